@@ -2,6 +2,8 @@ from flask import Flask
 from flask_cors import CORS
 from .config import Config
 from .firebase_auth import initialize_firebase
+from .metrics import init_metrics
+from .tracing import TRACE_HEADER, init_tracing
 
 
 def create_app(config_class: type = Config) -> Flask:
@@ -12,23 +14,32 @@ def create_app(config_class: type = Config) -> Flask:
         app,
         resources={r"/api/*": {"origins": "*"}},
         supports_credentials=True,
+        expose_headers=[TRACE_HEADER],
     )
 
     initialize_firebase()
+    init_metrics(app)
+    init_tracing(app)
 
     from .routes.auth import bp as auth_bp
     from .routes.uploads import bp as uploads_bp
     from .routes.forms import bp as forms_bp
     from .routes.analyze import bp as analyze_bp
     from .routes.chatbot import bp as chatbot_bp
+    from .routes.ai import bp as ai_bp
     from .routes.face_recognition import bp as face_bp
+    from .routes.face_stream import bp as face_stream_bp
+    from .routes.debug import bp as debug_bp
 
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(uploads_bp, url_prefix="/api/uploads")
     app.register_blueprint(forms_bp, url_prefix="/api/forms")
     app.register_blueprint(analyze_bp, url_prefix="/api")
     app.register_blueprint(chatbot_bp, url_prefix="/api")
+    app.register_blueprint(ai_bp, url_prefix="/api/ai")
     app.register_blueprint(face_bp, url_prefix="/api")
+    app.register_blueprint(face_stream_bp, url_prefix="/api")
+    app.register_blueprint(debug_bp, url_prefix="/api/debug")
 
     @app.get("/api/health")
     def health():
@@ -1,7 +1,26 @@
+import asyncio
+import hashlib
 import json
 import os
-from google import genai
+import threading
 from google.genai import types
+from .analysis_cache import analysis_cache, analysis_cache_key
+from .analysis_fields import (
+    ANALYSIS_FIELD_SPECS,
+    ANALYSIS_FIELDS,
+    analysis_from_batch_entry,
+    analysis_response_schema,
+    analysis_with_defaults,
+    batch_response_schema,
+    requested_fields,
+    select_fields,
+)
+from .chat_sessions import CHAT_SESSION_MAX_MESSAGES, chat_sessions
+from .gemini_client import AsyncSingleFlight, SingleFlight, gemini
+from .gemini_resilience import GeminiUnavailableError
+from .metrics import record_fallback, stage
+from .tracing import traced
+from .partial_json import parse_partial_json
 
 # IMPORTANT: KEEP THIS COMMENT
 # Follow these instructions when using this blueprint:
@@ -10,27 +29,27 @@ from google.genai import types
 
 # This API key is from Gemini Developer API Key, not vertex AI API Key
 # Try GEMINI_API_KEY first, fall back to GOOGLE_API_KEY
+# The client is shared per worker process; see gemini_client.GeminiClientManager
 def get_gemini_client():
-    """Get or create Gemini client instance"""
-    api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY or GOOGLE_API_KEY environment variable is required")
-    return genai.Client(api_key=api_key)
+    """Get the shared Gemini client instance"""
+    return gemini.client()
 
 
-def analyze_symptoms_with_ai(description, health_params, affected_regions):
-    """
-    Analyze symptoms using OpenAI's GPT-5 model.
-    
-    Args:
-        description: Patient's description of symptoms
-        health_params: Dictionary containing temperature, BP, heart rate, oxygen level
-        affected_regions: List of body regions marked as painful/affected
-    
-    Returns:
-        Dictionary containing AI-generated analysis with conditions, urgency, and summary
-    """
-    
+# Identical requests arriving while one is already waiting on Gemini share its response
+inflight_requests = SingleFlight()
+async_inflight_requests = AsyncSingleFlight()
+
+# Micro-batching of analyses: calls arriving within ANALYSIS_BATCH_WINDOW_MS of the first
+# are sent as one multi-patient prompt of up to ANALYSIS_BATCH_MAX patients. 0 turns it off
+ANALYSIS_BATCH_WINDOW_MS = float(os.environ.get('ANALYSIS_BATCH_WINDOW_MS', 0))
+ANALYSIS_BATCH_MAX = int(os.environ.get('ANALYSIS_BATCH_MAX', 8))
+
+
+ANALYSIS_SYSTEM_INSTRUCTION = "You are a knowledgeable medical AI assistant. Provide accurate, helpful preliminary health assessments while always emphasizing the importance of consulting healthcare professionals. Respond ONLY with valid JSON, no markdown formatting or code blocks."
+
+
+def patient_information(description, health_params, affected_regions):
+    """The prompt lines describing one patient's symptoms, regions and vital signs"""
     temperature = health_params.get("temperature")
     systolic_bp = health_params.get("systolicBP")
     diastolic_bp = health_params.get("diastolicBP")
@@ -50,156 +69,524 @@ def analyze_symptoms_with_ai(description, health_params, affected_regions):
     affected_regions_text = ", ".join(affected_regions) if affected_regions else "None specified"
     vital_signs_str = ", ".join(vital_signs_text) if vital_signs_text else "None provided"
     
-    prompt = f"""You are a medical AI assistant helping to analyze patient symptoms. Based on the information provided, generate a preliminary health assessment.
-
-Patient Information:
-- Symptom Description: {description if description else "Not provided"}
+    return f"""- Symptom Description: {description if description else "Not provided"}
 - Affected Body Regions: {affected_regions_text}
-- Vital Signs: {vital_signs_str}
-
-Please analyze this information and provide:
-1. Possible conditions (list of 2-4 potential diagnoses based on symptoms and vital signs)
-2. Urgency level (choose from: "Non-urgent - Self-care recommended", "Monitor closely - See doctor if worsens", "Seek medical attention within 24-48 hours", "Seek medical attention promptly within 24 hours", "Seek immediate medical attention - Emergency")
-3. Region-specific analysis (for each affected body region, provide brief analysis with possible causes)
-4. Symptom explanations (explain what each symptom might indicate)
-5. Possible solutions (actionable self-care recommendations and treatments for each condition)
-6. Related condition symptoms (what other symptoms might appear if the condition worsens or if it's a related problem)
-7. Doctor visit recommendation (clearly explain WHY and WHEN to see a doctor based on vital signs and symptoms)
-8. A comprehensive summary of the patient's condition
-
-IMPORTANT: Consider the vital signs carefully:
+- Vital Signs: {vital_signs_str}"""
+
+
+def requested_sections(fields):
+    return "\n".join(
+        f"{number}. {field}: {ANALYSIS_FIELD_SPECS[field]['instruction']}"
+        for number, field in enumerate(fields, 1)
+    )
+
+
+VITAL_SIGNS_GUIDANCE = """IMPORTANT: Consider the vital signs carefully:
 - Temperature >38°C (100.4°F) or <36°C (96.8°F) suggests fever or hypothermia
 - BP >140/90 is high, <90/60 is low
 - Heart rate >100 is high (tachycardia), <60 is low (bradycardia)
-- Oxygen <95% is concerning, <90% is critical
-
-Respond in JSON format with this structure:
-{{
-    "conditions": ["condition1", "condition2", "condition3"],
-    "urgency": "urgency level with specific timeframe",
-    "regionAnalysis": {{"region_name": "analysis with possible causes"}},
-    "symptomExplanations": ["symptom 1: what it indicates", "symptom 2: what it indicates"],
-    "possibleSolutions": ["self-care recommendation 1", "treatment option 2", "lifestyle modification 3"],
-    "relatedSymptoms": ["additional symptom to watch for 1", "potential complication symptom 2"],
-    "doctorRecommendation": {{
-        "shouldSeeDoctorFor": ["reason 1", "reason 2"],
-        "urgencyReason": "explanation based on vital signs and symptoms",
-        "redFlags": ["warning sign 1", "warning sign 2"]
-    }},
-    "summary": "comprehensive summary text explaining the condition and next steps"
-}}"""
-
-    response = None
-    try:
-        client = get_gemini_client()
-        system_instruction = "You are a knowledgeable medical AI assistant. Provide accurate, helpful preliminary health assessments while always emphasizing the importance of consulting healthcare professionals. Respond ONLY with valid JSON, no markdown formatting or code blocks."
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                types.Content(role="user", parts=[types.Part(text=prompt)])
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                response_mime_type="application/json"
-            )
+- Oxygen <95% is concerning, <90% is critical"""
+
+
+def build_analysis_prompt(description, health_params, affected_regions, fields=ANALYSIS_FIELDS):
+    """Symptom analysis prompt asking for the given fields (see analysis_fields)"""
+    return f"""You are a medical AI assistant helping to analyze patient symptoms. Based on the information provided, generate a preliminary health assessment.
+
+Patient Information:
+{patient_information(description, health_params, affected_regions)}
+
+Please analyze this information and provide only:
+{requested_sections(fields)}
+
+{VITAL_SIGNS_GUIDANCE}
+
+Respond with a JSON object holding exactly these fields, following the response schema."""
+
+
+def build_batch_analysis_prompt(patients, fields=ANALYSIS_FIELDS):
+    """
+    One prompt for several patients, each a (description, health_params,
+    affected_regions) tuple; the instructions and vital-sign guidance appear once.
+    """
+    patients_text = "\n\n".join(
+        f"Patient {number}:\n{patient_information(*patient)}"
+        for number, patient in enumerate(patients, 1)
+    )
+    return f"""You are a medical AI assistant helping to analyze patient symptoms. Assess each of the {len(patients)} patients below on their own and generate a preliminary health assessment for each.
+
+{patients_text}
+
+For each patient provide only:
+{requested_sections(fields)}
+
+{VITAL_SIGNS_GUIDANCE}
+
+Respond with a JSON array holding one object per patient, each with the patient's number in "patient" and exactly these fields, following the response schema."""
+
+
+def analysis_request(prompt, fields=ANALYSIS_FIELDS, affected_regions=None):
+    """generate_content arguments for an analysis prompt, constrained to the fields' schema"""
+    return {
+        "model": "gemini-2.5-flash",
+        "contents": [
+            types.Content(role="user", parts=[types.Part(text=prompt)])
+        ],
+        "config": types.GenerateContentConfig(
+            system_instruction=ANALYSIS_SYSTEM_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=analysis_response_schema(fields, affected_regions)
         )
-        
-        if not response.text:
-            raise ValueError("Empty response from Gemini")
-        
-        response_text = response.text.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
-        
-        result = json.loads(response_text)
-        
-        return {
-            "conditions": result.get("conditions", ["General health assessment needed"]),
-            "urgency": result.get("urgency", "Consult a healthcare professional"),
-            "regionAnalysis": result.get("regionAnalysis", {}),
-            "symptomExplanations": result.get("symptomExplanations", []),
-            "possibleSolutions": result.get("possibleSolutions", []),
-            "relatedSymptoms": result.get("relatedSymptoms", []),
-            "doctorRecommendation": result.get("doctorRecommendation", {
-                "shouldSeeDoctorFor": ["General health assessment"],
-                "urgencyReason": "Professional medical evaluation recommended",
-                "redFlags": []
-            }),
-            "summary": result.get("summary", "Please consult a healthcare professional for proper evaluation.")
-        }
-        
-    except json.JSONDecodeError as e:
-        print(f"AI Analysis JSON Error: {str(e)}")
+    }
+
+
+def analysis_text(call):
+    """
+    The text of the analysis answer `call()` returns. A truncated answer the SDK
+    could not parse comes back as a gemini_client.TruncatedResponse with the text
+    kept, which parse_analysis can still repair.
+    """
+    return call().text
+
+
+async def analysis_text_async(call):
+    return (await call()).text
+
+
+def parse_analysis(text, fields=ANALYSIS_FIELDS):
+    """
+    (analysis, complete) from the text of a Gemini answer. Markdown fences are
+    skipped and a truncated answer is repaired (complete is then False): the fields
+    it finished are kept and the others, including the one it stopped in, get their
+    defaults.
+    
+    Raises:
+        ValueError: on an empty answer or text with no JSON object to repair
+            (json.JSONDecodeError when the JSON itself is malformed)
+    """
+    if not text:
+        raise ValueError("Empty response from Gemini")
+    
+    result, complete = parse_partial_json(text)
+    if not isinstance(result, dict):
+        raise ValueError("Gemini answered with a JSON array instead of an object")
+    if not complete:
+        print(f"AI Analysis truncated after {len(text)} characters; kept {', '.join(result) or 'no fields'}")
+    
+    return analysis_with_defaults(result, fields), complete
+
+
+def batch_analysis_request(prompt, fields=ANALYSIS_FIELDS):
+    """generate_content arguments for a multi-patient analysis prompt"""
+    return {
+        "model": "gemini-2.5-flash",
+        "contents": [
+            types.Content(role="user", parts=[types.Part(text=prompt)])
+        ],
+        "config": types.GenerateContentConfig(
+            system_instruction=ANALYSIS_SYSTEM_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=batch_response_schema(fields)
+        )
+    }
+
+
+def split_batch_analysis(text, fields, count):
+    """
+    One analysis per patient from a multi-patient answer, None for each patient it
+    does not answer. In a truncated answer a patient whose entry was cut off counts
+    as unanswered; parse_partial_json only returns the entries that were closed.
+    """
+    if not text:
+        raise ValueError("Empty response from Gemini")
+    entries, _ = parse_partial_json(text)
+    if not isinstance(entries, list):
+        raise ValueError("Gemini answered a batch with a JSON object instead of an array")
+    analyses = [None] * count
+    for entry in entries:
+        number = entry.get("patient") if isinstance(entry, dict) else None
+        if isinstance(number, int) and 1 <= number <= count and analyses[number - 1] is None:
+            analyses[number - 1] = analysis_from_batch_entry(entry, fields)
+    return analyses
+
+
+def analysis_fallback(error):
+    """Logs a failed analysis and returns the placeholder result shown instead"""
+    record_fallback("analyze", "placeholder")
+    if isinstance(error, json.JSONDecodeError):
+        print(f"AI Analysis JSON Error: {str(error)}")
         try:
-            response_text_for_log = response.text if hasattr(response, 'text') else 'No response'
+            response_text_for_log = error.doc if error.doc else 'No response'
             print(f"Response was: {response_text_for_log}")
         except:
             print("Response was: Unable to retrieve response text")
+        see_doctor_for = "Unable to perform analysis"
+        summary = "Unable to parse AI analysis. Please consult a healthcare professional for evaluation."
+    else:
+        print(f"AI Analysis Error: {str(error)}")
+        see_doctor_for = "System error - manual assessment needed"
+        summary = "Unable to perform AI analysis. Please consult a healthcare professional for evaluation."
+    return {
+        "conditions": ["AI analysis unavailable - please consult a doctor"],
+        "urgency": "Consult a healthcare professional",
+        "regionAnalysis": {},
+        "symptomExplanations": [],
+        "possibleSolutions": [],
+        "relatedSymptoms": [],
+        "doctorRecommendation": {
+            "shouldSeeDoctorFor": [see_doctor_for],
+            "urgencyReason": "Please consult a healthcare professional for proper evaluation",
+            "redFlags": []
+        },
+        "summary": summary
+    }
+
+
+class _Batched:
+    def __init__(self, payload, done):
+        self.payload = payload
+        # threading.Event, or asyncio.Event in AsyncMicroBatcher
+        self.done = done
+        self.result = None
+        self.error = None
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+        self.timer = None
+
+
+class MicroBatcher:
+    """
+    Gathers calls that arrive within `window` seconds of a batch's first call into
+    one batch of at most `max_size`, and sends it with send_batch(key, payloads).
+    send_batch returns one result per payload, None for those it could not answer;
+    an exception it raises is raised to every caller. Calls are only batched with
+    calls of the same key.
+
+    The first caller of a batch waits out the window (or until the batch is full)
+    and sends it; the others block until it has. A batch of one is not sent: its
+    caller gets None and makes its usual call, as do the unanswered ones.
+    """
+
+    def __init__(self, send_batch, window=ANALYSIS_BATCH_WINDOW_MS / 1000, max_size=ANALYSIS_BATCH_MAX):
+        self.send_batch = send_batch
+        self.window = window
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._open = {}
+        self.counters = {'batches': 0, 'batchedCalls': 0, 'answered': 0, 'unanswered': 0, 'alone': 0, 'errors': 0}
+
+    @property
+    def enabled(self):
+        return self.window > 0 and self.max_size > 1
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _join(self, key, item):
+        """Adds the item to the key's open batch; returns (batch, leader, full)"""
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            batch.items.append(item)
+            full = len(batch.items) >= self.max_size
+            if full:
+                del self._open[key]
+            return batch, leader, full
+
+    def _close(self, key, batch):
+        with self._lock:
+            if self._open.get(key) is batch:
+                del self._open[key]
+
+    def _deliver(self, items, results):
+        if isinstance(results, Exception):
+            self._count('errors')
+            for item in items:
+                item.error = results
+        else:
+            answered = sum(result is not None for result in results)
+            self._count('answered', answered)
+            self._count('unanswered', len(items) - answered)
+            for item, result in zip(items, results):
+                item.result = result
+        for item in items:
+            item.done.set()
+
+    def _sending(self, items):
+        """False for a batch of one, which its caller sends alone"""
+        if len(items) == 1:
+            self._count('alone')
+            items[0].done.set()
+            return False
+        self._count('batches')
+        self._count('batchedCalls', len(items))
+        return True
+
+    def submit(self, key, payload):
+        """The batch's result for payload, or None when the caller should call alone"""
+        item = _Batched(payload, threading.Event())
+        batch, leader, full = self._join(key, item)
+        if full:
+            batch.full.set()
+        if leader:
+            batch.full.wait(self.window)
+            self._close(key, batch)
+            if self._sending(batch.items):
+                try:
+                    results = self.send_batch(key, [batched.payload for batched in batch.items])
+                except Exception as e:
+                    results = e
+                self._deliver(batch.items, results)
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self.counters)
         return {
-            "conditions": ["AI analysis unavailable - please consult a doctor"],
-            "urgency": "Consult a healthcare professional",
-            "regionAnalysis": {},
-            "symptomExplanations": [],
-            "possibleSolutions": [],
-            "relatedSymptoms": [],
-            "doctorRecommendation": {
-                "shouldSeeDoctorFor": ["Unable to perform analysis"],
-                "urgencyReason": "Please consult a healthcare professional for proper evaluation",
-                "redFlags": []
-            },
-            "summary": "Unable to parse AI analysis. Please consult a healthcare professional for evaluation."
+            'enabled': self.enabled,
+            'windowMs': round(self.window * 1000, 3),
+            'maxSize': self.max_size,
+            **counters,
+            'avgBatchSize': round(counters['batchedCalls'] / counters['batches'], 2) if counters['batches'] else None,
         }
+
+
+class AsyncMicroBatcher(MicroBatcher):
+    """
+    MicroBatcher for coroutines on one event loop. A timer sends each batch as its
+    own task, so a caller that goes away does not strand the rest of its batch.
+    """
+
+    def __init__(self, send_batch, window=ANALYSIS_BATCH_WINDOW_MS / 1000, max_size=ANALYSIS_BATCH_MAX):
+        super().__init__(send_batch, window, max_size)
+        self._tasks = set()
+
+    async def submit(self, key, payload):
+        item = _Batched(payload, asyncio.Event())
+        batch, leader, full = self._join(key, item)
+        if leader and not full:
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key, batch)
+        if full:
+            if batch.timer is not None:
+                batch.timer.cancel()
+            self._flush(key, batch)
+        await item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _flush(self, key, batch):
+        self._close(key, batch)
+        if self._sending(batch.items):
+            task = asyncio.get_running_loop().create_task(self._send(key, batch.items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key, items):
+        try:
+            results = await self.send_batch(key, [item.payload for item in items])
+        except Exception as e:
+            results = e
+        self._deliver(items, results)
+
+
+def send_analysis_batch(fields, patients):
+    """
+    MicroBatcher.send_batch for analyses: one model call for several patients.
+    Returns None for every patient when the answer cannot be used, so each is
+    analyzed alone; GeminiUnavailableError reaches every caller.
+    """
+    with stage("analyze_batch", "prompt_build"):
+        prompt = build_batch_analysis_prompt(patients, fields)
+    try:
+        with stage("analyze_batch", "gemini_call"):
+            text = analysis_text(
+                lambda: gemini.generate_content("analyze_batch", **batch_analysis_request(prompt, fields))
+            )
+        with stage("analyze_batch", "parse"):
+            return split_batch_analysis(text, fields, len(patients))
+    except GeminiUnavailableError:
+        raise
     except Exception as e:
-        print(f"AI Analysis Error: {str(e)}")
-        return {
-            "conditions": ["AI analysis unavailable - please consult a doctor"],
-            "urgency": "Consult a healthcare professional",
-            "regionAnalysis": {},
-            "symptomExplanations": [],
-            "possibleSolutions": [],
-            "relatedSymptoms": [],
-            "doctorRecommendation": {
-                "shouldSeeDoctorFor": ["System error - manual assessment needed"],
-                "urgencyReason": "Please consult a healthcare professional for proper evaluation",
-                "redFlags": []
-            },
-            "summary": f"Unable to perform AI analysis. Please consult a healthcare professional for evaluation."
-        }
+        print(f"AI batch analysis error, analyzing {len(patients)} patients one by one: {str(e)}")
+        return [None] * len(patients)
 
 
-def chatbot_response(user_message, affected_regions=None, conversation_history=None):
+async def send_analysis_batch_async(fields, patients):
+    with stage("analyze_batch", "prompt_build"):
+        prompt = build_batch_analysis_prompt(patients, fields)
+    try:
+        with stage("analyze_batch", "gemini_call"):
+            text = await analysis_text_async(
+                lambda: gemini.agenerate_content("analyze_batch", **batch_analysis_request(prompt, fields))
+            )
+        with stage("analyze_batch", "parse"):
+            return split_batch_analysis(text, fields, len(patients))
+    except GeminiUnavailableError:
+        raise
+    except Exception as e:
+        print(f"AI batch analysis error, analyzing {len(patients)} patients one by one: {str(e)}")
+        return [None] * len(patients)
+
+
+# Analyses that miss the cache within a few milliseconds of each other share one model call
+analysis_batcher = MicroBatcher(send_analysis_batch)
+async_analysis_batcher = AsyncMicroBatcher(send_analysis_batch_async)
+
+
+def request_analysis(description, health_params, affected_regions, fields, model_fields):
+    """(analysis, complete) from the model, batched with other patients when batching is on"""
+    if analysis_batcher.enabled:
+        analysis = analysis_batcher.submit(fields, (description, health_params, affected_regions))
+        if analysis is not None:
+            return analysis, True
+    with stage("analyze", "prompt_build"):
+        prompt = build_analysis_prompt(description, health_params, affected_regions, model_fields)
+    with stage("analyze", "gemini_call"):
+        text = analysis_text(
+            lambda: gemini.generate_content("analyze", **analysis_request(prompt, model_fields, affected_regions))
+        )
+    with stage("analyze", "parse"):
+        return parse_analysis(text, fields)
+
+
+async def request_analysis_async(description, health_params, affected_regions, fields, model_fields):
+    if async_analysis_batcher.enabled:
+        analysis = await async_analysis_batcher.submit(fields, (description, health_params, affected_regions))
+        if analysis is not None:
+            return analysis, True
+    with stage("analyze", "prompt_build"):
+        prompt = build_analysis_prompt(description, health_params, affected_regions, model_fields)
+    with stage("analyze", "gemini_call"):
+        text = await analysis_text_async(
+            lambda: gemini.agenerate_content("analyze", **analysis_request(prompt, model_fields, affected_regions))
+        )
+    with stage("analyze", "parse"):
+        return parse_analysis(text, fields)
+
+
+@traced("ai.cache_lookup")
+def cached_analysis(description, health_params, affected_regions, fields):
     """
-    Generate chatbot response for health-related questions.
+    (cache_key, cached analysis or None); a request for some of the fields is also
+    answered from a cached analysis with all of them.
+    """
+    cache_key = analysis_cache_key(description, health_params, affected_regions, model="gemini-2.5-flash", fields=fields)
+    cached = analysis_cache.get(cache_key)
+    if cached is None and fields != ANALYSIS_FIELDS:
+        cached = analysis_cache.get(analysis_cache_key(description, health_params, affected_regions, model="gemini-2.5-flash"))
+    return cache_key, (select_fields(cached, fields) if cached is not None else None)
+
+
+@traced("ai.analyze")
+def analyze_symptoms_with_ai(description, health_params, affected_regions, fields=ANALYSIS_FIELDS):
+    """
+    Analyze symptoms using OpenAI's GPT-5 model.
     
     Args:
-        user_message: User's question or message
-        affected_regions: List of body regions marked as painful/affected (optional)
-        conversation_history: Previous messages in the conversation (optional)
+        description: Patient's description of symptoms
+        health_params: Dictionary containing temperature, BP, heart rate, oxygen level
+        affected_regions: List of body regions marked as painful/affected
+        fields: Analysis fields to ask for (analysis_fields.ANALYSIS_FIELDS); fewer
+            fields mean a shorter prompt and answer
     
     Returns:
-        String containing the AI chatbot response
+        Dictionary containing AI-generated analysis with the requested fields
+    
+    Raises:
+        GeminiUnavailableError: when the model cannot answer in time; callers fall back
+            to the rule-based simple_analyze
     """
     
+    # Only complete model results are cached; repaired and fallback ones are not
+    cache_key, cached = cached_analysis(description, health_params, affected_regions, fields)
+    if cached is not None:
+        return cached
+
+    model_fields = requested_fields(fields, affected_regions)
+    if not model_fields:
+        return analysis_with_defaults({}, fields)
+    try:
+        analysis, complete = inflight_requests.do(
+            "analyze", cache_key,
+            lambda: request_analysis(description, health_params, affected_regions, fields, model_fields)
+        )
+        if complete:
+            analysis_cache.set(cache_key, analysis)
+        return analysis
+    except GeminiUnavailableError:
+        # Breaker open, deadline passed or upstream down: the route answers from simple_analyze
+        raise
+    except Exception as e:
+        return select_fields(analysis_fallback(e), fields)
+
+
+@traced("ai.analyze")
+async def analyze_symptoms_with_ai_async(description, health_params, affected_regions, fields=ANALYSIS_FIELDS):
+    """analyze_symptoms_with_ai for the ASGI app: awaits Gemini instead of holding a thread"""
+    cache_key, cached = cached_analysis(description, health_params, affected_regions, fields)
+    if cached is not None:
+        return cached
+
+    model_fields = requested_fields(fields, affected_regions)
+    if not model_fields:
+        return analysis_with_defaults({}, fields)
+    try:
+        analysis, complete = await async_inflight_requests.do(
+            "analyze", cache_key,
+            lambda: request_analysis_async(description, health_params, affected_regions, fields, model_fields)
+        )
+        if complete:
+            analysis_cache.set(cache_key, analysis)
+        return analysis
+    except GeminiUnavailableError:
+        # Breaker open, deadline passed or upstream down: the route answers from simple_analyze
+        raise
+    except Exception as e:
+        return select_fields(analysis_fallback(e), fields)
+
+
+CHATBOT_SYSTEM_INSTRUCTION = """You are a compassionate medical AI chatbot. Give VERY SHORT responses using 1-3 bullet points (• symbol). Each bullet should be 1-2 sentences max. Be helpful but concise. Always recommend consulting healthcare professionals for serious concerns."""
+
+# Length cap for the rolling summary of a chat session's older turns
+CHAT_SUMMARY_MAX_WORDS = 150
+
+CHATBOT_FALLBACK_MESSAGE = "I'm having trouble processing your request right now. Please try again or consult with a healthcare professional for medical advice."
+
+
+def build_chatbot_prompt(user_message, affected_regions=None, conversation_history=None, conversation_summary=None):
+    """
+    Chatbot prompt with the marked regions and the last few conversation turns.
+
+    Stateless clients send their own history, of which the last 6 messages are used.
+    Server-side sessions pass conversation_summary (empty until the first compaction)
+    and every message not yet folded into it.
+    """
     affected_regions_text = ""
     if affected_regions and len(affected_regions) > 0:
         affected_regions_text = f"\n\nContext: The user has marked the following body areas: {', '.join(affected_regions)}"
     
     conversation_context = ""
+    if conversation_summary:
+        conversation_context = f"\n\nSummary of the earlier conversation: {conversation_summary}"
     if conversation_history and len(conversation_history) > 0:
-        recent_history = conversation_history[-6:]
-        conversation_context = "\n\nPrevious conversation:\n"
+        recent_history = conversation_history[-CHAT_SESSION_MAX_MESSAGES:] if conversation_summary is not None else conversation_history[-6:]
+        conversation_context += "\n\nPrevious conversation:\n"
         for msg in recent_history:
             role = msg.get("role", "user")
             content = msg.get("content", "")
             conversation_context += f"{role.capitalize()}: {content}\n"
     
-    prompt = f"""You are a helpful medical AI assistant chatbot for DigitalVaidya, an AI symptom analysis tool.
+    return f"""You are a helpful medical AI assistant chatbot for DigitalVaidya, an AI symptom analysis tool.
 
 User's message: {user_message}{affected_regions_text}{conversation_context}
 
@@ -214,19 +601,84 @@ Important guidelines:
 
 Provide a helpful response in bullet point format."""
 
+
+def chatbot_request(prompt):
+    """generate_content arguments for a chatbot prompt"""
+    return {
+        "model": "gemini-2.5-flash",
+        "contents": [
+            types.Content(role="user", parts=[types.Part(text=prompt)])
+        ],
+        "config": types.GenerateContentConfig(
+            system_instruction=CHATBOT_SYSTEM_INSTRUCTION,
+            temperature=0.7
+        )
+    }
+
+
+@traced("ai.chatbot")
+def chatbot_response(user_message, affected_regions=None, conversation_history=None, conversation_summary=None):
+    """
+    Generate chatbot response for health-related questions.
+    
+    Args:
+        user_message: User's question or message
+        affected_regions: List of body regions marked as painful/affected (optional)
+        conversation_history: Previous messages in the conversation (optional)
+        conversation_summary: Summary of turns older than conversation_history (optional)
+    
+    Returns:
+        String containing the AI chatbot response
+    """
+    
+    prompt = build_chatbot_prompt(user_message, affected_regions, conversation_history, conversation_summary)
+
     try:
-        client = get_gemini_client()
-        system_instruction = """You are a compassionate medical AI chatbot. Give VERY SHORT responses using 1-3 bullet points (• symbol). Each bullet should be 1-2 sentences max. Be helpful but concise. Always recommend consulting healthcare professionals for serious concerns."""
+        # The prompt holds the message, regions and recent history, so it is the key
+        chat_key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        response = inflight_requests.do(
+            "chatbot", chat_key, lambda: gemini.generate_content("chatbot", **chatbot_request(prompt))
+        )
         
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                types.Content(role="user", parts=[types.Part(text=prompt)])
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                temperature=0.7
-            )
+        if not response.text:
+            raise ValueError("Empty response from Gemini")
+        
+        return response.text.strip()
+        
+    except Exception as e:
+        print(f"Chatbot Error: {str(e)}")
+        record_fallback("chatbot", "message")
+        return CHATBOT_FALLBACK_MESSAGE
+
+
+def chatbot_response_stream(user_message, affected_regions=None, conversation_history=None, conversation_summary=None):
+    """
+    Stream the chatbot response as it is generated.
+    
+    Yields:
+        Text fragments in order; errors are raised to the caller, which decides how
+        to report them since part of the answer may already have been sent
+    """
+    prompt = build_chatbot_prompt(user_message, affected_regions, conversation_history, conversation_summary)
+    produced = False
+    for chunk in gemini.generate_content_stream("chatbot_stream", **chatbot_request(prompt)):
+        text = chunk.text
+        if text:
+            produced = True
+            yield text
+    if not produced:
+        raise ValueError("Empty response from Gemini")
+
+
+@traced("ai.chatbot")
+async def chatbot_response_async(user_message, affected_regions=None, conversation_history=None, conversation_summary=None):
+    """chatbot_response for the ASGI app"""
+    prompt = build_chatbot_prompt(user_message, affected_regions, conversation_history, conversation_summary)
+
+    try:
+        chat_key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        response = await async_inflight_requests.do(
+            "chatbot", chat_key, lambda: gemini.agenerate_content("chatbot", **chatbot_request(prompt))
         )
         
         if not response.text:
@@ -236,9 +688,102 @@ Provide a helpful response in bullet point format."""
         
     except Exception as e:
         print(f"Chatbot Error: {str(e)}")
-        return "I'm having trouble processing your request right now. Please try again or consult with a healthcare professional for medical advice."
+        record_fallback("chatbot", "message")
+        return CHATBOT_FALLBACK_MESSAGE
+
+
+async def chatbot_response_stream_async(user_message, affected_regions=None, conversation_history=None, conversation_summary=None):
+    """chatbot_response_stream for the ASGI app"""
+    prompt = build_chatbot_prompt(user_message, affected_regions, conversation_history, conversation_summary)
+    produced = False
+    async for chunk in gemini.agenerate_content_stream("chatbot_stream", **chatbot_request(prompt)):
+        text = chunk.text
+        if text:
+            produced = True
+            yield text
+    if not produced:
+        raise ValueError("Empty response from Gemini")
+
+
+CHAT_SUMMARY_SYSTEM_INSTRUCTION = "You condense medical chat conversations into brief factual notes for the assistant's own memory. Plain prose, no bullet points."
+
+
+def build_chat_summary_prompt(summary, messages):
+    """Prompt folding older messages into the session's running summary"""
+    transcript = "\n".join(f"{msg.get('role', 'user').capitalize()}: {msg.get('content', '')}" for msg in messages)
+    previous = f"Summary so far: {summary}\n\n" if summary else ""
+    return f"""{previous}Conversation to add:
+{transcript}
+
+Write an updated summary of the whole conversation in at most {CHAT_SUMMARY_MAX_WORDS} words. Keep the user's symptoms, their timing and severity, vital signs, relevant history, advice already given and open questions. Leave out greetings and small talk."""
+
+
+def chat_summary_request(prompt):
+    """generate_content arguments for a conversation summary prompt"""
+    return {
+        "model": "gemini-2.5-flash",
+        "contents": [
+            types.Content(role="user", parts=[types.Part(text=prompt)])
+        ],
+        "config": types.GenerateContentConfig(
+            system_instruction=CHAT_SUMMARY_SYSTEM_INSTRUCTION,
+            temperature=0.2
+        )
+    }
+
+
+def record_chat_turn(session_id, user_message, reply):
+    """Saves an exchange to the session; folds older turns into its summary in the background when due"""
+    if chat_sessions.append_turn(session_id, user_message, reply):
+        threading.Thread(target=compact_chat_session, args=(session_id,), daemon=True).start()
+
+
+def compact_chat_session(session_id):
+    """Replaces all but the latest messages with an updated rolling summary"""
+    job = chat_sessions.start_compaction(session_id)
+    if job is None:
+        return
+    summary, folded = job
+    try:
+        response = gemini.generate_content("chat_summary", **chat_summary_request(build_chat_summary_prompt(summary, folded)))
+        if not response.text:
+            raise ValueError("Empty response from Gemini")
+        chat_sessions.finish_compaction(session_id, folded, response.text.strip())
+    except Exception as e:
+        print(f"Chat summary error: {str(e)}")
+        chat_sessions.abort_compaction(session_id)
+
+
+# Compaction tasks started by the ASGI app; referenced so they are not collected mid-run
+_compaction_tasks = set()
+
+
+def record_chat_turn_async(session_id, user_message, reply):
+    """record_chat_turn for the ASGI app: compaction runs as a task on the event loop"""
+    if chat_sessions.append_turn(session_id, user_message, reply):
+        task = asyncio.get_running_loop().create_task(compact_chat_session_async(session_id))
+        _compaction_tasks.add(task)
+        task.add_done_callback(_compaction_tasks.discard)
+
+
+async def compact_chat_session_async(session_id):
+    job = chat_sessions.start_compaction(session_id)
+    if job is None:
+        return
+    summary, folded = job
+    try:
+        response = await gemini.agenerate_content(
+            "chat_summary", **chat_summary_request(build_chat_summary_prompt(summary, folded))
+        )
+        if not response.text:
+            raise ValueError("Empty response from Gemini")
+        chat_sessions.finish_compaction(session_id, folded, response.text.strip())
+    except Exception as e:
+        print(f"Chat summary error: {str(e)}")
+        chat_sessions.abort_compaction(session_id)
 
 
+@traced("ai.health_summary")
 def generate_health_summary(description, affected_regions, health_params):
     """
     Generate a comprehensive health summary report based on symptoms, affected body regions, and health parameters.
@@ -287,10 +832,10 @@ Generate a detailed, professional health summary report that includes:
 Format the report in clear sections with bullet points for readability. Be professional, thorough, and empathetic."""
 
     try:
-        client = get_gemini_client()
         system_instruction = """You are a medical AI assistant creating professional health summary reports. Generate comprehensive, well-structured reports with clear sections and bullet points. Be thorough yet concise. Always emphasize the importance of professional medical consultation."""
         
-        response = client.models.generate_content(
+        response = gemini.generate_content(
+            "summary",
             model="gemini-2.5-flash",
             contents=[
                 types.Content(role="user", parts=[types.Part(text=prompt)])
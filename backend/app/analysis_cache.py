@@ -0,0 +1,273 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .analysis_fields import ANALYSIS_FIELDS
+from .metrics import analysis_cache_lookups
+from .pdf_service import get_bp_status, get_hr_status, get_o2_status, get_temp_status
+
+# Entries expire after this many seconds; 0 disables the cache
+ANALYSIS_CACHE_TTL = float(os.environ.get('ANALYSIS_CACHE_TTL', 3600))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 1024))
+# SQLite file shared by all workers on the host; unset keeps the cache per process
+ANALYSIS_CACHE_DB = os.environ.get('ANALYSIS_CACHE_DB')
+ANALYSIS_CACHE_DB_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_DB_MAX_ENTRIES', 20000))
+
+# Bump when the prompt or the result shape changes so old entries stop matching
+ANALYSIS_CACHE_VERSION = 2
+
+
+def vital_band(status_fn, *values):
+    """The pdf_service status band of a vital, or the raw text when it is not a number"""
+    try:
+        return status_fn(*values)
+    except (TypeError, ValueError):
+        return f"invalid:{values}"
+
+
+def canonical_analysis_input(description, health_params, affected_regions, model='', fields=None):
+    """
+    Inputs reduced to what the analysis should depend on: the description with case
+    and whitespace folded, the set of regions, and each vital as the band the health
+    report classifies it into (so 37.2 and 37.3°C share an entry). `fields` is the
+    tuple of analysis fields asked for (None for all of them).
+    """
+    health_params = health_params or {}
+    return {
+        'v': ANALYSIS_CACHE_VERSION,
+        'model': model,
+        'fields': sorted(fields) if fields and tuple(fields) != ANALYSIS_FIELDS else None,
+        'description': ' '.join((description or '').split()).lower(),
+        'regions': sorted({str(region).strip().lower() for region in affected_regions or [] if str(region).strip()}),
+        'vitals': {
+            'temperature': vital_band(get_temp_status, health_params.get('temperature')),
+            'bloodPressure': vital_band(get_bp_status, health_params.get('systolicBP'), health_params.get('diastolicBP')),
+            'heartRate': vital_band(get_hr_status, health_params.get('heartRate')),
+            'oxygen': vital_band(get_o2_status, health_params.get('oxygenLevel')),
+        },
+    }
+
+
+def analysis_cache_key(description, health_params, affected_regions, model='', fields=None):
+    canonical = canonical_analysis_input(description, health_params, affected_regions, model, fields)
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LocalCache:
+    """In-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, ttl=ANALYSIS_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires=None):
+        with self._lock:
+            self._entries[key] = (expires or time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache:
+    """
+    LRU with TTL in a SQLite file, shared by every worker process on the host.
+
+    Each thread opens its own connection (and a forked worker opens new ones).
+    WAL mode lets readers proceed while another worker writes; eviction runs only
+    every `prune_every` writes to keep the write path to a single upsert.
+    `table` lets other stores (e.g. chat sessions) keep their entries in the same file.
+    """
+
+    def __init__(self, path, max_entries=ANALYSIS_CACHE_DB_MAX_ENTRIES, ttl=ANALYSIS_CACHE_TTL, prune_every=64,
+                 table='analysis_cache'):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """Returns (value, expires) or None"""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(f'SELECT value, expires FROM {self.table} WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+            return None
+        conn.execute(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            f'INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), now + self.ttl, now),
+        )
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        conn = self._connect()
+        conn.execute(f'DELETE FROM {self.table} WHERE expires <= ?', (time.time(),))
+        conn.execute(
+            f'DELETE FROM {self.table} WHERE key IN ('
+            f'SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        self._connect().execute(f'DELETE FROM {self.table}')
+
+    def __len__(self):
+        return self._connect().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+
+class AnalysisCache:
+    """
+    Two-tier cache of successful symptom analyses: an in-process LRU in front of an
+    optional SQLite tier. Shared hits are copied into the local tier with their
+    remaining TTL. Values are deep-copied in and out so callers can modify results.
+    """
+
+    def __init__(self, local=None, shared=None):
+        self.local = local
+        self.shared = shared
+        self._lock = threading.Lock()
+        self.counters = {'localHits': 0, 'sharedHits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+
+    @property
+    def enabled(self):
+        return self.local is not None or self.shared is not None
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                self._count('localHits')
+                analysis_cache_lookups.labels('local_hit').inc()
+                return copy.deepcopy(value)
+        if self.shared is not None:
+            try:
+                found = self.shared.get(key)
+            except sqlite3.Error as e:
+                print(f"Analysis cache read error: {str(e)}")
+                self._count('errors')
+                found = None
+            if found is not None:
+                value, expires = found
+                if self.local is not None:
+                    self.local.set(key, value, expires)
+                self._count('sharedHits')
+                analysis_cache_lookups.labels('shared_hit').inc()
+                return copy.deepcopy(value)
+        self._count('misses')
+        analysis_cache_lookups.labels('miss').inc()
+        return None
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        value = copy.deepcopy(value)
+        if self.local is not None:
+            self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except sqlite3.Error as e:
+                print(f"Analysis cache write error: {str(e)}")
+                self._count('errors')
+        self._count('stores')
+
+    def clear(self):
+        if self.local is not None:
+            self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['localHits'] + counters['sharedHits'] + counters['misses']
+        return {
+            'enabled': self.enabled,
+            **counters,
+            'hitRate': round((counters['localHits'] + counters['sharedHits']) / lookups, 4) if lookups else None,
+            'localEntries': len(self.local) if self.local is not None else None,
+            'localEvictions': self.local.evictions if self.local is not None else None,
+            'sharedPath': self.shared.path if self.shared is not None else None,
+        }
+
+
+def create_analysis_cache():
+    if ANALYSIS_CACHE_TTL <= 0:
+        return AnalysisCache()
+    local = LocalCache() if ANALYSIS_CACHE_MAX_ENTRIES > 0 else None
+    shared = None
+    if ANALYSIS_CACHE_DB:
+        try:
+            shared = SqliteCache(ANALYSIS_CACHE_DB)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Analysis cache database unavailable, using the local cache only: {str(e)}")
+    return AnalysisCache(local, shared)
+
+
+analysis_cache = create_analysis_cache()
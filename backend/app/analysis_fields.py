@@ -0,0 +1,166 @@
+# Urgency levels the model chooses from, least to most urgent
+ANALYSIS_URGENCY_LEVELS = [
+    "Non-urgent - Self-care recommended",
+    "Monitor closely - See doctor if worsens",
+    "Seek medical attention within 24-48 hours",
+    "Seek medical attention promptly within 24 hours",
+    "Seek immediate medical attention - Emergency",
+]
+
+
+def _string_list():
+    return {"type": "ARRAY", "items": {"type": "STRING"}}
+
+
+# Every section an analysis can have, in prompt and response order: what the prompt
+# asks for, the response schema, and the value used when the model leaves it out
+ANALYSIS_FIELD_SPECS = {
+    "conditions": {
+        "instruction": "Possible conditions (list of 2-4 potential diagnoses based on symptoms and vital signs)",
+        "schema": lambda regions: _string_list(),
+        "default": ["General health assessment needed"],
+    },
+    "urgency": {
+        "instruction": "Urgency level (choose the one that fits the symptoms and vital signs)",
+        "schema": lambda regions: {"type": "STRING", "enum": ANALYSIS_URGENCY_LEVELS},
+        "choices": ANALYSIS_URGENCY_LEVELS,
+        "default": "Consult a healthcare professional",
+    },
+    "regionAnalysis": {
+        "instruction": "Region-specific analysis (for each affected body region, provide brief analysis with possible causes)",
+        "schema": lambda regions: {
+            "type": "OBJECT",
+            "properties": {region: {"type": "STRING"} for region in regions},
+            "required": list(regions),
+        },
+        "default": {},
+    },
+    "symptomExplanations": {
+        "instruction": "Symptom explanations (explain what each symptom might indicate, as \"symptom: what it indicates\")",
+        "schema": lambda regions: _string_list(),
+        "default": [],
+    },
+    "possibleSolutions": {
+        "instruction": "Possible solutions (actionable self-care recommendations and treatments for each condition)",
+        "schema": lambda regions: _string_list(),
+        "default": [],
+    },
+    "relatedSymptoms": {
+        "instruction": "Related condition symptoms (what other symptoms might appear if the condition worsens or if it's a related problem)",
+        "schema": lambda regions: _string_list(),
+        "default": [],
+    },
+    "doctorRecommendation": {
+        "instruction": "Doctor visit recommendation (clearly explain WHY and WHEN to see a doctor based on vital signs and symptoms, and the red flags to watch for)",
+        "schema": lambda regions: {
+            "type": "OBJECT",
+            "properties": {
+                "shouldSeeDoctorFor": _string_list(),
+                "urgencyReason": {"type": "STRING"},
+                "redFlags": _string_list(),
+            },
+            "required": ["shouldSeeDoctorFor", "urgencyReason", "redFlags"],
+        },
+        "default": {
+            "shouldSeeDoctorFor": ["General health assessment"],
+            "urgencyReason": "Professional medical evaluation recommended",
+            "redFlags": []
+        },
+    },
+    "summary": {
+        "instruction": "A comprehensive summary of the patient's condition and next steps",
+        "schema": lambda regions: {"type": "STRING"},
+        "default": "Please consult a healthcare professional for proper evaluation.",
+    },
+}
+ANALYSIS_FIELDS = tuple(ANALYSIS_FIELD_SPECS)
+
+
+def parse_fields(value):
+    """
+    The analysis fields a request selects, in canonical order: a list or a
+    comma-separated string of field names; empty, None or "all" selects every field.
+
+    Raises:
+        ValueError: naming the fields that do not exist
+    """
+    if value is None or value == "" or value == "all":
+        return ANALYSIS_FIELDS
+    names = value.split(",") if isinstance(value, str) else value
+    if not isinstance(names, (list, tuple)):
+        raise ValueError("fields must be a list or a comma-separated string")
+    selected = {str(name).strip() for name in names if str(name).strip()}
+    unknown = sorted(selected - set(ANALYSIS_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown analysis fields: {', '.join(unknown)}; choose from {', '.join(ANALYSIS_FIELDS)}")
+    return tuple(field for field in ANALYSIS_FIELDS if field in selected) or ANALYSIS_FIELDS
+
+
+def requested_fields(fields, affected_regions):
+    """The fields to ask the model for; region analysis only when regions were marked"""
+    return tuple(field for field in fields if field != "regionAnalysis" or affected_regions)
+
+
+def analysis_response_schema(fields, affected_regions):
+    """Response schema (a google.genai SchemaDict) for an analysis with exactly these fields"""
+    regions = list(dict.fromkeys(str(region) for region in affected_regions or []))
+    return {
+        "type": "OBJECT",
+        "properties": {field: ANALYSIS_FIELD_SPECS[field]["schema"](regions) for field in fields},
+        "required": list(fields),
+    }
+
+
+def analysis_field(result, field):
+    """One field of a parsed model answer; the default when it is missing or not one of its choices"""
+    spec = ANALYSIS_FIELD_SPECS[field]
+    if field not in result or ("choices" in spec and result[field] not in spec["choices"]):
+        return spec["default"]
+    return result[field]
+
+
+def analysis_with_defaults(result, fields):
+    """`fields` of a parsed model answer, each defaulted when the model left it out or gave an invalid choice"""
+    return {field: analysis_field(result, field) for field in fields}
+
+
+def select_fields(analysis, fields):
+    """The analysis with only the `fields` it has"""
+    return {field: analysis[field] for field in fields if field in analysis}
+
+
+def batch_response_schema(fields):
+    """
+    Response schema for a multi-patient analysis: an array with one object per
+    patient, numbered in `patient`. regionAnalysis becomes a list of
+    {region, analysis} pairs since each patient marks different regions.
+    """
+    properties = {"patient": {"type": "INTEGER"}}
+    for field in fields:
+        if field == "regionAnalysis":
+            properties[field] = {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {"region": {"type": "STRING"}, "analysis": {"type": "STRING"}},
+                    "required": ["region", "analysis"],
+                },
+            }
+        else:
+            properties[field] = ANALYSIS_FIELD_SPECS[field]["schema"]([])
+    return {
+        "type": "ARRAY",
+        "items": {"type": "OBJECT", "properties": properties, "required": ["patient", *fields]},
+    }
+
+
+def analysis_from_batch_entry(entry, fields):
+    """One patient's analysis from a multi-patient answer, shaped like a single analysis"""
+    entry = dict(entry)
+    regions = entry.get("regionAnalysis")
+    if isinstance(regions, list):
+        entry["regionAnalysis"] = {
+            pair["region"]: pair.get("analysis", "")
+            for pair in regions if isinstance(pair, dict) and pair.get("region")
+        }
+    return analysis_with_defaults(entry, fields)
@@ -0,0 +1,127 @@
+import copy
+import os
+import secrets
+import sqlite3
+import threading
+
+from .analysis_cache import LocalCache, SqliteCache, analysis_cache_key
+
+# Seconds an /api/analyze result stays available to /api/generate-summary
+ANALYSIS_RESULT_TTL = float(os.environ.get('ANALYSIS_RESULT_TTL', 3600))
+ANALYSIS_RESULT_MAX_ENTRIES = int(os.environ.get('ANALYSIS_RESULT_MAX_ENTRIES', 1024))
+# SQLite file shared by all workers on the host; unset keeps results per process
+ANALYSIS_RESULT_DB = os.environ.get('ANALYSIS_RESULT_DB')
+ANALYSIS_RESULT_DB_MAX_ENTRIES = int(os.environ.get('ANALYSIS_RESULT_DB_MAX_ENTRIES', 20000))
+
+
+class AnalysisResultStore:
+    """
+    Analyses served by /api/analyze, kept under an opaque analysisId so the PDF
+    report for the same inputs is rendered from them instead of asking the model
+    again. Each entry records its inputs, their analysis_cache_key and the user
+    who ran it; a request with different inputs or from another user gets nothing.
+    """
+
+    def __init__(self, local=None, shared=None):
+        self.local = local
+        self.shared = shared
+        self._lock = threading.Lock()
+        self.counters = {'stored': 0, 'reused': 0, 'misses': 0, 'mismatches': 0, 'errors': 0}
+
+    @property
+    def enabled(self):
+        return self.local is not None or self.shared is not None
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def save(self, description, health_params, affected_regions, analysis, owner=None):
+        """Stores the analysis; returns its analysisId (None when the store is disabled)"""
+        if not self.enabled:
+            return None
+        analysis_id = secrets.token_urlsafe(16)
+        entry = {
+            'description': description,
+            'healthParams': health_params,
+            'affectedRegions': affected_regions,
+            'inputKey': analysis_cache_key(description, health_params, affected_regions),
+            'analysis': copy.deepcopy(analysis),
+            'owner': owner,
+        }
+        if self.local is not None:
+            self.local.set(analysis_id, entry)
+        if self.shared is not None:
+            try:
+                self.shared.set(analysis_id, entry)
+            except sqlite3.Error as e:
+                print(f"Analysis store write error: {str(e)}")
+                self._count('errors')
+        self._count('stored')
+        return analysis_id
+
+    def _read(self, analysis_id):
+        if self.local is not None:
+            entry = self.local.get(analysis_id)
+            if entry is not None:
+                return entry
+        if self.shared is not None:
+            try:
+                found = self.shared.get(analysis_id)
+            except sqlite3.Error as e:
+                print(f"Analysis store read error: {str(e)}")
+                self._count('errors')
+                return None
+            if found is not None:
+                entry, expires = found
+                if self.local is not None:
+                    self.local.set(analysis_id, entry, expires)
+                return entry
+        return None
+
+    def get(self, analysis_id, owner=None, description=None, health_params=None, affected_regions=None):
+        """
+        The stored entry (description, healthParams, affectedRegions, analysis), or
+        None when it is unknown, expired, someone else's, or (if inputs are given)
+        for different inputs.
+        """
+        if not analysis_id or not self.enabled:
+            return None
+        entry = self._read(analysis_id)
+        if entry is None or entry.get('owner') != owner:
+            self._count('misses')
+            return None
+        if description or health_params or affected_regions:
+            if analysis_cache_key(description, health_params, affected_regions) != entry['inputKey']:
+                self._count('mismatches')
+                return None
+        self._count('reused')
+        return copy.deepcopy(entry)
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'enabled': self.enabled,
+            **counters,
+            'localEntries': len(self.local) if self.local is not None else None,
+            'sharedPath': self.shared.path if self.shared is not None else None,
+        }
+
+
+def create_analysis_store():
+    if ANALYSIS_RESULT_TTL <= 0:
+        return AnalysisResultStore()
+    local = LocalCache(ANALYSIS_RESULT_MAX_ENTRIES, ANALYSIS_RESULT_TTL) if ANALYSIS_RESULT_MAX_ENTRIES > 0 else None
+    shared = None
+    if ANALYSIS_RESULT_DB:
+        try:
+            shared = SqliteCache(
+                ANALYSIS_RESULT_DB, ANALYSIS_RESULT_DB_MAX_ENTRIES, ANALYSIS_RESULT_TTL, table='analysis_results'
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Analysis store database unavailable, keeping results in memory: {str(e)}")
+    return AnalysisResultStore(local, shared)
+
+
+analysis_store = create_analysis_store()
@@ -0,0 +1,455 @@
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.http import parse_accept_header
+
+from .ai_service import (
+    CHATBOT_FALLBACK_MESSAGE,
+    analyze_symptoms_with_ai_async,
+    chatbot_response_async,
+    chatbot_response_stream_async,
+    record_chat_turn_async,
+)
+from .analysis_fields import ANALYSIS_FIELDS
+from .chat_sessions import chat_sessions
+from .firebase_auth import optional_user
+from .gemini_client import gemini
+from .metrics import observe_request, record_fallback, stage
+from .tracing import TRACE_HEADER, finish_trace, start_trace, trace_headers
+from .pdf_service import generate_health_summary_pdf
+from .routes.analyze import (
+    ANALYZE_BATCH_CONCURRENCY,
+    batch_done_line,
+    batch_error_line,
+    batch_item_inputs,
+    batch_items,
+    batch_result_line,
+    build_analysis_result,
+    build_report_data,
+    ndjson_line,
+    provisional_result,
+    report_filename,
+    selected_fields,
+    simple_analyze,
+    store_analysis,
+    stored_analysis,
+    user_info_from_token,
+)
+from .routes.chatbot import sse_event, uses_session
+from .triage import triage_stats, triage_vitals
+
+# Threads that run the Flask app for every route the ASGI app does not serve itself
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))
+
+
+class AsgiRequest:
+    """The parts of an HTTP request the native AI routes read"""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.args = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+
+    def get_json(self):
+        """Like Flask's get_json(silent=True)"""
+        try:
+            data = json.loads(self.body or b'null')
+        except ValueError:
+            return None
+        return data
+
+    def wants_stream(self, data):
+        if self.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return True
+        if data.get('stream') is True:
+            return True
+        return parse_accept_header(self.headers.get('accept')).best == 'text/event-stream'
+
+    async def user_info(self):
+        """uid/email of a valid Firebase bearer token (verified off the event loop)"""
+        auth_header = self.headers.get('authorization')
+        if not auth_header:
+            return None
+        decoded_token = await asyncio.to_thread(optional_user, auth_header)
+        return user_info_from_token(decoded_token) if decoded_token else None
+
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type='application/json', headers=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def json_response(payload, status=200):
+    return Response(json.dumps(payload).encode('utf-8'), status)
+
+
+class StreamingResponse(Response):
+    def __init__(self, chunks, content_type, headers=None):
+        super().__init__(b'', 200, content_type, headers)
+        self.chunks = chunks
+
+
+async def analyze(request):
+    data = request.get_json() or {}
+    description = data.get("description", "")
+    health_params = data.get("healthParams", {})
+    affected_regions = data.get("spots", []) or []
+    try:
+        fields = selected_fields(data, request.args)
+    except ValueError as e:
+        return json_response({"ok": False, "error": str(e)}, 400)
+
+    user_info = await request.user_info()
+    triage = triage_vitals(health_params)
+    if request.wants_stream(data):
+        return StreamingResponse(
+            analysis_events(description, health_params, affected_regions, user_info, triage, fields),
+            "text/event-stream",
+            {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    analysis = await analyze_with_triage_async(description, health_params, affected_regions, triage, fields)
+    analysis_id = store_analysis(description, health_params, affected_regions, analysis, user_info, fields)
+    return json_response({
+        "ok": True,
+        "result": build_analysis_result(analysis, health_params, affected_regions, user_info, triage, analysis_id, fields)
+    })
+
+
+async def analyze_with_triage_async(description, health_params, affected_regions, triage, fields=ANALYSIS_FIELDS):
+    """Same as the Flask route's analyze_with_triage"""
+    if triage["critical"]:
+        triage_stats.record(triage["level"], short_circuit=True)
+        return simple_analyze(description, health_params, affected_regions, triage)
+
+    triage_stats.record(triage["level"])
+    try:
+        return await analyze_symptoms_with_ai_async(description, health_params, affected_regions, fields)
+    except Exception as e:
+        print(f"AI analysis failed, falling back to simple analysis: {str(e)}")
+        record_fallback("analyze", "rule_based")
+        return simple_analyze(description, health_params, affected_regions, triage)
+
+
+async def analysis_events(description, health_params, affected_regions, user_info, triage, fields=ANALYSIS_FIELDS):
+    """Same events as the Flask route's stream_analysis"""
+    start = time.perf_counter()
+    yield sse_event("triage", {
+        "ok": True,
+        "result": provisional_result(description, health_params, affected_regions, user_info, triage, fields)
+    })
+    analysis = await analyze_with_triage_async(description, health_params, affected_regions, triage, fields)
+    analysis_id = store_analysis(description, health_params, affected_regions, analysis, user_info, fields)
+    yield sse_event("result", {
+        "ok": True,
+        "result": build_analysis_result(
+            analysis, health_params, affected_regions, user_info, triage, analysis_id, fields
+        ),
+        "totalMs": round((time.perf_counter() - start) * 1000, 1)
+    })
+
+
+async def analyze_batch(request):
+    data = request.get_json()
+    try:
+        items = batch_items(data)
+        fields = selected_fields(data if isinstance(data, dict) else {}, request.args)
+    except ValueError as e:
+        return json_response({"ok": False, "error": str(e)}, 400)
+
+    user_info = await request.user_info()
+    return StreamingResponse(
+        batch_lines(items, user_info, fields),
+        "application/x-ndjson",
+        {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def analyze_batch_item(index, item, user_info, fields, slots):
+    """Same line as the Flask route's analyze_batch_item, once one of the request's slots is free"""
+    async with slots:
+        start = time.perf_counter()
+        try:
+            inputs = batch_item_inputs(item)
+            triage = triage_vitals(inputs[1])
+            analysis = await analyze_with_triage_async(*inputs, triage, fields)
+            return batch_result_line(index, start, inputs, analysis, user_info, triage, fields)
+        except Exception as e:
+            return batch_error_line(index, start, e)
+
+
+async def batch_lines(items, user_info, fields):
+    """Same lines as the Flask route's batch_lines; leaving cancels the patients still running"""
+    start = time.perf_counter()
+    slots = asyncio.Semaphore(ANALYZE_BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.ensure_future(analyze_batch_item(index, item, user_info, fields, slots))
+        for index, item in enumerate(items)
+    ]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            failed += 0 if line["ok"] else 1
+            yield ndjson_line(line)
+        yield ndjson_line(batch_done_line(len(items), failed, start))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def chatbot(request):
+    data = request.get_json() or {}
+    message = data.get("message", "")
+    affected_regions = data.get("affectedRegions", [])
+    conversation_history = data.get("history", [])
+
+    if not message:
+        return json_response({"ok": False, "error": "Message is required"}, 400)
+
+    session = None
+    conversation_summary = None
+    if uses_session(data):
+        user_info = await request.user_info()
+        session, _ = chat_sessions.open(data.get("sessionId"), user_info["uid"] if user_info else None)
+        conversation_summary, conversation_history = chat_sessions.context(session)
+
+    if request.wants_stream(data):
+        return StreamingResponse(
+            chat_events(message, affected_regions, conversation_history, conversation_summary, session),
+            "text/event-stream",
+            {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    response = await chatbot_response_async(message, affected_regions, conversation_history, conversation_summary)
+    if session is None:
+        return json_response({"ok": True, "response": response})
+    if response != CHATBOT_FALLBACK_MESSAGE:
+        record_chat_turn_async(session["id"], message, response)
+    return json_response({"ok": True, "response": response, "sessionId": session["id"]})
+
+
+async def chat_events(message, affected_regions, conversation_history, conversation_summary=None, session=None):
+    """Same events as the Flask route's stream_chat"""
+    session_fields = {"sessionId": session["id"]} if session is not None else {}
+    start = time.perf_counter()
+    first_ms = None
+    parts = []
+    try:
+        async for text in chatbot_response_stream_async(message, affected_regions, conversation_history, conversation_summary):
+            if first_ms is None:
+                first_ms = (time.perf_counter() - start) * 1000
+            parts.append(text)
+            yield sse_event("delta", {"text": text})
+        response = "".join(parts).strip()
+        if session is not None:
+            record_chat_turn_async(session["id"], message, response)
+        yield sse_event("done", {
+            "ok": True,
+            "response": response,
+            "ttftMs": round(first_ms, 1),
+            "totalMs": round((time.perf_counter() - start) * 1000, 1),
+            **session_fields
+        })
+    except Exception as e:
+        print(f"Chatbot stream error: {str(e)}")
+        record_fallback("chatbot_stream", "message")
+        yield sse_event("error", {
+            "ok": False,
+            "error": f"AI service error: {str(e)}",
+            "response": CHATBOT_FALLBACK_MESSAGE,
+            "partial": bool(parts),
+            "totalMs": round((time.perf_counter() - start) * 1000, 1),
+            **session_fields
+        })
+
+
+async def generate_summary(request):
+    data = request.get_json() or {}
+    description = data.get("description", "")
+    affected_regions = data.get("affectedRegions", [])
+    health_params = data.get("healthParams", {})
+    user_info = await request.user_info()
+
+    stored = stored_analysis(data, user_info)
+    if stored is not None:
+        description = stored["description"]
+        affected_regions = stored["affectedRegions"]
+        health_params = stored["healthParams"]
+        analysis = stored["analysis"]
+    elif not description and not affected_regions:
+        if data.get("analysisId"):
+            return json_response({"ok": False, "error": "Analysis not found or expired; please analyze your symptoms again"}, 404)
+        return json_response({"ok": False, "error": "Please provide symptom description or mark affected areas"}, 400)
+    else:
+        try:
+            with stage("summary", "analysis"):
+                analysis = await analyze_symptoms_with_ai_async(description, health_params, affected_regions)
+        except Exception as e:
+            print(f"AI analysis failed for PDF generation, falling back to simple analysis: {str(e)}")
+            record_fallback("summary", "rule_based")
+            analysis = simple_analyze(description, health_params, affected_regions)
+
+    report_data = build_report_data(description, health_params, affected_regions, analysis, user_info)
+    try:
+        # ReportLab is CPU-bound; a thread keeps the event loop serving other requests
+        with stage("summary", "pdf_build"):
+            pdf_buffer = await asyncio.to_thread(generate_health_summary_pdf, report_data)
+    except Exception as e:
+        print(f"PDF generation error: {str(e)}")
+        return json_response({"ok": False, "error": f"Failed to generate PDF: {str(e)}"}, 500)
+
+    return Response(
+        pdf_buffer.getvalue(),
+        content_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename={report_filename()}"}
+    )
+
+
+class AsgiApp:
+    """
+    ASGI front for the Flask app.
+
+    /api/analyze, /api/analyze/batch, /api/chatbot and /api/generate-summary run
+    as coroutines that await Gemini through the async client, so a worker holds
+    thousands of them in flight on one event loop. Every other HTTP route is passed to the Flask app on
+    a thread pool. The face login WebSocket is Flask-Sock (WSGI-only); deployments
+    using this entry point route /api/face/stream to a WSGI worker.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.max_content_length = flask_app.config.get("MAX_CONTENT_LENGTH")
+        self.wsgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+        self.routes = {
+            ("POST", "/api/analyze"): analyze,
+            ("POST", "/api/analyze/batch"): analyze_batch,
+            ("POST", "/api/chatbot"): chatbot,
+            ("POST", "/api/generate-summary"): generate_summary,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            handler = self.routes.get((scope["method"], scope["path"]))
+            if handler is None:
+                await self.wsgi(scope, receive, send)
+            else:
+                await self.handle(handler, scope, receive, send)
+        elif scope["type"] == "websocket":
+            await receive()
+            await send({"type": "websocket.close", "code": 1008})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await gemini.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_body(self, receive):
+        """Request body, or None once it exceeds MAX_CONTENT_LENGTH"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return bytes(body)
+            body.extend(message.get("body", b""))
+            if self.max_content_length and len(body) > self.max_content_length:
+                return None
+            if not message.get("more_body"):
+                return bytes(body)
+
+    def cors_headers(self, request):
+        # Matches flask-cors with origins "*" and supports_credentials: the origin is echoed
+        origin = request.headers.get("origin")
+        if not origin:
+            return []
+        return [
+            (b"access-control-allow-origin", origin.encode("latin-1")),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-expose-headers", TRACE_HEADER.encode("latin-1")),
+            (b"vary", b"Origin"),
+        ]
+
+    async def handle(self, handler, scope, receive, send):
+        """
+        Runs a native route, traced and timed into http_request_duration_seconds like
+        the Flask routes
+        """
+        start = time.perf_counter()
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        trace = start_trace(f'{scope["method"]} {scope["path"]}', headers)
+        status = 500
+        try:
+            status = await self.respond(handler, scope, receive, send, trace)
+        finally:
+            observe_request(scope["method"], scope["path"], status, time.perf_counter() - start)
+            finish_trace(trace, status)
+
+    async def respond(self, handler, scope, receive, send, trace):
+        """Reads the request, runs the handler and sends its response; returns the status"""
+        body = await self.read_body(receive)
+        request = AsgiRequest(scope, body or b"")
+        if body is None:
+            response = json_response({"ok": False, "error": "Request body too large"}, 413)
+        else:
+            try:
+                response = await handler(request)
+            except Exception as e:
+                print(f"{handler.__name__} route error: {str(e)}")
+                response = json_response({"ok": False, "error": f"Server error: {str(e)}"}, 500)
+
+        headers = [(b"content-type", response.content_type.encode("latin-1"))]
+        headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+        headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in trace_headers(trace).items()]
+        headers += self.cors_headers(request)
+
+        if not isinstance(response, StreamingResponse):
+            headers.append((b"content-length", str(len(response.body)).encode()))
+            await send({"type": "http.response.start", "status": response.status, "headers": headers})
+            await send({"type": "http.response.body", "body": response.body})
+            return response.status
+
+        await send({"type": "http.response.start", "status": response.status, "headers": headers})
+        await self.stream_body(response.chunks, receive, send)
+        return response.status
+
+    async def stream_body(self, chunks, receive, send):
+        """Send chunks as they come; stop generating (and free the model slot) on disconnect"""
+        async def forward():
+            async for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        sender = asyncio.ensure_future(forward())
+        watcher = asyncio.ensure_future(wait_disconnect())
+        try:
+            await asyncio.wait({sender, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (sender, watcher):
+                task.cancel()
+            await asyncio.gather(sender, watcher, return_exceptions=True)
+            await chunks.aclose()
+        if sender.done() and not sender.cancelled() and sender.exception():
+            raise sender.exception()
+
+
+def create_asgi_app(flask_app):
+    return AsgiApp(flask_app)
@@ -0,0 +1,167 @@
+import copy
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from .analysis_cache import LocalCache, SqliteCache
+
+# Sessions expire after this many idle seconds
+CHAT_SESSION_TTL = float(os.environ.get('CHAT_SESSION_TTL', 6 * 3600))
+CHAT_SESSION_MAX_SESSIONS = int(os.environ.get('CHAT_SESSION_MAX_SESSIONS', 2048))
+# SQLite file that keeps sessions across restarts and shares them between workers;
+# unset keeps each worker's sessions in its own memory
+CHAT_SESSION_DB = os.environ.get('CHAT_SESSION_DB')
+CHAT_SESSION_DB_MAX_SESSIONS = int(os.environ.get('CHAT_SESSION_DB_MAX_SESSIONS', 50000))
+# Once more messages than this wait unsummarized, all but the last
+# CHAT_SESSION_KEEP_MESSAGES are folded into the session's rolling summary
+CHAT_SESSION_MAX_MESSAGES = int(os.environ.get('CHAT_SESSION_MAX_MESSAGES', 12))
+CHAT_SESSION_KEEP_MESSAGES = int(os.environ.get('CHAT_SESSION_KEEP_MESSAGES', 6))
+# Messages kept while summaries keep failing; the oldest beyond this are dropped
+CHAT_SESSION_HARD_LIMIT = CHAT_SESSION_MAX_MESSAGES * 4
+
+
+def new_session_id():
+    return secrets.token_urlsafe(18)
+
+
+class ChatSessionStore:
+    """
+    Server-side chat sessions: the rolling summary of older turns plus the recent
+    messages verbatim, so clients send only a session id and the new message.
+
+    Sessions live in an in-process LRU and, when a SQLite file is configured, in it
+    too. The file is then the source of truth (another worker may have advanced the
+    session); the LRU answers only when it cannot be read. Updates are serialized
+    per process; two workers updating one session at once keep the last write.
+    """
+
+    def __init__(self, local=None, shared=None):
+        self.local = local
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._compacting = set()
+        self.counters = {
+            'created': 0, 'resumed': 0, 'expired': 0, 'turns': 0,
+            'compactions': 0, 'compactionErrors': 0, 'foldedMessages': 0, 'errors': 0,
+        }
+
+    def _count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def _read(self, session_id):
+        if self.shared is not None:
+            try:
+                found = self.shared.get(session_id)
+                return found[0] if found is not None else None
+            except sqlite3.Error as e:
+                print(f"Chat session read error: {str(e)}")
+                self._count('errors')
+        return self.local.get(session_id) if self.local is not None else None
+
+    def _write(self, session):
+        session['updated'] = time.time()
+        if self.local is not None:
+            self.local.set(session['id'], session)
+        if self.shared is not None:
+            try:
+                self.shared.set(session['id'], session)
+            except sqlite3.Error as e:
+                print(f"Chat session write error: {str(e)}")
+                self._count('errors')
+
+    def open(self, session_id=None, owner=None):
+        """
+        The session with this id, or a new one when the id is unknown, expired or
+        belongs to another user. Returns (session, resumed).
+        """
+        with self._lock:
+            session = self._read(session_id) if session_id else None
+            if session is not None and session.get('owner') == owner:
+                self._count('resumed')
+                return copy.deepcopy(session), True
+            if session_id:
+                self._count('expired')
+            session = {'id': new_session_id(), 'owner': owner, 'summary': '', 'folded': 0, 'messages': []}
+            self._write(session)
+            self._count('created')
+            return copy.deepcopy(session), False
+
+    def context(self, session):
+        """(summary, messages) to build the next prompt from; the summary is '' before the first compaction"""
+        return session.get('summary', ''), session['messages'][-CHAT_SESSION_MAX_MESSAGES:]
+
+    def append_turn(self, session_id, user_message, reply):
+        """Adds one exchange; returns True when the session is due for compaction"""
+        with self._lock:
+            session = self._read(session_id)
+            if session is None:
+                return False
+            session['messages'].extend([
+                {'role': 'user', 'content': user_message},
+                {'role': 'assistant', 'content': reply},
+            ])
+            if len(session['messages']) > CHAT_SESSION_HARD_LIMIT:
+                del session['messages'][:len(session['messages']) - CHAT_SESSION_HARD_LIMIT]
+            self._write(session)
+            self._count('turns')
+            return len(session['messages']) > CHAT_SESSION_MAX_MESSAGES and session_id not in self._compacting
+
+    def start_compaction(self, session_id):
+        """
+        Claims the session for compaction; returns (summary, messages to fold), or
+        None when there is nothing to fold or this process is already folding it.
+        """
+        with self._lock:
+            if session_id in self._compacting:
+                return None
+            session = self._read(session_id)
+            if session is None or len(session['messages']) <= CHAT_SESSION_MAX_MESSAGES:
+                return None
+            self._compacting.add(session_id)
+            folded = session['messages'][:-CHAT_SESSION_KEEP_MESSAGES]
+            return session.get('summary', ''), copy.deepcopy(folded)
+
+    def finish_compaction(self, session_id, folded, summary):
+        """Replaces the folded messages with the new summary, keeping turns added meanwhile"""
+        with self._lock:
+            self._compacting.discard(session_id)
+            session = self._read(session_id)
+            if session is None or session['messages'][:len(folded)] != folded:
+                return
+            session['summary'] = summary
+            session['folded'] = session.get('folded', 0) + len(folded)
+            del session['messages'][:len(folded)]
+            self._write(session)
+            self._count('compactions')
+            self._count('foldedMessages', len(folded))
+
+    def abort_compaction(self, session_id):
+        with self._lock:
+            self._compacting.discard(session_id)
+            self._count('compactionErrors')
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            'localSessions': len(self.local) if self.local is not None else None,
+            'localEvictions': self.local.evictions if self.local is not None else None,
+            'sharedPath': self.shared.path if self.shared is not None else None,
+        }
+
+
+def create_chat_session_store():
+    local = LocalCache(CHAT_SESSION_MAX_SESSIONS, CHAT_SESSION_TTL)
+    shared = None
+    if CHAT_SESSION_DB:
+        try:
+            shared = SqliteCache(CHAT_SESSION_DB, CHAT_SESSION_DB_MAX_SESSIONS, CHAT_SESSION_TTL, table='chat_sessions')
+        except (OSError, sqlite3.Error) as e:
+            print(f"Chat session database unavailable, keeping sessions in memory: {str(e)}")
+    return ChatSessionStore(local, shared)
+
+
+chat_sessions = create_chat_session_store()
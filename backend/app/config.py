@@ -4,6 +4,8 @@ import os
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret")
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB upload limit
+    # WebSocket frames (face streaming) share the upload limit; pings keep idle proxies open
+    SOCK_SERVER_OPTIONS = {"ping_interval": 25, "max_message_size": MAX_CONTENT_LENGTH}
     UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "uploads")))
     CORS_ORIGINS = [
         os.environ.get("FRONTEND_ORIGIN", "http://localhost:5000"),
@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+
+from .face_gallery import score_rows
+
+ASSIGN_CHUNK_ROWS = 16384
+
+
+def assign_to_lists(vectors, centroids, chunk_rows=ASSIGN_CHUNK_ROWS):
+    """Nearest centroid (by correlation) for every row, computed in bounded chunks"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_rows):
+        chunk = np.asarray(vectors[start:start + chunk_rows], dtype=np.float32)
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors, n_lists, iterations=20, sample_size=50000, seed=0):
+    """
+    Spherical k-means over normalized face vectors.
+
+    Rows are centered and L2-normalized, so the dot product is the correlation
+    score itself and each centroid is the renormalized mean of its members.
+    """
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    n_lists = max(1, min(n_lists, count))
+    if count > sample_size:
+        sample_rows = np.sort(rng.choice(count, size=sample_size, replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    else:
+        sample = np.asarray(vectors, dtype=np.float32)
+
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists from random members so every list stays useful
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.divide(sums, norms, out=np.zeros_like(sums), where=norms > 0)
+    return centroids.astype(np.float32)
+
+
+class IVFBinding:
+    """
+    Postings of an IVFIndex laid out as row positions of one base segment. Never
+    changed once built, so a search keeps using the binding it started with while
+    a compaction binds the index to the new base.
+    """
+
+    def __init__(self, base_vectors, offsets, positions):
+        offsets.setflags(write=False)
+        positions.setflags(write=False)
+        self.base_vectors = base_vectors
+        self.offsets = offsets
+        self.positions = positions
+
+
+class IVFIndex:
+    """
+    Inverted-file index over face templates for sublinear candidate search.
+
+    A coarse k-means quantizer splits the gallery into n_lists buckets. A probe is
+    compared with the centroids, the n_probe closest buckets are gathered, and
+    only that shortlist is scored exactly. Raising n_probe trades latency for
+    recall; n_probe == n_lists is an exhaustive search.
+
+    Postings are persisted by mobile number so the index survives store
+    compactions; rows registered after the build are assigned on the fly.
+    """
+
+    def __init__(self, centroids, mobiles, assignments):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignment_by_mobile = dict(zip(mobiles, (int(a) for a in assignments)))
+        self._binding = None
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    def __len__(self):
+        return len(self.assignment_by_mobile)
+
+    @classmethod
+    def build(cls, vectors, mobiles, n_lists=None, iterations=20, sample_size=50000, seed=0):
+        """
+        Train an index over the given vectors.
+
+        Args:
+            vectors: (n, dim) normalized vectors, e.g. a TemplateStore's memmapped base
+            mobiles: Mobile number for every row
+            n_lists: Number of buckets; defaults to ~4*sqrt(n)
+        """
+        if not len(vectors):
+            raise ValueError("Cannot build a face index over an empty gallery")
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(len(vectors)))
+        centroids = train_centroids(vectors, n_lists, iterations=iterations, sample_size=sample_size, seed=seed)
+        assignments = assign_to_lists(vectors, centroids)
+        return cls(centroids, list(mobiles), assignments)
+
+    def save(self, path):
+        """Write the index atomically so running workers never read a partial file"""
+        mobiles = list(self.assignment_by_mobile.keys())
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            mobiles=np.array([m.encode('utf-8') for m in mobiles], dtype='S32'),
+            assignments=np.array([self.assignment_by_mobile[m] for m in mobiles], dtype=np.int32),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            mobiles = [m.decode('utf-8') for m in data['mobiles'].tolist()]
+            return cls(data['centroids'], mobiles, data['assignments'])
+
+    def bind(self, base_vectors, base_meta):
+        """
+        The IVFBinding of the postings to the given base segment.
+
+        Only rebuilt when the store remaps its base file (after a compaction).
+        Rows the index has not seen are assigned to their nearest centroid.
+        """
+        binding = self._binding
+        if binding is not None and binding.base_vectors is base_vectors:
+            return binding
+        mobiles = [m.decode('utf-8') for m in base_meta['mobile'].tolist()]
+        assignments = np.fromiter(
+            (self.assignment_by_mobile.get(m, -1) for m in mobiles),
+            dtype=np.int32, count=len(mobiles),
+        )
+        missing = np.flatnonzero(assignments < 0)
+        if len(missing):
+            assignments[missing] = assign_to_lists(base_vectors[missing], self.centroids)
+
+        order = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=self.n_lists)
+        binding = IVFBinding(base_vectors, np.concatenate([[0], np.cumsum(counts)]), order)
+        # One reference swap, so readers see either the old binding or the new one
+        self._binding = binding
+        return binding
+
+    def candidates(self, binding, probe, n_probe):
+        """Base-row positions of `binding` in the n_probe buckets closest to the probe"""
+        n_probe = max(1, min(n_probe, self.n_lists))
+        centroid_scores = self.centroids @ probe
+        if n_probe < self.n_lists:
+            lists = np.argpartition(centroid_scores, -n_probe)[-n_probe:]
+        else:
+            lists = np.arange(self.n_lists)
+        offsets, positions = binding.offsets, binding.positions
+        parts = [positions[offsets[i]:offsets[i + 1]] for i in lists]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def score_candidates(self, binding, probe, n_probe):
+        """Exact correlation scores for the shortlist of `binding`; returns (positions, scores)"""
+        positions = self.candidates(binding, probe, n_probe)
+        if not len(positions):
+            return positions, np.zeros(0, dtype=np.float32)
+        return positions, score_rows(binding.base_vectors[positions], probe)
@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+
+from .face_gallery import normalize_histograms
+
+HISTOGRAM_CHANNELS = 3
+HISTOGRAM_BINS = 256
+CODEC_DTYPES = ('float32', 'float16', 'int8')
+INT8_MAX = 127
+
+
+class DescriptorCodec:
+    """
+    Compression stage between normalized face histograms and stored templates.
+
+    Up to three steps are applied, in order:
+      bins   sum groups of adjacent bins (256 -> `bins` per channel) and renormalize.
+             The result is exactly the correlation score of the coarser histograms.
+      pca    project onto the top principal directions of the gallery. The PCA is
+             uncentered, so dot products of projections approximate the original
+             correlation scores and MATCH_THRESHOLD keeps its meaning. Projections
+             are deliberately not renormalized: that restores self-scores of 1 but
+             inflates impostor scores far more (see `flask face eval-codec`).
+      dtype  float16, or int8 with a per-dimension scale. Probes are divided by the
+             scale instead of dequantizing the gallery, so scoring stays a single
+             matrix-vector product over the stored rows.
+    """
+
+    def __init__(self, bins=HISTOGRAM_BINS, components=None, dtype='float32', scales=None):
+        if HISTOGRAM_BINS % bins:
+            raise ValueError(f"bins must divide {HISTOGRAM_BINS}, got {bins}")
+        if dtype not in CODEC_DTYPES:
+            raise ValueError(f"Unsupported descriptor dtype '{dtype}'. Choose from {list(CODEC_DTYPES)}")
+        if dtype == 'int8' and scales is None:
+            raise ValueError("int8 descriptors need per-dimension scales; use DescriptorCodec.fit")
+        self.bins = bins
+        self.components = None if components is None else np.asarray(components, dtype=np.float32)
+        self.dtype = dtype
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+
+    @property
+    def dim(self):
+        if self.components is not None:
+            return self.components.shape[0]
+        return HISTOGRAM_CHANNELS * self.bins
+
+    @property
+    def input_dim(self):
+        return HISTOGRAM_CHANNELS * HISTOGRAM_BINS
+
+    def describe(self):
+        return {
+            'bins': self.bins,
+            'components': None if self.components is None else int(self.components.shape[0]),
+            'dtype': self.dtype,
+            'dim': self.dim,
+            'bytesPerTemplate': self.dim * np.dtype(self.dtype).itemsize,
+        }
+
+    def reduce_bins(self, vectors):
+        """Sum adjacent bins of normalized full-width vectors and renormalize"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.bins == HISTOGRAM_BINS:
+            return vectors
+        group = HISTOGRAM_BINS // self.bins
+        shape = vectors.shape[:-1] + (HISTOGRAM_CHANNELS, self.bins, group)
+        # Summing the centered bins differs from summing the raw ones by a constant,
+        # which the re-centering removes again
+        return normalize_histograms(vectors.reshape(shape).sum(axis=-1).reshape(vectors.shape[:-1] + (-1,)))
+
+    def transform(self, vectors):
+        """Compressed float32 descriptors of normalized full-width vectors"""
+        reduced = self.reduce_bins(vectors)
+        if self.components is None:
+            return reduced
+        return np.asarray(reduced @ self.components.T, dtype=np.float32)
+
+    def encode(self, vectors):
+        """Descriptors in the stored dtype"""
+        transformed = self.transform(vectors)
+        if self.dtype == 'int8':
+            return np.clip(np.rint(transformed * self.scales), -INT8_MAX, INT8_MAX).astype(np.int8)
+        return transformed.astype(self.dtype)
+
+    def decode(self, stored):
+        """Stored rows back to float32 descriptors"""
+        stored = np.asarray(stored, dtype=np.float32)
+        if self.dtype == 'int8':
+            return stored / self.scales
+        return stored
+
+    def probe(self, vectors):
+        """Probe descriptor to dot directly with stored rows (int8 rows stay quantized)"""
+        transformed = self.transform(vectors)
+        if self.dtype == 'int8':
+            return transformed / self.scales
+        return transformed
+
+    @classmethod
+    def fit(cls, vectors, bins=HISTOGRAM_BINS, n_components=None, dtype='float32', sample_size=50000, seed=0):
+        """
+        Fit a codec on normalized full-width gallery vectors.
+
+        Args:
+            vectors: (n, 768) normalized vectors, e.g. a TemplateStore's base segment
+            bins: Histogram bins kept per channel
+            n_components: Principal components kept, or None to skip PCA
+            dtype: 'float32', 'float16' or 'int8'
+        """
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample_size:
+            rows = np.sort(rng.choice(len(vectors), size=sample_size, replace=False))
+            sample = np.asarray(vectors[rows], dtype=np.float32)
+        else:
+            sample = np.asarray(vectors, dtype=np.float32)
+        if not len(sample):
+            raise ValueError("Cannot fit a descriptor codec on an empty gallery")
+
+        codec = cls(bins=bins, dtype='float32')
+        reduced = codec.reduce_bins(sample)
+        if n_components:
+            if n_components > reduced.shape[1]:
+                raise ValueError(f"Cannot keep {n_components} components of {reduced.shape[1]}-dim descriptors")
+            # Eigenvectors of the (uncentered) second-moment matrix preserve inner products best
+            _, _, vt = np.linalg.svd(reduced, full_matrices=False)
+            codec.components = np.ascontiguousarray(vt[:n_components], dtype=np.float32)
+
+        scales = None
+        if dtype == 'int8':
+            # Full per-dimension range: histograms of evenly lit faces concentrate in a
+            # few bins, and clipping those costs more accuracy than the coarser steps
+            limits = np.abs(codec.transform(sample)).max(axis=0)
+            scales = INT8_MAX / np.maximum(limits, 1e-6)
+        return cls(bins=bins, components=codec.components, dtype=dtype, scales=scales)
+
+    def save(self, path):
+        """Write the codec atomically"""
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        arrays = {'bins': np.int32(self.bins), 'dtype': np.array(self.dtype)}
+        if self.components is not None:
+            arrays['components'] = self.components
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                bins=int(data['bins']),
+                components=data['components'] if 'components' in data else None,
+                dtype=str(data['dtype']),
+                scales=data['scales'] if 'scales' in data else None,
+            )
@@ -0,0 +1,215 @@
+import threading
+import time
+from pathlib import Path
+
+import cv2
+
+from .metrics import observe_stage
+
+CASCADE_PATH = str(Path(__file__).resolve().parent / 'cascade_data' / 'haarcascade_frontalface_default.xml')
+
+# Smallest window the frontal-face cascade was trained on
+CASCADE_WINDOW = 24
+
+# scaleFactor / minNeighbors as passed to detectMultiScale, plus the largest image
+# side the cascade runs on (None = full resolution). Halving only pays off for
+# large frames: webcam-sized images run at full resolution under 'balanced'.
+DETECTION_PROFILES = {
+    'legacy': {'scaleFactor': 1.3, 'minNeighbors': 5, 'maxDetectDim': None},
+    'accurate': {'scaleFactor': 1.1, 'minNeighbors': 5, 'maxDetectDim': 1280},
+    'balanced': {'scaleFactor': 1.3, 'minNeighbors': 5, 'maxDetectDim': 800},
+    'fast': {'scaleFactor': 1.3, 'minNeighbors': 4, 'maxDetectDim': 400},
+}
+
+
+def load_cascade(path=CASCADE_PATH):
+    cascade = cv2.CascadeClassifier(path)
+    if cascade.empty():
+        raise RuntimeError(f"Failed to load Haar cascade from {path}. File may be missing or corrupted.")
+    return cascade
+
+
+class StageTimings:
+    """
+    Thread-safe running totals of per-stage durations in milliseconds; each stage
+    is also observed into the face stage metrics
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, timings):
+        for stage, ms in timings.items():
+            observe_stage('face', stage, ms / 1000)
+        with self._lock:
+            for stage, ms in timings.items():
+                count, total, worst = self._stages.get(stage, (0, 0.0, 0.0))
+                self._stages[stage] = (count + 1, total + ms, max(worst, ms))
+
+    def summary(self):
+        with self._lock:
+            return {
+                stage: {'count': count, 'avgMs': round(total / count, 3), 'maxMs': round(worst, 3)}
+                for stage, (count, total, worst) in self._stages.items()
+            }
+
+
+class FaceDetector:
+    """
+    Haar-cascade face detection on a downscaled pyramid level.
+
+    Frames whose longest side exceeds the profile's maxDetectDim are halved with
+    cv2.pyrDown until the minimum face size is as close to the cascade's native 24px
+    window as it can get without dropping below it (two levels for the default
+    100px). Intermediate levels were measured to be slower and less stable than
+    either full resolution or the deepest level. The cascade runs on that level and
+    the boxes are mapped back to full-resolution coordinates, so crops keep full
+    detail.
+    """
+
+    def __init__(self, cascade, profile='balanced', cascade_path=CASCADE_PATH):
+        if profile not in DETECTION_PROFILES:
+            raise ValueError(f"Unknown detection profile '{profile}'. Choose from {sorted(DETECTION_PROFILES)}")
+        self.cascade = cascade
+        self.cascade_path = cascade_path
+        self.profile = profile
+        self.params = DETECTION_PROFILES[profile]
+        self.timings = StageTimings()
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+
+    def thread_cascade(self):
+        """
+        The classifier for the calling thread. CascadeClassifier keeps per-call scale
+        data on the object and is not safe to share between threads, so worker
+        threads lazily load their own copy.
+        """
+        if threading.get_ident() == self._owner:
+            return self.cascade
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = self._local.cascade = load_cascade(self.cascade_path)
+        return cascade
+
+    def pyramid_levels(self, shape, min_size):
+        """Number of pyrDown halvings to apply for an image of the given shape"""
+        max_dim = self.params['maxDetectDim']
+        if not max_dim:
+            return 0
+        if max(shape[:2]) <= max_dim:
+            return 0
+        levels = 0
+        while min_size / 2 >= CASCADE_WINDOW:
+            min_size /= 2
+            levels += 1
+        return levels
+
+    def detect(self, img, min_size=100):
+        """
+        Detect faces in a BGR or grayscale image.
+
+        Returns:
+            (list of (x, y, w, h) boxes in full-resolution coordinates, timings dict in ms)
+        """
+        timings = {}
+        start = time.perf_counter()
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        timings['gray'] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        levels = self.pyramid_levels(gray.shape, min_size)
+        level = gray
+        for _ in range(levels):
+            level = cv2.pyrDown(level)
+        scale_x = gray.shape[1] / level.shape[1]
+        scale_y = gray.shape[0] / level.shape[0]
+        timings['downscale'] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        level_min = max(CASCADE_WINDOW, int(round(min_size / max(scale_x, scale_y))))
+        faces = self.thread_cascade().detectMultiScale(
+            level, self.params['scaleFactor'], self.params['minNeighbors'],
+            minSize=(level_min, level_min),
+        )
+        timings['detect'] = (time.perf_counter() - start) * 1000
+
+        boxes = []
+        height, width = gray.shape[:2]
+        for x, y, w, h in faces:
+            x0 = min(int(round(x * scale_x)), width - 1)
+            y0 = min(int(round(y * scale_y)), height - 1)
+            x1 = min(int(round((x + w) * scale_x)), width)
+            y1 = min(int(round((y + h) * scale_y)), height)
+            boxes.append((x0, y0, x1 - x0, y1 - y0))
+        return boxes, timings
+
+
+class FaceTracker:
+    """
+    Follow one detected face across video frames by template matching.
+
+    The face is kept as a small grayscale template and searched for with
+    normalized cross-correlation in a window around its last position, which
+    costs a fraction of a cascade pass. When the best match drops below min_score
+    (the face turned away, left the window or was occluded) the tracker resets and
+    the caller falls back to full detection.
+    """
+
+    def __init__(self, min_score=0.6, search_margin=0.5, template_width=48):
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.template_width = template_width
+        self.score = 0.0
+        self.reset()
+
+    def reset(self):
+        self.box = None
+        self.template = None
+
+    @property
+    def active(self):
+        return self.box is not None
+
+    def _template(self, gray, box):
+        x, y, w, h = box
+        size = (self.template_width, max(1, int(round(h * self._scale))))
+        return cv2.resize(gray[y:y + h, x:x + w], size, interpolation=cv2.INTER_AREA)
+
+    def start(self, gray, box):
+        """Begin tracking the (x, y, w, h) box found by the detector in this frame"""
+        self.box = tuple(int(v) for v in box)
+        self._scale = self.template_width / self.box[2]
+        self.template = self._template(gray, self.box)
+        self.score = 1.0
+
+    def update(self, gray):
+        """Box of the tracked face in a new grayscale frame, or None when it was lost"""
+        if self.box is None:
+            return None
+        x, y, w, h = self.box
+        height, width = gray.shape[:2]
+        margin_x, margin_y = int(w * self.search_margin), int(h * self.search_margin)
+        x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+        x1, y1 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+        if x1 - x0 < w or y1 - y0 < h:
+            self.reset()
+            return None
+
+        window_size = (
+            max(self.template.shape[1], int(round((x1 - x0) * self._scale))),
+            max(self.template.shape[0], int(round((y1 - y0) * self._scale))),
+        )
+        window = cv2.resize(gray[y0:y1, x0:x1], window_size, interpolation=cv2.INTER_AREA)
+        result = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(result)
+        self.score = float(score)
+        if self.score < self.min_score:
+            self.reset()
+            return None
+
+        new_x = min(x0 + int(round(location[0] / self._scale)), width - w)
+        new_y = min(y0 + int(round(location[1] / self._scale)), height - h)
+        self.box = (new_x, new_y, w, h)
+        self.template = self._template(gray, self.box)
+        return self.box
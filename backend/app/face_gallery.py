@@ -0,0 +1,298 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from .metrics import face_gallery_size, stage
+
+# Upcast chunks sized to stay in cache: converting a narrow matrix in cache-sized
+# pieces makes int8 rows score as fast as float32 ones while reading 4x less memory
+SCORE_CHUNK_BYTES = 1 << 20
+
+
+def compute_face_histogram(face):
+    with stage('face', 'histogram'):
+        return _face_histogram(face)
+
+
+def _face_histogram(face):
+    hist_b = cv2.calcHist([face], [0], None, [256], [0, 256])
+    hist_g = cv2.calcHist([face], [1], None, [256], [0, 256])
+    hist_r = cv2.calcHist([face], [2], None, [256], [0, 256])
+    
+    hist_b = cv2.normalize(hist_b, hist_b).flatten()
+    hist_g = cv2.normalize(hist_g, hist_g).flatten()
+    hist_r = cv2.normalize(hist_r, hist_r).flatten()
+    
+    return np.concatenate([hist_b, hist_g, hist_r])
+
+
+def normalize_histograms(histograms):
+    """
+    Center and L2-normalize histograms so that a plain dot product between two
+    rows equals OpenCV's HISTCMP_CORREL score.
+
+    Args:
+        histograms: Array of shape (dim,) or (n, dim)
+
+    Returns:
+        float32 array of the same shape
+    """
+    hists = np.asarray(histograms, dtype=np.float32)
+    centered = hists - hists.mean(axis=-1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=-1, keepdims=True)
+    # Flat histograms have no variance; leave them as zero rows so they never match
+    np.divide(centered, norms, out=centered, where=norms > 0)
+    return centered
+
+
+def score_rows(matrix, probe, chunk_rows=None):
+    """
+    Dot every row of a (possibly memory-mapped, possibly float16/int8) matrix with a probe.
+
+    float32 matrices are scored in one BLAS call; narrower dtypes are upcast in
+    bounded chunks so a login never materializes a full float32 copy of the gallery.
+    """
+    if matrix.dtype == np.float32:
+        return np.asarray(matrix @ probe, dtype=np.float32)
+    if chunk_rows is None:
+        chunk_rows = max(64, SCORE_CHUNK_BYTES // (4 * max(1, matrix.shape[1])))
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), chunk_rows):
+        chunk = np.asarray(matrix[start:start + chunk_rows], dtype=np.float32)
+        scores[start:start + len(chunk)] = chunk @ probe
+    return scores
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if k < len(scores):
+        top = np.argpartition(scores, -k)[-k:]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(scores[top])[::-1]]
+
+
+class FaceGallery:
+    """
+    Process-wide index of registered face histograms.
+
+    Templates are kept pre-normalized in a TemplateStore: the compacted base is a
+    contiguous memory-mapped matrix and recent registrations sit in a small
+    in-memory delta, so scoring a probe against all users is one matrix-vector
+    product per segment. An optional IVF index (see face_ann.py) narrows the base
+    segment to a shortlist that is then scored exactly.
+
+    With a DescriptorCodec (see face_codec.py) the store holds compressed
+    descriptors and probes are encoded the same way; full_store then keeps the
+    full-width templates the codec can be refitted from.
+    """
+
+    def __init__(self, store, n_probe=8, ann_min_rows=0, codec=None, full_store=None):
+        self.store = store
+        self.codec = codec
+        self.full_store = full_store
+        self.n_probe = n_probe
+        self.ann_min_rows = ann_min_rows
+        self.ann_index = None
+        self._index_path = None
+        self._index_stat = None
+        self._index_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, mobile):
+        return mobile in self.store
+
+    @property
+    def dim(self):
+        return self.store.dim
+
+    def load(self):
+        """Map the template store from disk"""
+        self.store.open()
+        if self.full_store is not None:
+            self.full_store.open()
+        face_gallery_size.set(len(self))
+
+    def load_index(self, path):
+        """Attach a persisted IVF index; a missing file leaves exhaustive search in place"""
+        from .face_ann import IVFIndex
+
+        self._index_path = path
+        stat = _file_stat(path)
+        if stat == self._index_stat:
+            return self.ann_index is not None
+        self._index_stat = stat
+        if stat is None:
+            self.ann_index = None
+            return False
+        index = IVFIndex.load(path)
+        if index.dim != self.dim:
+            print(f"Ignoring face index {path}: built for {index.dim}-dim templates, gallery has {self.dim}")
+            self.ann_index = None
+            return False
+        self.ann_index = index
+        return True
+
+    def refresh_if_changed(self):
+        """Pick up registrations, compactions and index rebuilds made by other workers"""
+        changed = self.store.refresh()
+        if self._index_path and _file_stat(self._index_path) != self._index_stat:
+            self.load_index(self._index_path)
+            changed = True
+        if changed:
+            face_gallery_size.set(len(self))
+        return changed
+
+    def transform(self, histogram):
+        """Float32 descriptor of a raw histogram, in the space the gallery scores in"""
+        vector = normalize_histograms(histogram)
+        return self.codec.transform(vector) if self.codec else vector
+
+    def upsert(self, mobile, user_name, histogram):
+        """Add a user or overwrite an existing user's template"""
+        self.upsert_many([(mobile, user_name, histogram)])
+
+    def upsert_many(self, items):
+        """
+        Add or overwrite several users with one store write.
+
+        Args:
+            items: List of (mobile, userName, histogram)
+        """
+        if not items:
+            return
+        vectors = normalize_histograms(np.stack([histogram for _, _, histogram in items]))
+        if self.codec:
+            self.full_store.append_many(
+                (mobile, user_name, vector, None) for (mobile, user_name, _), vector in zip(items, vectors)
+            )
+            vectors = self.codec.encode(vectors)
+        self.store.append_many(
+            (mobile, user_name, vector, None) for (mobile, user_name, _), vector in zip(items, vectors)
+        )
+        face_gallery_size.set(len(self))
+
+    def vectors(self, mobiles):
+        """Stored descriptors (decoded to float32) for the given users, in order; unknown users are skipped"""
+        found = []
+        rows = []
+        for mobile in mobiles:
+            vector = self.store.vector(mobile)
+            if vector is not None:
+                found.append(mobile)
+                rows.append(vector)
+        if not rows:
+            return found, np.zeros((0, self.dim), dtype=np.float32)
+        rows = np.stack(rows)
+        return found, self.codec.decode(rows) if self.codec else rows
+
+    def search(self, histogram, k=1, n_probe=None, exhaustive=False):
+        """
+        Score a probe histogram against registered users.
+
+        Args:
+            histogram: Raw histogram as returned by compute_face_histogram
+            k: Number of best matches to return
+            n_probe: IVF buckets to visit (defaults to the gallery setting)
+            exhaustive: Ignore the IVF index and score every template
+
+        Returns:
+            List of (user dict, correlation score) tuples, best first. Scores are
+            exact HISTCMP_CORREL values whether or not the index was used (or
+            their approximation by the codec's descriptors, if one is set).
+        """
+        with stage('face', 'match'):
+            return self._search(histogram, k, n_probe, exhaustive)
+
+    def _search(self, histogram, k, n_probe, exhaustive):
+        probe = normalize_histograms(histogram)
+        if self.codec:
+            probe = self.codec.probe(probe)
+        snapshot = self.store.snapshot()
+        if len(snapshot) == 0:
+            return []
+
+        base_count = len(snapshot.base_vectors)
+        positions = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0, dtype=np.float32)
+        if base_count:
+            index = self.ann_index
+            if index is not None and not exhaustive and base_count >= self.ann_min_rows:
+                with self._index_lock:
+                    binding = index.bind(snapshot.base_vectors, snapshot.base_meta)
+                positions, scores = index.score_candidates(binding, probe, n_probe or self.n_probe)
+                live = snapshot.base_live[positions]
+            else:
+                positions = np.arange(base_count)
+                scores = score_rows(snapshot.base_vectors, probe)
+                live = snapshot.base_live
+            # Rows superseded by a newer registration in the log never match
+            scores = np.where(live, scores, -np.inf).astype(np.float32)
+        if len(snapshot.delta_vectors):
+            positions = np.concatenate([positions, base_count + np.arange(len(snapshot.delta_vectors))])
+            delta_scores = np.where(snapshot.delta_live, snapshot.delta_vectors @ probe, -np.inf)
+            scores = np.concatenate([scores, delta_scores.astype(np.float32)])
+
+        return [
+            (snapshot.user(int(positions[i])), float(scores[i]))
+            for i in top_k(scores, k)
+            if np.isfinite(scores[i])
+        ]
+
+
+class ScoreFusion:
+    """
+    Fuse correlation scores across several frames of the same person.
+
+    Each frame contributes its top-k gallery matches as candidates; candidates are
+    then re-scored exactly against every frame and ranked by their mean score, so
+    one blurred or badly lit frame no longer decides the login on its own.
+    """
+
+    def __init__(self, gallery, k=5):
+        self.gallery = gallery
+        self.k = k
+        self.probes = []
+        self.candidates = {}
+
+    def __len__(self):
+        return len(self.probes)
+
+    def add(self, histogram, search=True):
+        """
+        Add one frame's histogram; returns that frame's own top-k matches.
+
+        With search=False the frame only re-scores the candidates collected so far,
+        for frames known to show the same face (e.g. tracked video frames).
+        """
+        matches = self.gallery.search(histogram, k=self.k) if search else []
+        self.probes.append(self.gallery.transform(histogram))
+        for user, _ in matches:
+            self.candidates.setdefault(user['mobile'], user)
+        return matches
+
+    def best(self):
+        """(user dict, mean correlation across frames) of the best candidate, or (None, -1)"""
+        if not self.candidates or not self.probes:
+            return None, -1.0
+        mobiles, vectors = self.gallery.vectors(list(self.candidates))
+        if not mobiles:
+            return None, -1.0
+        scores = (vectors @ np.stack(self.probes).T).mean(axis=1)
+        best = int(np.argmax(scores))
+        return self.candidates[mobiles[best]], float(scores[best])
+
+
+def _file_stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
@@ -0,0 +1,495 @@
+import json
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: fall back to in-process locking only
+    fcntl = None
+
+MAGIC = b'DVFT'
+FORMAT_VERSION = 1
+# magic, version, dtype code, dim, row count, generation; padded to 64 bytes
+HEADER = struct.Struct('<4sHHIQQ36x')
+DTYPE_CODES = {'float32': 1, 'float16': 2, 'int8': 3}
+DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<f2'), 3: np.dtype('i1')}
+
+META_DTYPE = np.dtype([('mobile', 'S32'), ('userName', 'S64'), ('registeredAt', '<f8')])
+
+BASE_FILE = 'templates.bin'
+LOG_FILE = 'templates.log'
+LOCK_FILE = 'templates.lock'
+
+
+def log_record_dtype(dim, vector_dtype):
+    return np.dtype(META_DTYPE.descr + [('vector', vector_dtype, (dim,))])
+
+
+def _encode_text(value, size):
+    """UTF-8 encode and truncate on a character boundary to fit a fixed-width field"""
+    return str(value).encode('utf-8')[:size].decode('utf-8', errors='ignore').encode('utf-8')
+
+
+def _decode_text(value):
+    return value.decode('utf-8', errors='replace')
+
+
+class TemplateSnapshot:
+    """Point-in-time view of a TemplateStore's base and delta segments"""
+
+    def __init__(self, base_vectors, base_meta, base_live, delta_vectors, delta_meta, delta_live):
+        self.base_vectors = base_vectors
+        self.base_meta = base_meta
+        self.base_live = base_live
+        self.delta_vectors = delta_vectors
+        self.delta_meta = delta_meta
+        self.delta_live = delta_live
+
+    def __len__(self):
+        return len(self.base_vectors) + len(self.delta_vectors)
+
+    def user(self, position):
+        """Metadata for a position in the concatenated base + delta row space"""
+        base_count = len(self.base_vectors)
+        if position < base_count:
+            return TemplateStore._meta_to_dict(self.base_meta[position])
+        return dict(self.delta_meta[position - base_count])
+
+
+class TemplateStore:
+    """
+    Packed on-disk store for face templates.
+
+    Layout inside the store directory:
+      templates.bin  header | contiguous vectors (rows x dim) | fixed-width metadata
+      templates.log  header | append-only records (metadata + vector)
+      templates.lock advisory lock serializing writers across gunicorn workers
+
+    The base file is opened with np.memmap in read-only mode, so every worker maps
+    the same page-cache pages instead of keeping a private copy. New registrations
+    go to the append log and are folded into the base file by compact().
+    """
+
+    def __init__(self, root, dim=768, dtype='float32', compact_every=1024):
+        if dtype not in DTYPE_CODES:
+            raise ValueError(f"Unsupported template dtype: {dtype}")
+        self.root = root
+        self.dim = dim
+        self.dtype = dtype
+        self.compact_every = compact_every
+        os.makedirs(root, exist_ok=True)
+        self.base_path = os.path.join(root, BASE_FILE)
+        self.log_path = os.path.join(root, LOG_FILE)
+        self.lock_path = os.path.join(root, LOCK_FILE)
+
+        self._lock = threading.RLock()
+        self._write_depth = 0
+        self._base_stat = None
+        self._log_ino = None
+        self._log_dtype = None
+        self._log_offset = 0
+        self._log_record_size = log_record_dtype(dim, DTYPES[DTYPE_CODES[dtype]]).itemsize
+        self.generation = 0
+        self.base_vectors = np.zeros((0, dim), dtype=np.float32)
+        self.base_meta = np.zeros(0, dtype=META_DTYPE)
+        self.base_live = np.zeros(0, dtype=bool)
+        self.index = {}
+        self._reset_delta()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, mobile):
+        return str(mobile) in self.index
+
+    def exists(self):
+        return os.path.exists(self.base_path) or os.path.exists(self.log_path)
+
+    @contextmanager
+    def write_lock(self):
+        """
+        Serialize writers within this process and, where supported, across processes.
+        Reentrant: only the outermost holder takes the file lock.
+        """
+        with self._lock:
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield
+                finally:
+                    self._write_depth -= 1
+                return
+            with open(self.lock_path, 'a+') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._write_depth = 1
+                try:
+                    yield
+                finally:
+                    self._write_depth = 0
+                    if fcntl:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def open(self):
+        """Map the base file and replay the append log"""
+        with self._lock:
+            self._map_base()
+            self._reset_delta()
+            self._log_ino = None
+            self._log_dtype = None
+            self._log_offset = 0
+            self._read_log()
+
+    def refresh(self):
+        """
+        Pick up writes made by other processes.
+
+        A replaced base file (after compaction) or log is remapped; a grown log
+        is read incrementally from the last offset. Returns True if anything changed.
+        """
+        with self._lock:
+            if self._stat(self.base_path) != self._base_stat:
+                self.open()
+                return True
+            log_stat = self._stat(self.log_path)
+            if log_stat is None and self._log_ino is None:
+                return False
+            if log_stat is None or log_stat[0] != self._log_ino or log_stat[2] < self._log_offset:
+                self.open()
+                return True
+            if log_stat[2] - self._log_offset >= self._log_record_size:
+                self._read_log()
+                return True
+            return False
+
+    def get(self, mobile):
+        """Return the metadata dict for a mobile number, or None"""
+        with self._lock:
+            location = self.index.get(str(mobile))
+            if location is None:
+                return None
+            segment, row = location
+            if segment == 'base':
+                return self._meta_to_dict(self.base_meta[row])
+            return dict(self.delta_meta[row])
+
+    def vector(self, mobile):
+        """Return the stored normalized vector for a mobile number, or None"""
+        with self._lock:
+            location = self.index.get(str(mobile))
+            if location is None:
+                return None
+            segment, row = location
+            if segment == 'base':
+                return np.asarray(self.base_vectors[row], dtype=np.float32)
+            return self.delta_vectors[row].copy()
+
+    def snapshot(self):
+        """
+        Return a consistent view of the stored vectors for lock-free scoring.
+
+        Nothing a snapshot references is written after it is taken: the base
+        arrays are read-only memmaps, delta rows are written once (a re-registration
+        appends a new row) and the liveness masks are replaced, not changed in place.
+        """
+        with self._lock:
+            return TemplateSnapshot(
+                self.base_vectors, self.base_meta, self.base_live,
+                self.delta_vectors[:self.delta_size], list(self.delta_meta),
+                self.delta_live[:self.delta_size],
+            )
+
+    def append(self, mobile, user_name, vector, registered_at=None):
+        """Persist one normalized template to the append log"""
+        self.append_many([(mobile, user_name, vector, registered_at)])
+
+    def append_many(self, items):
+        """
+        Persist several normalized templates with a single locked write.
+
+        Args:
+            items: Iterable of (mobile, userName, vector, registeredAt or None)
+        """
+        items = list(items)
+        if not items:
+            return
+        records = np.zeros(len(items), dtype=log_record_dtype(self.dim, DTYPES[DTYPE_CODES[self.dtype]]))
+        now = time.time()
+        for i, (mobile, user_name, vector, registered_at) in enumerate(items):
+            mobile_bytes = str(mobile).encode('utf-8')
+            if len(mobile_bytes) > META_DTYPE['mobile'].itemsize:
+                raise ValueError(f"Mobile identifier too long: {mobile}")
+            records[i]['mobile'] = mobile_bytes
+            records[i]['userName'] = _encode_text(user_name, META_DTYPE['userName'].itemsize)
+            records[i]['registeredAt'] = registered_at if registered_at is not None else now
+            records[i]['vector'] = vector
+
+        with self.write_lock():
+            self.refresh()
+            if self._log_dtype is not None and self._log_dtype != DTYPES[DTYPE_CODES[self.dtype]]:
+                # Log was written with a different precision; rewrite it before appending
+                self._compact_locked()
+            new_log = not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0
+            with open(self.log_path, 'ab') as f:
+                if new_log:
+                    f.write(self._header(0))
+                f.write(records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._read_log()
+            if self.compact_every and self.delta_size >= self.compact_every:
+                self._compact_locked()
+
+    def compact(self):
+        """Fold the append log into a fresh base file, keeping the latest record per mobile"""
+        with self.write_lock():
+            self.refresh()
+            self._compact_locked()
+
+    def _compact_locked(self):
+        rows = []
+        for mobile, (segment, row) in self.index.items():
+            rows.append((mobile, segment, row))
+        rows.sort(key=lambda item: item[0])
+
+        count = len(rows)
+        vector_dtype = DTYPES[DTYPE_CODES[self.dtype]]
+        meta = np.zeros(count, dtype=META_DTYPE)
+        tmp_path = f'{self.base_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._header(count, self.generation + 1))
+            vectors = np.zeros((count, self.dim), dtype=vector_dtype)
+            for i, (mobile, segment, row) in enumerate(rows):
+                if segment == 'base':
+                    vectors[i] = self.base_vectors[row]
+                    meta[i] = self.base_meta[row]
+                else:
+                    vectors[i] = self.delta_vectors[row]
+                    user = self.delta_meta[row]
+                    meta[i]['mobile'] = user['mobile'].encode('utf-8')
+                    meta[i]['userName'] = _encode_text(user['userName'], META_DTYPE['userName'].itemsize)
+                    meta[i]['registeredAt'] = user['registeredAt']
+            f.write(vectors.tobytes())
+            f.write(meta.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.base_path)
+
+        tmp_log = f'{self.log_path}.{os.getpid()}.tmp'
+        with open(tmp_log, 'wb') as f:
+            f.write(self._header(0, self.generation + 1))
+        os.replace(tmp_log, self.log_path)
+        self.open()
+
+    def _header(self, count, generation=None):
+        return HEADER.pack(
+            MAGIC, FORMAT_VERSION, DTYPE_CODES[self.dtype], self.dim, count,
+            self.generation if generation is None else generation,
+        )
+
+    def _read_header(self, f, path):
+        raw = f.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            return None
+        magic, version, dtype_code, dim, count, generation = HEADER.unpack(raw)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a face template file (version {version})")
+        if dim != self.dim:
+            raise ValueError(f"{path} stores {dim}-dim templates, expected {self.dim}")
+        return DTYPES[dtype_code], count, generation
+
+    def _map_base(self):
+        self._base_stat = self._stat(self.base_path)
+        self.index = {}
+        if self._base_stat is None:
+            self.generation = 0
+            self.base_vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.base_meta = np.zeros(0, dtype=META_DTYPE)
+            self.base_live = np.zeros(0, dtype=bool)
+            return
+
+        with open(self.base_path, 'rb') as f:
+            vector_dtype, count, generation = self._read_header(f, self.base_path)
+        self.generation = generation
+        if count == 0:
+            self.base_vectors = np.zeros((0, self.dim), dtype=vector_dtype)
+            self.base_meta = np.zeros(0, dtype=META_DTYPE)
+        else:
+            self.base_vectors = np.memmap(
+                self.base_path, dtype=vector_dtype, mode='r',
+                offset=HEADER.size, shape=(count, self.dim),
+            )
+            self.base_meta = np.memmap(
+                self.base_path, dtype=META_DTYPE, mode='r',
+                offset=HEADER.size + count * self.dim * vector_dtype.itemsize, shape=(count,),
+            )
+        self.base_live = np.ones(count, dtype=bool)
+        mobiles = self.base_meta['mobile'].tolist()
+        self.index = {_decode_text(mobile): ('base', row) for row, mobile in enumerate(mobiles)}
+
+    def _reset_delta(self):
+        self.delta_vectors = np.zeros((16, self.dim), dtype=np.float32)
+        self.delta_live = np.zeros(16, dtype=bool)
+        self.delta_meta = []
+        self.delta_size = 0
+
+    def _read_log(self):
+        """Read complete log records written since the last call"""
+        log_stat = self._stat(self.log_path)
+        if log_stat is None:
+            return
+        with open(self.log_path, 'rb') as f:
+            header = self._read_header(f, self.log_path)
+            if header is None:
+                return
+            self._log_ino = log_stat[0]
+            self._log_dtype = header[0]
+            record_dtype = log_record_dtype(self.dim, self._log_dtype)
+            self._log_record_size = record_dtype.itemsize
+            start = max(self._log_offset, HEADER.size)
+            available = (log_stat[2] - start) // record_dtype.itemsize
+            if available > 0:
+                f.seek(start)
+                records = np.fromfile(f, dtype=record_dtype, count=available)
+                self._apply_log_records(records)
+                start += available * record_dtype.itemsize
+            # A half-written tail record is picked up on the next read
+            self._log_offset = start
+
+    def _apply_log_records(self, records):
+        # Snapshots being scored share these arrays: rows past delta_size are free to
+        # write, but a row a snapshot can see is never changed. A re-registration gets
+        # a new delta row, and the superseded row is marked dead in copies of the masks
+        superseded = {'base': [], 'delta': []}
+        for record in records:
+            mobile = _decode_text(record['mobile'])
+            location = self.index.get(mobile)
+            if location is not None:
+                superseded[location[0]].append(location[1])
+            row = self.delta_size
+            if row >= self.delta_vectors.shape[0]:
+                capacity = max(self.delta_vectors.shape[0] * 2, 16)
+                grown = np.zeros((capacity, self.dim), dtype=np.float32)
+                grown[:row] = self.delta_vectors[:row]
+                self.delta_vectors = grown
+                grown_live = np.zeros(capacity, dtype=bool)
+                grown_live[:row] = self.delta_live[:row]
+                self.delta_live = grown_live
+            self.delta_vectors[row] = record['vector']
+            self.delta_live[row] = True
+            self.delta_meta.append({
+                'mobile': mobile,
+                'userName': _decode_text(record['userName']),
+                'registeredAt': float(record['registeredAt']),
+            })
+            self.delta_size += 1
+            self.index[mobile] = ('delta', row)
+        if superseded['base']:
+            base_live = self.base_live.copy()
+            base_live[superseded['base']] = False
+            self.base_live = base_live
+        if superseded['delta']:
+            delta_live = self.delta_live.copy()
+            delta_live[superseded['delta']] = False
+            self.delta_live = delta_live
+
+    @staticmethod
+    def _meta_to_dict(meta):
+        return {
+            'mobile': _decode_text(meta['mobile']),
+            'userName': _decode_text(meta['userName']),
+            'registeredAt': float(meta['registeredAt']),
+        }
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def migrate_json_templates(json_dir, store, normalize):
+    """
+    One-shot import of legacy `{mobile}.json` registrations into a TemplateStore.
+    Runs under the store's write lock and does nothing if the store already has
+    templates, so gunicorn workers starting together migrate only once.
+
+    Args:
+        json_dir: Directory holding the legacy JSON files
+        store: Destination TemplateStore
+        normalize: Function turning a raw histogram into the stored vector
+
+    Returns:
+        Number of templates migrated
+    """
+    with store.write_lock():
+        if store.exists():
+            return 0
+        return _migrate_json_templates_locked(json_dir, store, normalize)
+
+
+def _legacy_json_files(json_dir):
+    """(filename, path, mobile, parsed registration) of every legacy JSON file; unreadable ones are skipped"""
+    for filename in sorted(os.listdir(json_dir)):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(json_dir, filename)
+        try:
+            with open(path, 'r') as f:
+                user_data = json.load(f)
+            mobile = str(user_data['mobile'])
+        except Exception as e:
+            print(f"Skipping face template {filename}: {str(e)}")
+            continue
+        yield filename, path, mobile, user_data
+
+
+def _migrate_json_templates_locked(json_dir, store, normalize):
+    items = []
+    for filename, _, mobile, user_data in _legacy_json_files(json_dir):
+        try:
+            histogram = np.asarray(user_data['faceHistogram'], dtype=np.float32)
+        except Exception as e:
+            print(f"Skipping face template {filename}: {str(e)}")
+            continue
+        if histogram.shape != (store.dim,):
+            print(f"Skipping face template {filename}: unexpected histogram size {histogram.size}")
+            continue
+        registered_at = None
+        if user_data.get('registeredAt'):
+            try:
+                registered_at = datetime.fromisoformat(user_data['registeredAt']).timestamp()
+            except ValueError:
+                pass
+        items.append((mobile, user_data.get('userName', 'User'), normalize(histogram), registered_at))
+
+    if items:
+        store.append_many(items)
+        store.compact()
+    return len(items)
+
+
+def remove_migrated_json(json_dir, store):
+    """
+    Delete the legacy JSON files whose mobile the store holds, however they got there
+    (e.g. imported at startup). Files for mobiles it lacks are left alone.
+
+    Returns:
+        Number of files removed
+    """
+    removed = 0
+    with store.write_lock():
+        store.refresh()
+        for _, path, mobile, _ in _legacy_json_files(json_dir):
+            if mobile in store:
+                os.remove(path)
+                removed += 1
+    return removed
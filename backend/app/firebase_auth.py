@@ -63,22 +63,47 @@ def optional_auth(f):
     """Decorator for optional authentication - adds user info if token is present"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = None
-        
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-        
-        if token:
-            try:
-                decoded_token = auth.verify_id_token(token)
-                request.user = decoded_token
-            except:
-                request.user = None
-        else:
-            request.user = None
+        request.user = optional_user(request.headers.get('Authorization'))
         
         return f(*args, **kwargs)
     
     return decorated_function
+
+
+def optional_user(auth_header):
+    """Decoded Firebase token from an `Authorization: Bearer` header, or None"""
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    try:
+        return auth.verify_id_token(auth_header.split(' ')[1])
+    except:
+        return None
+
+
+# Comma-separated emails whose Firebase tokens may use the admin endpoints, besides
+# tokens carrying an `admin: true` custom claim
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+
+def is_admin(decoded_token):
+    if not decoded_token:
+        return False
+    if decoded_token.get("admin") is True:
+        return True
+    email = decoded_token.get("email")
+    return bool(email) and decoded_token.get("email_verified", False) and email.lower() in ADMIN_EMAILS
+
+
+def admin_required(f):
+    """Decorator allowing only admins (see is_admin); 401 without a valid token, 403 for other users"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        decoded_token = optional_user(request.headers.get('Authorization'))
+        if not decoded_token:
+            return jsonify({'error': 'Admin token required', 'ok': False}), 401
+        if not is_admin(decoded_token):
+            return jsonify({'error': 'Admin access required', 'ok': False}), 403
+        request.user = decoded_token
+        return f(*args, **kwargs)
+    
+    return decorated_function
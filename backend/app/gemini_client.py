@@ -0,0 +1,880 @@
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent import futures
+
+import httpx
+import requests
+from google import genai
+from google.genai import errors
+from google.genai._api_client import HttpResponse, RequestJsonEncoder
+
+from .gemini_resilience import (
+    GEMINI_HEDGE,
+    GEMINI_MAX_RETRIES,
+    CircuitBreaker,
+    CircuitOpenError,
+    Deadline,
+    GeminiDeadlineExceeded,
+    GeminiUnavailableError,
+    LatencyTracker,
+    ResilienceStats,
+    backoff_delay,
+    current_deadline,
+    deadline_for,
+    is_transient,
+    read_timeout,
+)
+from .metrics import ai_errors, ai_inflight
+from .tracing import span
+
+# Calls allowed to wait on the model at once per worker process; further calls queue
+GEMINI_MAX_INFLIGHT = int(os.environ.get('GEMINI_MAX_INFLIGHT', 8))
+# How long a queued call waits for a free slot before giving up
+GEMINI_QUEUE_TIMEOUT = float(os.environ.get('GEMINI_QUEUE_TIMEOUT', 30))
+# The same limit for the ASGI app's calls, which wait on the event loop instead of a
+# thread each, so one process can keep far more of them open
+GEMINI_ASYNC_MAX_INFLIGHT = int(os.environ.get('GEMINI_ASYNC_MAX_INFLIGHT', 512))
+GEMINI_CONNECT_TIMEOUT = float(os.environ.get('GEMINI_CONNECT_TIMEOUT', 5))
+GEMINI_READ_TIMEOUT = float(os.environ.get('GEMINI_READ_TIMEOUT', 120))
+# Optional endpoint override, e.g. a local fake server in tests
+GEMINI_BASE_URL = os.environ.get('GEMINI_BASE_URL')
+# How long a coalesced caller waits for the shared call before giving up
+AI_SINGLEFLIGHT_TIMEOUT = float(os.environ.get('AI_SINGLEFLIGHT_TIMEOUT', 90))
+
+
+class GeminiBusyError(GeminiUnavailableError):
+    """Raised when no in-flight slot frees up within GEMINI_QUEUE_TIMEOUT"""
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised to a caller that gave up waiting on another caller's identical request"""
+
+
+class TruncatedResponse:
+    """
+    Returned instead of the SDK's response when the model answered but the SDK could
+    not json-parse a schema-constrained answer (it was cut off); `text` keeps the raw
+    answer for the caller to repair, e.g. with parse_partial_json.
+    """
+
+    def __init__(self, error):
+        self.text = error.doc
+        self.error = error
+
+
+def gemini_api_key():
+    api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY or GOOGLE_API_KEY environment variable is required")
+    return api_key
+
+
+class SessionTransport:
+    """
+    Sends the SDK's HTTP requests over one pooled requests.Session.
+
+    google-genai opens a fresh Session (and so a fresh TCP/TLS connection) for
+    every call; routing them through a shared session keeps connections alive
+    between calls. Any object with the same send(http_request, stream) method can
+    stand in for it, e.g. a fake that returns canned responses in tests.
+    """
+
+    def __init__(self, pool_size=GEMINI_MAX_INFLIGHT, timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send(self, http_request, stream=False):
+        data = http_request.data or None
+        if data is not None and not isinstance(data, bytes):
+            data = json.dumps(data, cls=RequestJsonEncoder)
+        connect, read = self.timeout
+        response = self.session.request(
+            http_request.method.upper(),
+            http_request.url,
+            headers=http_request.headers,
+            data=data,
+            stream=stream,
+            timeout=(connect, read_timeout(read)),
+        )
+        errors.APIError.raise_for_response(response)
+        return HttpResponse(response.headers, response if stream else [response.text])
+
+    def close(self):
+        self.session.close()
+
+
+class _ErrorBody:
+    """Error payload in the shape errors.APIError reads from non-requests responses"""
+
+    def __init__(self, status_code, text):
+        try:
+            body = json.loads(text)
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            body = {'error': {'code': status_code, 'message': text}}
+        self.body_segments = [body]
+
+
+def raise_for_status(status_code, text):
+    """Raise the SDK's ClientError/ServerError for a failed httpx response"""
+    if status_code == 200:
+        return
+    if 400 <= status_code < 500:
+        raise errors.ClientError(status_code, _ErrorBody(status_code, text))
+    if 500 <= status_code < 600:
+        raise errors.ServerError(status_code, _ErrorBody(status_code, text))
+    raise errors.APIError(status_code, _ErrorBody(status_code, text))
+
+
+class AsyncSessionTransport:
+    """
+    SessionTransport for the event loop: one pooled httpx.AsyncClient.
+
+    The SDK's async client only moves the blocking requests call onto a thread,
+    which would cap concurrency at the thread pool size. Fakes for tests implement
+    the same send(http_request) and stream(http_request) coroutines.
+    """
+
+    def __init__(self, pool_size=GEMINI_ASYNC_MAX_INFLIGHT, timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT)):
+        connect, read = timeout
+        self.timeout = timeout
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read, connect=connect),
+        )
+
+    def _timeout(self):
+        connect, read = self.timeout
+        return httpx.Timeout(read_timeout(read), connect=connect)
+
+    @staticmethod
+    def _body(http_request):
+        data = http_request.data or None
+        if data is not None and not isinstance(data, bytes):
+            data = json.dumps(data, cls=RequestJsonEncoder)
+        return data
+
+    async def send(self, http_request):
+        response = await self.client.request(
+            http_request.method.upper(),
+            http_request.url,
+            headers=http_request.headers,
+            content=self._body(http_request),
+            timeout=self._timeout(),
+        )
+        raise_for_status(response.status_code, response.text)
+        return HttpResponse(response.headers, [response.text])
+
+    async def stream(self, http_request):
+        """Yields the decoded JSON objects of a server-sent-events response"""
+        async with self.client.stream(
+            http_request.method.upper(),
+            http_request.url,
+            headers=http_request.headers,
+            content=self._body(http_request),
+            timeout=self._timeout(),
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise_for_status(response.status_code, response.text)
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                if line.startswith('data: '):
+                    line = line[len('data: '):]
+                yield json.loads(line)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class CallStats:
+    """Thread-safe per-kind counters of queue wait and call duration in milliseconds"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+        self.inflight = 0
+        self.peak_inflight = 0
+
+    def start(self):
+        with self._lock:
+            self.inflight += 1
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+        ai_inflight.inc()
+
+    def finish(self, kind, wait_ms, call_ms, ok, first_chunk_ms=None):
+        ai_inflight.dec()
+        with self._lock:
+            self.inflight -= 1
+            entry = self._kinds.setdefault(kind, {
+                'calls': 0, 'errors': 0, 'waitMs': 0.0, 'maxWaitMs': 0.0, 'callMs': 0.0, 'maxCallMs': 0.0,
+                'firstChunks': 0, 'firstChunkMs': 0.0, 'maxFirstChunkMs': 0.0,
+            })
+            entry['calls'] += 1
+            entry['errors'] += 0 if ok else 1
+            entry['waitMs'] += wait_ms
+            entry['maxWaitMs'] = max(entry['maxWaitMs'], wait_ms)
+            entry['callMs'] += call_ms
+            entry['maxCallMs'] = max(entry['maxCallMs'], call_ms)
+            if first_chunk_ms is not None:
+                entry['firstChunks'] += 1
+                entry['firstChunkMs'] += first_chunk_ms
+                entry['maxFirstChunkMs'] = max(entry['maxFirstChunkMs'], first_chunk_ms)
+
+    def summary(self):
+        with self._lock:
+            kinds = {}
+            for kind, entry in self._kinds.items():
+                calls = entry['calls']
+                kinds[kind] = {
+                    'calls': calls,
+                    'errors': entry['errors'],
+                    'avgWaitMs': round(entry['waitMs'] / calls, 3),
+                    'maxWaitMs': round(entry['maxWaitMs'], 3),
+                    'avgCallMs': round(entry['callMs'] / calls, 3),
+                    'maxCallMs': round(entry['maxCallMs'], 3),
+                }
+                if entry['firstChunks']:
+                    # Streamed calls: time from sending the request to the first chunk
+                    kinds[kind]['avgFirstChunkMs'] = round(entry['firstChunkMs'] / entry['firstChunks'], 3)
+                    kinds[kind]['maxFirstChunkMs'] = round(entry['maxFirstChunkMs'], 3)
+            return {'inflight': self.inflight, 'peakInflight': self.peak_inflight, 'calls': kinds}
+
+
+class GeminiClientManager:
+    """
+    One genai.Client per worker process, shared by all request threads.
+
+    The client and its transport are created on first use and recreated in a
+    forked child (gunicorn workers fork from the master), so no connection or
+    lock is ever shared across processes. At most max_inflight calls run at once;
+    the rest wait up to queue_timeout for a slot.
+
+    Every call has a deadline for its kind (gemini_resilience.GEMINI_DEADLINES),
+    transient failures are retried with jittered backoff inside it, and a circuit
+    breaker refuses calls outright while the upstream keeps failing, so callers
+    fall back at once instead of each waiting out the outage.
+    """
+
+    def __init__(self, max_inflight=GEMINI_MAX_INFLIGHT, queue_timeout=GEMINI_QUEUE_TIMEOUT, base_url=GEMINI_BASE_URL,
+                 async_max_inflight=GEMINI_ASYNC_MAX_INFLIGHT, max_retries=GEMINI_MAX_RETRIES, hedge=GEMINI_HEDGE):
+        self.max_inflight = max_inflight
+        self.async_max_inflight = async_max_inflight
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.base_url = base_url
+        self._custom_transport = None
+        self._custom_async_transport = None
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """Drop all per-process state; the next call builds it again"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._client = None
+        self._transport = self._custom_transport
+        # asyncio primitives belong to one event loop; they are rebuilt for a new loop
+        self._loop = None
+        self._async_slots = None
+        self._async_transport = self._custom_async_transport
+        self._executor = None
+        self.clients_created = 0
+        self.stats = CallStats()
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self.resilience = ResilienceStats()
+
+    def _check_pid(self):
+        # register_at_fork covers os.fork; this also catches forks that bypass it
+        if self._pid != os.getpid():
+            self._reset()
+
+    @property
+    def transport(self):
+        self._check_pid()
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    self._transport = SessionTransport(pool_size=self.max_inflight)
+        return self._transport
+
+    def set_transport(self, transport):
+        """Route all calls through `transport` (None restores the pooled session)"""
+        self._check_pid()
+        with self._lock:
+            self._custom_transport = transport
+            self._transport = transport
+
+    def _loop_state(self):
+        """(semaphore, transport) for the running event loop"""
+        self._check_pid()
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._async_slots = asyncio.Semaphore(self.async_max_inflight)
+            self._async_transport = self._custom_async_transport or AsyncSessionTransport(self.async_max_inflight)
+        return self._async_slots, self._async_transport
+
+    def set_async_transport(self, transport):
+        """Route the ASGI app's calls through `transport` (None restores httpx)"""
+        self._custom_async_transport = transport
+        self._loop = None
+
+    async def aclose(self):
+        """Close the event loop's connection pool (ASGI lifespan shutdown)"""
+        if isinstance(self._async_transport, AsyncSessionTransport):
+            await self._async_transport.close()
+        self._loop = None
+
+    def _patch_async(self, api_client):
+        async def async_request(http_request, stream=False):
+            return await self._loop_state()[1].send(http_request)
+
+        async def async_request_streamed(http_method, path, request_dict, http_options=None):
+            http_request = api_client._build_request(http_method, path, request_dict, http_options)
+            async for chunk in self._loop_state()[1].stream(http_request):
+                yield chunk
+
+        api_client._async_request = async_request
+        api_client.async_request_streamed = async_request_streamed
+
+    def client(self):
+        """The shared genai.Client for this process"""
+        self._check_pid()
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    http_options = {'base_url': self.base_url} if self.base_url else None
+                    client = genai.Client(api_key=gemini_api_key(), http_options=http_options)
+                    # The transport is looked up per call so set_transport also
+                    # applies to an existing client
+                    client._api_client._request_unauthorized = (
+                        lambda http_request, stream=False: self.transport.send(http_request, stream)
+                    )
+                    if not client._api_client.vertexai:
+                        self._patch_async(client._api_client)
+                    self._client = client
+                    self.clients_created += 1
+        return self._client
+
+    def _acquire_slot(self, deadline):
+        """Waits for an in-flight slot; returns the wait in milliseconds"""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=max(0.0, min(self.queue_timeout, deadline.remaining()))):
+            if deadline.expired():
+                raise GeminiDeadlineExceeded(f"Gemini deadline of {deadline.seconds}s passed while queued")
+            raise GeminiBusyError(f"Timed out after {self.queue_timeout}s waiting for a free Gemini slot")
+        return (time.perf_counter() - start) * 1000
+
+    def _run(self, kind, client, kwargs, deadline, wait_ms):
+        """One generate_content attempt in a slot the caller acquired (released here)"""
+        self.stats.start()
+        ok = False
+        start = time.perf_counter()
+        token = current_deadline.set(deadline)
+        try:
+            # One span per attempt, so retries and hedges show in the request's trace
+            with span(f"gemini.{kind}"):
+                try:
+                    response = client.models.generate_content(**kwargs)
+                except json.JSONDecodeError as e:
+                    response = self._truncated(kind, e)
+            ok = True
+            self.latency.record(kind, time.perf_counter() - start)
+            return response
+        finally:
+            current_deadline.reset(token)
+            self.stats.finish(kind, wait_ms, (time.perf_counter() - start) * 1000, ok)
+            self._slots.release()
+
+    def _truncated(self, kind, error):
+        """
+        The SDK json-parses schema-constrained answers itself and raises on a cut-off
+        one after the upstream call succeeded; that is an answer, not a failure to
+        retry or count against the breaker
+        """
+        self.resilience.count(kind, 'truncated')
+        return TruncatedResponse(error)
+
+    def _attempt(self, kind, client, kwargs, deadline):
+        return self._run(kind, client, kwargs, deadline, self._acquire_slot(deadline))
+
+    def _hedge_executor(self):
+        self._check_pid()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = futures.ThreadPoolExecutor(self.max_inflight * 2, thread_name_prefix='gemini-hedge')
+        return self._executor
+
+    def _hedged(self, kind, client, kwargs, deadline, delay):
+        """
+        Runs the attempt on a pool thread; if it has not answered after `delay` and a
+        slot is free, sends a duplicate and returns whichever succeeds first. The
+        slower call cannot be interrupted and finishes in the background.
+        """
+        primary = self._hedge_executor().submit(self._attempt, kind, client, kwargs, deadline)
+        done, _ = futures.wait([primary], timeout=delay)
+        if done or not self._slots.acquire(blocking=False):
+            return primary.result()
+        self.resilience.count(kind, 'hedges')
+        hedge = self._hedge_executor().submit(self._run, kind, client, kwargs, deadline, 0.0)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.resilience.count(kind, 'hedgeWins')
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _retry_delay(self, kind, error, attempt, deadline):
+        """
+        Records a failed attempt with the breaker and returns how long to sleep before
+        the next one, or raises when the call should not be retried. Upstream trouble
+        that outlasts the retries or the deadline is raised as GeminiUnavailableError.
+        """
+        ai_errors.labels(kind, type(error).__name__).inc()
+        if isinstance(error, GeminiBusyError):
+            # Our own queue was full; says nothing about the upstream
+            self.breaker.release()
+            raise error
+        if isinstance(error, GeminiDeadlineExceeded):
+            self.breaker.record_failure()
+            self.resilience.count(kind, 'deadlineExceeded')
+            raise error
+        if not is_transient(error):
+            # The upstream answered (e.g. 400) or the failure is ours
+            if isinstance(error, errors.APIError):
+                self.breaker.record_success()
+            else:
+                self.breaker.release()
+            raise error
+        self.breaker.record_failure()
+        delay = backoff_delay(attempt)
+        if delay >= deadline.remaining():
+            self.resilience.count(kind, 'deadlineExceeded')
+            raise GeminiDeadlineExceeded(f"Gemini deadline of {deadline.seconds}s passed: {error}") from error
+        if attempt >= self.max_retries:
+            self.resilience.count(kind, 'unavailable')
+            raise GeminiUnavailableError(f"Gemini failed after {attempt + 1} attempts: {error}") from error
+        self.resilience.count(kind, 'retries')
+        return delay
+
+    def _check_breaker(self, kind):
+        if not self.breaker.allow():
+            self.resilience.count(kind, 'rejected')
+            ai_errors.labels(kind, 'CircuitOpenError').inc()
+            raise CircuitOpenError("Gemini circuit breaker is open; skipping the model")
+
+    def generate_content(self, kind, **kwargs):
+        """
+        client.models.generate_content with the in-flight limit, deadline, retries,
+        hedging and circuit breaker applied, and timing recorded.
+
+        Args:
+            kind: Label the call's timings are recorded under (e.g. 'chatbot'); also
+                selects its deadline from GEMINI_DEADLINES
+            **kwargs: Passed through to generate_content
+
+        Raises:
+            GeminiUnavailableError: the breaker is open, the deadline passed, or the
+                upstream kept failing; GeminiBusyError when no slot freed up in time
+        """
+        client = self.client()
+        deadline = Deadline(deadline_for(kind))
+        attempt = 0
+        while True:
+            self._check_breaker(kind)
+            delay = self.latency.hedge_delay(kind) if self.hedge else None
+            try:
+                if delay is not None and delay < deadline.remaining():
+                    response = self._hedged(kind, client, kwargs, deadline, delay)
+                else:
+                    response = self._attempt(kind, client, kwargs, deadline)
+            except Exception as e:
+                time.sleep(self._retry_delay(kind, e, attempt, deadline))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return response
+
+    def _stream_once(self, kind, client, kwargs, deadline):
+        """
+        One generate_content_stream attempt. The in-flight slot is held until the
+        stream is exhausted or closed, and the time to the first chunk is recorded
+        next to the total duration.
+        """
+        wait_ms = self._acquire_slot(deadline)
+        self.stats.start()
+        ok = False
+        first_chunk_ms = None
+        stream = None
+        start = time.perf_counter()
+        try:
+            stream = client.models.generate_content_stream(**kwargs)
+            while True:
+                # The SDK sends the request on the first next(); the deadline caps its read timeout
+                token = current_deadline.set(deadline)
+                try:
+                    chunk = next(stream)
+                except StopIteration:
+                    break
+                finally:
+                    current_deadline.reset(token)
+                if first_chunk_ms is None:
+                    first_chunk_ms = (time.perf_counter() - start) * 1000
+                yield chunk
+            ok = True
+        except GeneratorExit:
+            # The consumer went away (e.g. the browser closed the connection)
+            ok = True
+            raise
+        finally:
+            if stream is not None:
+                stream.close()
+            self.stats.finish(kind, wait_ms, (time.perf_counter() - start) * 1000, ok, first_chunk_ms)
+            self._slots.release()
+
+    def generate_content_stream(self, kind, **kwargs):
+        """
+        client.models.generate_content_stream under the same limit, deadline and
+        breaker, yielding chunks. The deadline bounds the wait for the first chunk and
+        for each gap after it. Failures before the first chunk are retried; later ones
+        are raised, since text has already been passed on.
+        """
+        client = self.client()
+        deadline = Deadline(deadline_for(kind))
+        attempt = 0
+        while True:
+            self._check_breaker(kind)
+            produced = False
+            try:
+                with contextlib.closing(self._stream_once(kind, client, kwargs, deadline)) as chunks:
+                    for chunk in chunks:
+                        produced = True
+                        yield chunk
+            except GeneratorExit:
+                if produced:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                delay = self._retry_delay(kind, e, self.max_retries if produced else attempt, deadline)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return
+
+    async def _aacquire_slot(self, slots, deadline):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(slots.acquire(), max(0.0, min(self.queue_timeout, deadline.remaining())))
+        except asyncio.TimeoutError:
+            if deadline.expired():
+                raise GeminiDeadlineExceeded(f"Gemini deadline of {deadline.seconds}s passed while queued")
+            raise GeminiBusyError(f"Timed out after {self.queue_timeout}s waiting for a free Gemini slot")
+        return (time.perf_counter() - start) * 1000
+
+    async def _aattempt(self, kind, client, kwargs, deadline):
+        slots, _ = self._loop_state()
+        wait_ms = await self._aacquire_slot(slots, deadline)
+        self.stats.start()
+        ok = False
+        start = time.perf_counter()
+        token = current_deadline.set(deadline)
+        try:
+            with span(f"gemini.{kind}"):
+                try:
+                    response = await asyncio.wait_for(
+                        client.aio.models.generate_content(**kwargs), max(0.0, deadline.remaining())
+                    )
+                except json.JSONDecodeError as e:
+                    response = self._truncated(kind, e)
+            ok = True
+            self.latency.record(kind, time.perf_counter() - start)
+            return response
+        except asyncio.TimeoutError:
+            raise GeminiDeadlineExceeded(f"Gemini deadline of {deadline.seconds}s passed")
+        finally:
+            current_deadline.reset(token)
+            self.stats.finish(kind, wait_ms, (time.perf_counter() - start) * 1000, ok)
+            slots.release()
+
+    async def _ahedged(self, kind, client, kwargs, deadline, delay):
+        """_hedged for coroutines; the slower call is cancelled"""
+        slots, _ = self._loop_state()
+        primary = asyncio.ensure_future(self._aattempt(kind, client, kwargs, deadline))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or slots.locked():
+                return await primary
+            self.resilience.count(kind, 'hedges')
+            hedge = asyncio.ensure_future(self._aattempt(kind, client, kwargs, deadline))
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.resilience.count(kind, 'hedgeWins')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def agenerate_content(self, kind, **kwargs):
+        """generate_content for coroutines: waits on the event loop, not in a thread"""
+        client = self.client()
+        deadline = Deadline(deadline_for(kind))
+        attempt = 0
+        while True:
+            self._check_breaker(kind)
+            delay = self.latency.hedge_delay(kind) if self.hedge else None
+            try:
+                if delay is not None and delay < deadline.remaining():
+                    response = await self._ahedged(kind, client, kwargs, deadline, delay)
+                else:
+                    response = await self._aattempt(kind, client, kwargs, deadline)
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(kind, e, attempt, deadline))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return response
+
+    async def _astream_once(self, kind, client, kwargs, deadline):
+        slots, _ = self._loop_state()
+        wait_ms = await self._aacquire_slot(slots, deadline)
+        self.stats.start()
+        ok = False
+        first_chunk_ms = None
+        stream = None
+        start = time.perf_counter()
+        # The transport caps the stream's read timeout with the deadline when it sends the request
+        token = current_deadline.set(deadline)
+        try:
+            stream = client.aio.models.generate_content_stream(**kwargs)
+            async for chunk in stream:
+                if first_chunk_ms is None:
+                    first_chunk_ms = (time.perf_counter() - start) * 1000
+                    current_deadline.reset(token)
+                    token = None
+                yield chunk
+            ok = True
+        except GeneratorExit:
+            ok = True
+            raise
+        finally:
+            if token is not None:
+                current_deadline.reset(token)
+            if stream is not None:
+                await stream.aclose()
+            self.stats.finish(kind, wait_ms, (time.perf_counter() - start) * 1000, ok, first_chunk_ms)
+            slots.release()
+
+    async def agenerate_content_stream(self, kind, **kwargs):
+        """generate_content_stream for coroutines"""
+        client = self.client()
+        deadline = Deadline(deadline_for(kind))
+        attempt = 0
+        while True:
+            self._check_breaker(kind)
+            produced = False
+            chunks = self._astream_once(kind, client, kwargs, deadline)
+            try:
+                async for chunk in chunks:
+                    produced = True
+                    yield chunk
+            except GeneratorExit:
+                if produced:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                delay = self._retry_delay(kind, e, self.max_retries if produced else attempt, deadline)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            finally:
+                await chunks.aclose()
+            self.breaker.record_success()
+            return
+
+    def summary(self):
+        self._check_pid()
+        return {
+            'pid': self._pid,
+            'maxInflight': self.max_inflight,
+            'asyncMaxInflight': self.async_max_inflight,
+            'clientsCreated': self.clients_created,
+            'transport': type(self._transport).__name__ if self._transport else None,
+            **self.stats.summary(),
+            'breaker': self.breaker.summary(),
+            'resilience': self.resilience.summary(),
+            'hedging': self.hedge,
+        }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one.
+
+    The first caller for a key runs the function; callers arriving while it runs
+    wait for it and receive the same result, or have the same exception raised.
+    Nothing is remembered once the call finishes, so this only merges calls that
+    overlap in time (the analysis cache covers repeats).
+    """
+
+    def __init__(self, timeout=AI_SINGLEFLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Calls in flight at fork time belong to threads the child does not have
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._kinds = {}
+
+    def _count(self, kind, name):
+        entry = self._kinds.setdefault(kind, {'upstreamCalls': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0})
+        entry[name] += 1
+
+    def do(self, kind, key, fn, timeout=None):
+        """
+        Run fn() once for all concurrent callers of (kind, key).
+
+        Raises:
+            SingleFlightTimeout: when waiting on another caller's call took longer than timeout
+        """
+        flight_key = (kind, key)
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_key] = _Flight()
+                self._count(kind, 'upstreamCalls')
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            timeout = self.timeout if timeout is None else timeout
+            if not flight.done.wait(timeout):
+                with self._lock:
+                    self._count(kind, 'timeouts')
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for an identical {kind} request")
+            with self._lock:
+                self._count(kind, 'coalesced')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._count(kind, 'errors')
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+            flight.done.set()
+
+    def summary(self):
+        with self._lock:
+            return {
+                'inflight': len(self._flights),
+                'waiting': sum(flight.waiters for flight in self._flights.values()),
+                'calls': {kind: dict(entry) for kind, entry in self._kinds.items()},
+            }
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines on one event loop: waiters await the leader's future"""
+
+    async def do(self, kind, key, fn, timeout=None):
+        """Await fn() once for all concurrent callers of (kind, key)"""
+        flight_key = (kind, key)
+        # The lock only guards against /api/ai/stats reading from another thread
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_key] = _Flight()
+                flight.done = asyncio.get_running_loop().create_future()
+                self._count(kind, 'upstreamCalls')
+            else:
+                flight.waiters += 1
+
+        if leader:
+            try:
+                result = await fn()
+                flight.done.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                # The leader's client went away; its waiters still get an answer
+                flight.done.set_exception(RuntimeError(f"The shared {kind} request was cancelled"))
+                raise
+            except Exception as e:
+                flight.done.set_exception(e)
+                with self._lock:
+                    self._count(kind, 'errors')
+                raise
+            finally:
+                if not flight.waiters and flight.done.done() and not flight.done.cancelled():
+                    # Mark the exception retrieved so an unawaited flight does not log a warning
+                    flight.done.exception()
+                with self._lock:
+                    del self._flights[flight_key]
+
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            # shield: a waiter timing out must not cancel the leader's call
+            return await asyncio.wait_for(asyncio.shield(flight.done), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._count(kind, 'timeouts')
+            raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for an identical {kind} request")
+        finally:
+            if flight.done.done():
+                with self._lock:
+                    self._count(kind, 'coalesced')
+
+
+gemini = GeminiClientManager()
@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+import requests
+from google.genai import errors
+
+# Total time a call may take, queueing and retries included, per call kind; for the
+# stream kinds it bounds the wait for the first chunk, and for each later one
+GEMINI_DEADLINE_DEFAULT = float(os.environ.get('GEMINI_DEADLINE', 30))
+GEMINI_DEADLINES = {
+    kind: float(os.environ.get(f'GEMINI_DEADLINE_{kind.upper()}', default))
+    for kind, default in {
+        'analyze': 25,
+        'analyze_batch': 40,
+        'chatbot': 15,
+        'chatbot_stream': 15,
+        'chat_summary': 30,
+        'summary': 45,
+    }.items()
+}
+# Retries after a transient failure (429, 5xx, timeouts, connection errors), with
+# full-jitter exponential backoff between GEMINI_RETRY_BASE and GEMINI_RETRY_CAP seconds
+GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', 2))
+GEMINI_RETRY_BASE = float(os.environ.get('GEMINI_RETRY_BASE', 0.25))
+GEMINI_RETRY_CAP = float(os.environ.get('GEMINI_RETRY_CAP', 4))
+# Hedging: when a call has not answered after the kind's recent p95 latency, send
+# one duplicate and take whichever answers first. Off by default (it costs quota)
+GEMINI_HEDGE = os.environ.get('GEMINI_HEDGE', '').lower() in ('1', 'true', 'yes')
+GEMINI_HEDGE_PERCENTILE = float(os.environ.get('GEMINI_HEDGE_PERCENTILE', 0.95))
+GEMINI_HEDGE_MIN_DELAY = float(os.environ.get('GEMINI_HEDGE_MIN_DELAY', 0.5))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.environ.get('GEMINI_HEDGE_MIN_SAMPLES', 20))
+# Circuit breaker: opens after this many failures in a row, or when at least this
+# share of the last GEMINI_BREAKER_WINDOW attempts failed; stays open for the cooldown
+GEMINI_BREAKER_FAILURES = int(os.environ.get('GEMINI_BREAKER_FAILURES', 5))
+GEMINI_BREAKER_FAILURE_RATE = float(os.environ.get('GEMINI_BREAKER_FAILURE_RATE', 0.5))
+GEMINI_BREAKER_WINDOW = int(os.environ.get('GEMINI_BREAKER_WINDOW', 20))
+GEMINI_BREAKER_COOLDOWN = float(os.environ.get('GEMINI_BREAKER_COOLDOWN', 30))
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class GeminiUnavailableError(RuntimeError):
+    """The model cannot answer in time; callers should answer from their local fallback"""
+
+
+class CircuitOpenError(GeminiUnavailableError):
+    """Raised without calling the model while the circuit breaker is open"""
+
+
+class GeminiDeadlineExceeded(GeminiUnavailableError, TimeoutError):
+    """Raised when a call's deadline passes, whether queued, waiting on the model or between retries"""
+
+
+# The deadline of the call running in this thread or task; the transports cap their
+# read timeout with it since the SDK has no per-request timeout
+current_deadline = contextvars.ContextVar('gemini_deadline', default=None)
+
+
+def deadline_for(kind):
+    return GEMINI_DEADLINES.get(kind, GEMINI_DEADLINE_DEFAULT)
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def read_timeout(default):
+    """`default` capped by the current call's remaining deadline"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise GeminiDeadlineExceeded(f"Gemini deadline of {deadline.seconds}s passed")
+    return min(default, remaining)
+
+
+def is_transient(error):
+    """Failures worth retrying, and that count against the upstream's health"""
+    if isinstance(error, errors.APIError):
+        return error.code in TRANSIENT_STATUS_CODES
+    return isinstance(error, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        httpx.TransportError,
+        asyncio.TimeoutError,
+        TimeoutError,
+    ))
+
+
+def backoff_delay(attempt, base=GEMINI_RETRY_BASE, cap=GEMINI_RETRY_CAP):
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Recent successful call durations per kind, for the hedging delay"""
+
+    def __init__(self, size=256, percentile=GEMINI_HEDGE_PERCENTILE, min_samples=GEMINI_HEDGE_MIN_SAMPLES,
+                 min_delay=GEMINI_HEDGE_MIN_DELAY):
+        self.size = size
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, kind, seconds):
+        with self._lock:
+            self._samples.setdefault(kind, deque(maxlen=self.size)).append(seconds)
+
+    def hedge_delay(self, kind):
+        """Seconds to wait before hedging, or None until enough calls were seen"""
+        with self._lock:
+            samples = sorted(self._samples.get(kind, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, samples[min(len(samples) - 1, int(self.percentile * len(samples)))])
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. Open: calls are refused for `cooldown` seconds.
+    Half-open: one trial call is let through; its success closes the breaker, its
+    failure opens it again. Thread-safe; shared by sync and async calls.
+    """
+
+    def __init__(self, failures=GEMINI_BREAKER_FAILURES, failure_rate=GEMINI_BREAKER_FAILURE_RATE,
+                 window=GEMINI_BREAKER_WINDOW, cooldown=GEMINI_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+        self.state = 'closed'
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if self.state == 'open' and now - self._opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._trial_started = None
+            if self.state == 'half_open' and (self._trial_started is None or now - self._trial_started >= self.cooldown):
+                # A trial that never reported back (e.g. its caller gave up) does not block the next one
+                self._trial_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._outcomes.append(True)
+            if self.state != 'closed':
+                self.state = 'closed'
+                self._outcomes.clear()
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == 'open':
+                # A call that started before the breaker opened; the cooldown stands
+                return
+            self._consecutive += 1
+            self._outcomes.append(False)
+            failed = self._outcomes.count(False)
+            if (
+                self.state == 'half_open'
+                or self._consecutive >= self.failures
+                or (len(self._outcomes) >= self._outcomes.maxlen // 2 and failed / len(self._outcomes) >= self.failure_rate)
+            ):
+                if self.state != 'open':
+                    self.opens += 1
+                    print(f"Gemini circuit breaker opened for {self.cooldown}s after repeated failures")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._outcomes.clear()
+                self._consecutive = 0
+
+    def release(self):
+        """A call ended without saying anything about the upstream (e.g. it never got a slot)"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial_started = None
+
+    def summary(self):
+        with self._lock:
+            open_for = self.cooldown - (time.monotonic() - self._opened_at) if self.state == 'open' else 0
+            return {
+                'state': self.state,
+                'opens': self.opens,
+                'rejected': self.rejected,
+                'consecutiveFailures': self._consecutive,
+                'recentFailureRate': round(self._outcomes.count(False) / len(self._outcomes), 3) if self._outcomes else None,
+                'reopensInS': round(max(0.0, open_for), 1),
+            }
+
+
+class ResilienceStats:
+    """
+    Per-kind counts of retries, hedges, deadline misses, calls refused by the breaker
+    and answers the SDK could not parse because they were cut off
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def count(self, kind, name):
+        with self._lock:
+            entry = self._kinds.setdefault(kind, {
+                'retries': 0, 'hedges': 0, 'hedgeWins': 0, 'deadlineExceeded': 0, 'unavailable': 0, 'rejected': 0,
+                'truncated': 0,
+            })
+            entry[name] += 1
+
+    def summary(self):
+        with self._lock:
+            return {kind: dict(entry) for kind, entry in self._kinds.items()}
@@ -0,0 +1,117 @@
+import os
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from .tracing import record_span, span
+
+# Directory where every worker process keeps its samples, so /api/metrics reports the
+# sum over all workers whichever one answers the scrape. gunicorn.conf.py sets it for
+# gunicorn; it must be in the environment before the app is imported
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+request_seconds = Histogram(
+    'http_request_duration_seconds', 'Time from receiving a request to sending the last byte of its response',
+    ['method', 'route', 'status'], buckets=REQUEST_BUCKETS,
+)
+stage_seconds = Histogram(
+    'stage_duration_seconds', 'Time spent in one stage of a route (e.g. analyze/gemini_call, face/decode)',
+    ['operation', 'stage'], buckets=STAGE_BUCKETS,
+)
+ai_errors = Counter(
+    'ai_errors_total', 'Failed Gemini attempts (each retry counts) and calls the circuit breaker rejected',
+    ['kind', 'error'],
+)
+ai_fallbacks = Counter(
+    'ai_fallbacks_total', 'Answers served from a fallback instead of the model',
+    ['operation', 'fallback'],
+)
+analysis_cache_lookups = Counter(
+    'analysis_cache_lookups_total', 'Analysis cache lookups by outcome (local_hit, shared_hit, miss)',
+    ['result'],
+)
+ai_inflight = Gauge(
+    'ai_inflight_calls', 'Gemini calls waiting on the model', multiprocess_mode='livesum',
+)
+face_gallery_size = Gauge(
+    'face_gallery_templates', 'Registered face templates', multiprocess_mode='livemax',
+)
+
+
+@contextmanager
+def stage(operation, name):
+    """
+    Times the block into stage_duration_seconds, e.g. `with stage("analyze", "prompt_build"):`,
+    and records it as an `operation.name` span of the request's trace. In a coroutine,
+    awaits inside the block count towards the stage.
+    """
+    start = time.perf_counter()
+    try:
+        with span(f'{operation}.{name}'):
+            yield
+    finally:
+        stage_seconds.labels(operation, name).observe(time.perf_counter() - start)
+
+
+def observe_stage(operation, name, seconds):
+    """A stage timed elsewhere that just ended"""
+    stage_seconds.labels(operation, name).observe(seconds)
+    record_span(f'{operation}.{name}', seconds)
+
+
+def record_fallback(operation, fallback):
+    ai_fallbacks.labels(operation, fallback).inc()
+
+
+def observe_request(method, route, status, seconds):
+    request_seconds.labels(method, route, str(status)).observe(seconds)
+
+
+def metrics_text():
+    """The Prometheus text exposition of every metric, summed over workers when multiprocess"""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def init_metrics(app):
+    """Times every Flask request and serves GET /api/metrics"""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request_when_sent(response):
+        start = g.get('request_start')
+        if start is not None:
+            # Unmatched paths share one label so scanners cannot blow up the series count
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            method, status = request.method, response.status_code
+            if response.direct_passthrough:
+                # Files (e.g. the PDF report) go straight to the server, which never calls close hooks
+                observe_request(method, route, status, time.perf_counter() - start)
+            else:
+                # Streamed bodies are still being generated here; record once the last byte is sent
+                response.call_on_close(lambda: observe_request(method, route, status, time.perf_counter() - start))
+        return response
+
+    @app.get('/api/metrics')
+    def metrics():
+        return Response(metrics_text(), mimetype=CONTENT_TYPE_LATEST)
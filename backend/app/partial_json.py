@@ -0,0 +1,118 @@
+import json
+
+_CLOSERS = {'{': '}', '[': ']'}
+_LITERAL_CHARS = set('0123456789+-.eEtrufalsn')
+
+
+class PartialJsonParser:
+    """
+    Tolerant, incremental JSON reader for model output.
+
+    feed() text as it arrives; value() returns the document so far. Anything before
+    the first `{` or `[` (e.g. a markdown fence) and after the top-level value is
+    ignored. A truncated document is repaired by cutting back to the last member of
+    the top-level value that was finished and closing it: a member cut off mid-way
+    (an unclosed string, number, array or object) is dropped whole, never kept in
+    part. Each character is scanned once, however many chunks it came in.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._start = None
+        self.complete = False
+        # Open containers, each [opener, state]; object states are key/colon/value/next,
+        # array states are value/next
+        self._stack = []
+        self._in_string = False
+        self._escape = 0
+        self._literal_start = None
+        # End of the last finished member of the top-level value, and the closer it needs
+        self._safe_end = None
+        self._safe_closers = ''
+
+    def feed(self, chunk):
+        if chunk:
+            self.text += chunk
+            self._scan()
+        return self
+
+    def _value_done(self, end):
+        if not self._stack:
+            self.complete = True
+            self._safe_end, self._safe_closers = end, ''
+            return
+        self._stack[-1][1] = 'next'
+        if len(self._stack) == 1:
+            # Only members of the top-level value are cut points, so nested values are
+            # either kept finished or dropped with the member they belong to
+            self._safe_end = end
+
+    def _scan(self):
+        text = self.text
+        i = self._pos
+        while i < len(text) and not self.complete:
+            char = text[i]
+            if self._start is None:
+                if char in _CLOSERS:
+                    self._start = i
+                    self._stack.append([char, 'key' if char == '{' else 'value'])
+                    self._safe_end, self._safe_closers = i + 1, _CLOSERS[char]
+                i += 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    # Inside \uXXXX the escape lasts four more characters
+                    if self._escape == 1 and char == 'u':
+                        self._escape = 5
+                    self._escape -= 1
+                elif char == '\\':
+                    self._escape = 1
+                elif char == '"':
+                    self._in_string = False
+                    container = self._stack[-1]
+                    if container[0] == '{' and container[1] == 'key':
+                        container[1] = 'colon'
+                    else:
+                        self._value_done(i + 1)
+                i += 1
+                continue
+            if self._literal_start is not None:
+                if char in _LITERAL_CHARS:
+                    i += 1
+                    continue
+                self._literal_start = None
+                self._value_done(i)
+            container = self._stack[-1]
+            if char in ' \t\r\n':
+                pass
+            elif char == '"':
+                self._in_string = True
+            elif char in _CLOSERS:
+                self._stack.append([char, 'key' if char == '{' else 'value'])
+            elif char in '}]':
+                self._stack.pop()
+                self._value_done(i + 1)
+            elif char == ':':
+                container[1] = 'value'
+            elif char == ',':
+                container[1] = 'key' if container[0] == '{' else 'value'
+            else:
+                self._literal_start = i
+            i += 1
+        self._pos = i
+
+    def value(self):
+        """
+        The document read so far; raises ValueError when it has not started or
+        nothing of it can be repaired.
+        """
+        if self._start is None:
+            raise ValueError("No JSON object or array in the text")
+        return json.loads(self.text[self._start:self._safe_end] + self._safe_closers)
+
+
+def parse_partial_json(text):
+    """(value, complete) for a possibly truncated or fenced JSON document"""
+    parser = PartialJsonParser().feed(text)
+    return parser.value(), parser.complete
@@ -7,7 +7,10 @@ from reportlab.lib import colors
 from io import BytesIO
 from datetime import datetime
 
+from .tracing import span, traced
 
+
+@traced('pdf.generate')
 def generate_health_summary_pdf(report_data):
     """
     Generate a comprehensive health summary report in PDF format.
@@ -208,7 +211,8 @@ def generate_health_summary_pdf(report_data):
     footer_text = "Generated by DigitalVaidya - AI-Powered Symptom Analysis"
     story.append(Paragraph(footer_text, ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, textColor=colors.grey, alignment=TA_CENTER)))
     
-    doc.build(story)
+    with span('pdf.build'):
+        doc.build(story)
     buffer.seek(0)
     return buffer
 
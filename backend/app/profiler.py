@@ -0,0 +1,147 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+
+# Samples per second; each one walks the stack of every thread in the process
+PROFILE_SAMPLE_HZ = float(os.environ.get('PROFILE_SAMPLE_HZ', 100))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 120))
+# Where finished profiles are kept, so any worker can return a profile another one took
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'digitalvaidya-profiles'))
+# Profiles kept in PROFILE_DIR; older ones are deleted
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 20))
+
+_PROFILE_ID_CHARS = set('0123456789abcdef')
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse_stack(frame, thread_name):
+    """One sampled stack as collapsed-stack text: thread;outermost;...;innermost"""
+    names = [frame_label(f) for f, _ in traceback.walk_stack(frame)]
+    names.append(thread_name)
+    # Semicolons separate frames in the collapsed format
+    return ';'.join(name.replace(';', ':') for name in reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread of this process from a background thread, at
+    PROFILE_SAMPLE_HZ, and counts identical stacks. The dump is collapsed-stack text
+    (`thread;frame;frame count` per line) for flamegraph.pl, speedscope or inferno.
+    One profile runs at a time per worker process.
+    """
+
+    def __init__(self, hz=PROFILE_SAMPLE_HZ, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.hz = hz
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._running = None
+
+    def start(self, seconds):
+        """Starts a profile of `seconds`; returns its description, or raises ProfilerBusyError"""
+        seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+        with self._lock:
+            if self._running is not None:
+                raise ProfilerBusyError(f"A profile is already running in this worker ({self._running['id']})")
+            profile = {
+                'id': uuid.uuid4().hex,
+                'pid': os.getpid(),
+                'seconds': seconds,
+                'hz': self.hz,
+                'startedAt': time.time(),
+                'endsAt': time.time() + seconds,
+                'status': 'running',
+            }
+            self._running = profile
+        # Lets a worker other than this one tell a running profile from an unknown id
+        self._write(profile['id'], 'json', json.dumps(profile))
+        threading.Thread(target=self._run, args=(profile,), name='sampling-profiler', daemon=True).start()
+        return profile
+
+    def _run(self, profile):
+        counts = Counter()
+        samples = 0
+        interval = 1 / self.hz
+        own_id = threading.get_ident()
+        deadline = time.perf_counter() + profile['seconds']
+        try:
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != own_id:
+                        counts[collapse_stack(frame, names.get(thread_id, f'thread-{thread_id}'))] += 1
+                samples += 1
+                time.sleep(interval)
+            self._save(profile, counts, samples)
+        except Exception as e:
+            print(f"Profiler error: {str(e)}")
+            self._write(profile['id'], 'json', json.dumps({**profile, 'status': 'failed', 'error': str(e)}))
+        finally:
+            with self._lock:
+                self._running = None
+
+    def _path(self, profile_id, suffix):
+        return os.path.join(self.directory, f'{profile_id}.{suffix}')
+
+    def _write(self, profile_id, suffix, text):
+        # Written under a temporary name and renamed, so readers never see half a file
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(profile_id, f'{suffix}.tmp')
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self._path(profile_id, suffix))
+
+    def _save(self, profile, counts, samples):
+        self._write(profile['id'], 'folded', ''.join(f'{stack} {count}\n' for stack, count in counts.most_common()))
+        self._write(profile['id'], 'json', json.dumps({**profile, 'status': 'done', 'samples': samples}))
+        self._prune()
+
+    def _prune(self):
+        finished = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in finished[:-self.keep] if self.keep else finished:
+            for suffix in ('json', 'folded'):
+                try:
+                    os.remove(self._path(entry.name[:-len('.json')], suffix))
+                except FileNotFoundError:
+                    pass
+
+    def result(self, profile_id):
+        """
+        (description, collapsed stacks) of a profile taken by any worker; the stacks
+        are None until its status is done. None for an unknown id.
+        """
+        if not profile_id or set(profile_id) - _PROFILE_ID_CHARS:
+            return None
+        try:
+            with open(self._path(profile_id, 'json')) as f:
+                profile = json.load(f)
+            if profile['status'] != 'done':
+                return profile, None
+            with open(self._path(profile_id, 'folded')) as f:
+                return profile, f.read()
+        except FileNotFoundError:
+            return None
+
+    def summary(self):
+        with self._lock:
+            return {'hz': self.hz, 'running': dict(self._running) if self._running else None}
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,31 @@
+from flask import Blueprint
+from ..ai_service import async_analysis_batcher, async_inflight_requests, analysis_batcher, inflight_requests
+from ..analysis_cache import analysis_cache
+from ..analysis_store import analysis_store
+from ..chat_sessions import chat_sessions
+from ..firebase_auth import admin_required
+from ..gemini_client import gemini
+from ..triage import triage_stats
+
+bp = Blueprint("ai", __name__)
+
+
+@bp.get("/stats")
+@admin_required
+def stats():
+    """Per-worker Gemini call counts, queue waits and call durations, cache, coalescing, batching, triage and chat session counters"""
+    return {
+        "ok": True,
+        "stats": gemini.summary(),
+        "cache": analysis_cache.summary(),
+        # /api/analyze results kept for /api/generate-summary
+        "analysisStore": analysis_store.summary(),
+        "singleflight": inflight_requests.summary(),
+        # Calls served by the ASGI app (asgi.py) coalesce on the event loop
+        "asyncSingleflight": async_inflight_requests.summary(),
+        # Analyses sent together as one multi-patient prompt (ANALYSIS_BATCH_WINDOW_MS)
+        "batching": analysis_batcher.summary(),
+        "asyncBatching": async_analysis_batcher.summary(),
+        "triage": triage_stats.summary(),
+        "chatSessions": chat_sessions.summary(),
+    }
@@ -1,17 +1,44 @@
-from flask import Blueprint, request, send_file
+from flask import Blueprint, Response, request, send_file, stream_with_context
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from ..firebase_auth import optional_auth
 from ..ai_service import generate_health_summary, analyze_symptoms_with_ai
+from ..analysis_fields import ANALYSIS_FIELDS, parse_fields
+from ..analysis_store import analysis_store
+from ..metrics import record_fallback, stage
+from ..tracing import bind_trace
 from ..pdf_service import generate_health_summary_pdf
+from ..triage import triage_stats, triage_vitals
+from .chatbot import sse_event, wants_stream
 from datetime import datetime
 
 bp = Blueprint("analyze", __name__)
 
+# `result` keys named differently from their analysis field
+RESULT_KEYS = {"conditions": "condition"}
 
-def simple_analyze(description, health_params, affected_regions):
-    """Simple symptom analysis without AI"""
+# /api/analyze/batch: patients per request, and how many of one request's patients
+# are analyzed at a time; the threads doing it are shared by all batch requests
+ANALYZE_BATCH_MAX_ITEMS = int(os.environ.get('ANALYZE_BATCH_MAX_ITEMS', 200))
+ANALYZE_BATCH_CONCURRENCY = int(os.environ.get('ANALYZE_BATCH_CONCURRENCY', 8))
+ANALYZE_BATCH_WORKERS = int(os.environ.get('ANALYZE_BATCH_WORKERS', 32))
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+
+def simple_analyze(description, health_params, affected_regions, triage=None):
+    """Simple symptom analysis without AI, graded by the vital-sign triage rules"""
+    
+    if triage is None:
+        triage = triage_vitals(health_params)
     
     conditions = []
-    urgency = "Consult a healthcare professional"
+    urgency = triage["urgency"]
     region_analysis = {}
     
     if affected_regions:
@@ -22,30 +49,30 @@ def simple_analyze(description, health_params, affected_regions):
     if description and len(description) > 10:
         conditions.append("Symptoms described")
     
-    temp = health_params.get("temperature")
-    if temp:
-        try:
-            temp_val = float(temp)
-            if temp_val > 38.0:
-                conditions.append("Elevated temperature")
-                urgency = "Seek medical attention within 24 hours"
-            elif temp_val < 36.0:
-                conditions.append("Low temperature")
-        except:
-            pass
+    conditions.extend(triage["findings"])
     
     if not conditions:
         conditions = ["General health assessment"]
     
     summary = f"You've reported symptoms including: {description[:100]}. " if description else ""
-    summary += f"Please consult with a healthcare professional for proper medical evaluation and diagnosis."
+    if triage["critical"]:
+        summary += "Your vital signs include critical values. Seek emergency medical care now rather than waiting on an online assessment."
+    else:
+        summary += f"Please consult with a healthcare professional for proper medical evaluation and diagnosis."
     
-    return {
+    analysis = {
         "conditions": conditions,
         "urgency": urgency,
         "regionAnalysis": region_analysis,
         "summary": summary
     }
+    if triage["findings"]:
+        analysis["doctorRecommendation"] = {
+            "shouldSeeDoctorFor": triage["findings"],
+            "urgencyReason": f"Based on your vital signs: {'; '.join(triage['findings'])}",
+            "redFlags": triage["findings"] if triage["critical"] else []
+        }
+    return analysis
 
 
 @bp.post("/analyze")
@@ -57,13 +84,246 @@ def analyze_symptoms():
     spots = data.get("spots", [])
     
     affected_regions = spots if spots else []
+    try:
+        fields = selected_fields(data, request.args)
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}, 400
+    user_info = request_user_info()
+    triage = triage_vitals(health_params)
+    
+    if wants_stream(data):
+        return stream_analysis(description, health_params, affected_regions, user_info, triage, fields)
     
+    analysis = analyze_with_triage(description, health_params, affected_regions, triage, fields)
+    analysis_id = store_analysis(description, health_params, affected_regions, analysis, user_info, fields)
+    return {
+        "ok": True,
+        "result": build_analysis_result(analysis, health_params, affected_regions, user_info, triage, analysis_id, fields)
+    }
+
+
+@bp.post("/analyze/batch")
+@optional_auth
+def analyze_batch():
+    """
+    Analyze many patients in one request: a JSON array of {description, healthParams,
+    spots} (or {patients: [...], fields}). Results stream back as NDJSON in the order
+    they finish, one line per patient with its `index`, then a `done` line.
+    """
+    data = request.get_json(silent=True)
+    try:
+        items = batch_items(data)
+        fields = selected_fields(data if isinstance(data, dict) else {}, request.args)
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}, 400
+    user_info = request_user_info()
+    return Response(
+        stream_with_context(batch_lines(items, user_info, fields)),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def batch_pool():
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ThreadPoolExecutor(max_workers=ANALYZE_BATCH_WORKERS, thread_name_prefix='analyze-batch')
+        return _batch_pool
+
+
+def batch_items(data):
+    """The patients of an /api/analyze/batch body; raises ValueError when there are none or too many"""
+    items = data.get("patients") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError("Send a non-empty array of patients ({description, healthParams, spots})")
+    if len(items) > ANALYZE_BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {ANALYZE_BATCH_MAX_ITEMS} patients per request")
+    return items
+
+
+def batch_item_inputs(item):
+    if not isinstance(item, dict):
+        raise ValueError("Each patient must be an object with description, healthParams and spots")
+    return item.get("description") or "", item.get("healthParams") or {}, item.get("spots") or []
+
+
+def ndjson_line(payload):
+    return json.dumps(payload) + "\n"
+
+
+def batch_result_line(index, start, inputs, analysis, user_info, triage, fields):
+    description, health_params, affected_regions = inputs
+    analysis_id = store_analysis(description, health_params, affected_regions, analysis, user_info, fields)
+    return {
+        "index": index,
+        "ok": True,
+        "result": build_analysis_result(analysis, health_params, affected_regions, user_info, triage, analysis_id, fields),
+        "ms": round((time.perf_counter() - start) * 1000, 1)
+    }
+
+
+def batch_error_line(index, start, error):
+    print(f"Batch analysis error for patient {index}: {str(error)}")
+    return {"index": index, "ok": False, "error": str(error), "ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+def analyze_batch_item(index, item, user_info, fields):
+    """One patient's NDJSON line: the /api/analyze result (model or rule-based), or the error"""
+    start = time.perf_counter()
     try:
-        analysis = analyze_symptoms_with_ai(description, health_params, affected_regions)
+        inputs = batch_item_inputs(item)
+        triage = triage_vitals(inputs[1])
+        analysis = analyze_with_triage(*inputs, triage, fields)
+        return batch_result_line(index, start, inputs, analysis, user_info, triage, fields)
     except Exception as e:
-        print(f"AI analysis failed, falling back to simple analysis: {str(e)}")
-        analysis = simple_analyze(description, health_params, affected_regions)
+        return batch_error_line(index, start, e)
+
+
+def batch_done_line(count, failed, start):
+    return {"done": True, "count": count, "failed": failed, "totalMs": round((time.perf_counter() - start) * 1000, 1)}
+
+
+def batch_lines(items, user_info, fields):
+    """
+    NDJSON lines as patients finish. At most ANALYZE_BATCH_CONCURRENCY of them are
+    in progress at once; patients not yet started are dropped if the client leaves.
+    """
+    start = time.perf_counter()
+    pool = batch_pool()
+    analyze_item = bind_trace(analyze_batch_item)
+    pending = enumerate(items)
+    running = {
+        pool.submit(analyze_item, index, item, user_info, fields)
+        for index, item in itertools.islice(pending, ANALYZE_BATCH_CONCURRENCY)
+    }
+    failed = 0
+    try:
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                following = next(pending, None)
+                if following is not None:
+                    running.add(pool.submit(analyze_item, *following, user_info, fields))
+                line = future.result()
+                failed += 0 if line["ok"] else 1
+                yield ndjson_line(line)
+        yield ndjson_line(batch_done_line(len(items), failed, start))
+    finally:
+        for future in running:
+            future.cancel()
+
+
+def selected_fields(data, args):
+    """
+    The analysis fields picked by the body's `fields` (a list) or `?fields=a,b`;
+    every field when neither is given. Raises ValueError for unknown names.
+    """
+    return parse_fields(data.get("fields", args.get("fields")))
+
+
+def analyze_with_triage(description, health_params, affected_regions, triage, fields=ANALYSIS_FIELDS):
+    """
+    Critical vitals are answered from the triage rules at once; everything else goes
+    to the model, with the rule-based analysis as the fallback.
+    """
+    if triage["critical"]:
+        triage_stats.record(triage["level"], short_circuit=True)
+        return simple_analyze(description, health_params, affected_regions, triage)
     
+    triage_stats.record(triage["level"])
+    try:
+        return analyze_symptoms_with_ai(description, health_params, affected_regions, fields)
+    except Exception as e:
+        print(f"AI analysis failed, falling back to simple analysis: {str(e)}")
+        record_fallback("analyze", "rule_based")
+        return simple_analyze(description, health_params, affected_regions, triage)
+
+
+def provisional_result(description, health_params, affected_regions, user_info, triage, fields=ANALYSIS_FIELDS):
+    """The rule-based result streamed before the model's answer arrives"""
+    analysis = simple_analyze(description, health_params, affected_regions, triage)
+    result = build_analysis_result(analysis, health_params, affected_regions, user_info, triage, fields=fields)
+    result["provisional"] = not triage["critical"]
+    return result
+
+
+def stream_analysis(description, health_params, affected_regions, user_info, triage, fields=ANALYSIS_FIELDS):
+    """
+    Server-Sent Events: a `triage` event with the rule-based result right away, then a
+    `result` event with the final one (the model's, unless triage was critical).
+    """
+    def events():
+        start = time.perf_counter()
+        yield sse_event("triage", {
+            "ok": True,
+            "result": provisional_result(description, health_params, affected_regions, user_info, triage, fields)
+        })
+        analysis = analyze_with_triage(description, health_params, affected_regions, triage, fields)
+        analysis_id = store_analysis(description, health_params, affected_regions, analysis, user_info, fields)
+        yield sse_event("result", {
+            "ok": True,
+            "result": build_analysis_result(
+                analysis, health_params, affected_regions, user_info, triage, analysis_id, fields
+            ),
+            "totalMs": round((time.perf_counter() - start) * 1000, 1)
+        })
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def store_analysis(description, health_params, affected_regions, analysis, user_info, fields=ANALYSIS_FIELDS):
+    """
+    Keeps the analysis for /api/generate-summary; returns its analysisId. Analyses
+    with only some of the fields are not kept, since the report needs all of them.
+    """
+    if fields != ANALYSIS_FIELDS:
+        return None
+    owner = user_info["uid"] if user_info else None
+    return analysis_store.save(description, health_params, affected_regions, analysis, owner)
+
+
+def stored_analysis(data, user_info):
+    """
+    The stored /api/analyze entry for the request's analysisId, if it is still kept,
+    belongs to this user and (when the request repeats them) matches the inputs
+    """
+    analysis_id = data.get("analysisId")
+    if not analysis_id:
+        return None
+    return analysis_store.get(
+        analysis_id,
+        user_info["uid"] if user_info else None,
+        data.get("description", ""),
+        data.get("healthParams", {}),
+        data.get("affectedRegions", [])
+    )
+
+
+def request_user_info():
+    """uid/email of the user optional_auth attached to the request, if any"""
+    if hasattr(request, 'user') and request.user:
+        return user_info_from_token(request.user)
+    return None
+
+
+def user_info_from_token(decoded_token):
+    return {
+        "uid": decoded_token.get("uid"),
+        "email": decoded_token.get("email")
+    }
+
+
+def build_analysis_result(analysis, health_params, affected_regions, user_info, triage=None, analysis_id=None,
+                          fields=ANALYSIS_FIELDS):
+    """
+    The /api/analyze `result` object for an analysis dict. With some of the fields
+    selected, the sections not asked for are left out and `fields` lists the others.
+    """
     conditions = analysis.get("conditions", ["General Checkup Recommended"])
     urgency_level = analysis.get("urgency", "Consult a healthcare professional")
     region_analysis = analysis.get("regionAnalysis", {})
@@ -73,13 +333,6 @@ def analyze_symptoms():
     related_symptoms = analysis.get("relatedSymptoms", [])
     doctor_recommendation = analysis.get("doctorRecommendation", {})
     
-    user_info = None
-    if hasattr(request, 'user') and request.user:
-        user_info = {
-            "uid": request.user.get("uid"),
-            "email": request.user.get("email")
-        }
-    
     result = {
         "condition": " & ".join(conditions) if conditions else "General Checkup Recommended",
         "urgency": urgency_level,
@@ -91,10 +344,16 @@ def analyze_symptoms():
         "possibleSolutions": possible_solutions,
         "relatedSymptoms": related_symptoms,
         "doctorRecommendation": doctor_recommendation,
+        "triage": triage if triage is not None else triage_vitals(health_params),
+        "analysisId": analysis_id,
         "user": user_info
     }
-    
-    return {"ok": True, "result": result}
+    if fields != ANALYSIS_FIELDS:
+        for field in ANALYSIS_FIELDS:
+            if field not in fields:
+                del result[RESULT_KEYS.get(field, field)]
+        result["fields"] = list(fields)
+    return result
 
 
 @bp.post("/generate-summary")
@@ -102,49 +361,49 @@ def analyze_symptoms():
 def generate_summary():
     """
     Generate a comprehensive health summary report in PDF format based on symptoms and affected regions.
+    
+    With the analysisId of an /api/analyze result the report is rendered from that
+    analysis; otherwise the symptoms are analyzed again.
     """
     try:
         data = request.get_json(silent=True) or {}
         description = data.get("description", "")
         affected_regions = data.get("affectedRegions", [])
         health_params = data.get("healthParams", {})
+        user_info = request_user_info()
         
-        if not description and not affected_regions:
+        stored = stored_analysis(data, user_info)
+        if stored is not None:
+            description = stored["description"]
+            affected_regions = stored["affectedRegions"]
+            health_params = stored["healthParams"]
+            analysis = stored["analysis"]
+        elif not description and not affected_regions:
+            if data.get("analysisId"):
+                return {"ok": False, "error": "Analysis not found or expired; please analyze your symptoms again"}, 404
             return {"ok": False, "error": "Please provide symptom description or mark affected areas"}, 400
+        else:
+            try:
+                with stage("summary", "analysis"):
+                    analysis = analyze_symptoms_with_ai(description, health_params, affected_regions)
+            except Exception as e:
+                print(f"AI analysis failed for PDF generation, falling back to simple analysis: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                record_fallback("summary", "rule_based")
+                analysis = simple_analyze(description, health_params, affected_regions)
         
-        try:
-            analysis = analyze_symptoms_with_ai(description, health_params, affected_regions)
-        except Exception as e:
-            print(f"AI analysis failed for PDF generation, falling back to simple analysis: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            analysis = simple_analyze(description, health_params, affected_regions)
-        
-        user_info = None
-        if hasattr(request, 'user') and request.user:
-            user_info = {
-                "uid": request.user.get("uid"),
-                "email": request.user.get("email")
-            }
-        
-        report_data = {
-            "timestamp": datetime.utcnow().isoformat() + 'Z',
-            "user": user_info,
-            "affectedRegions": affected_regions,
-            "symptoms": description,
-            "healthParameters": health_params,
-            "analysis": analysis
-        }
+        report_data = build_report_data(description, health_params, affected_regions, analysis, user_info)
         
         try:
-            pdf_buffer = generate_health_summary_pdf(report_data)
-            filename = f"DigitalVaidya-Health-Report-{datetime.utcnow().strftime('%Y-%m-%d')}.pdf"
+            with stage("summary", "pdf_build"):
+                pdf_buffer = generate_health_summary_pdf(report_data)
             
             return send_file(
                 pdf_buffer,
                 mimetype='application/pdf',
                 as_attachment=True,
-                download_name=filename
+                download_name=report_filename()
             )
         except Exception as e:
             print(f"PDF generation error: {str(e)}")
@@ -159,3 +418,16 @@ def generate_summary():
         return {"ok": False, "error": f"Server error: {str(e)}"}, 500
 
 
+def build_report_data(description, health_params, affected_regions, analysis, user_info):
+    return {
+        "timestamp": datetime.utcnow().isoformat() + 'Z',
+        "user": user_info,
+        "affectedRegions": affected_regions,
+        "symptoms": description,
+        "healthParameters": health_params,
+        "analysis": analysis
+    }
+
+
+def report_filename():
+    return f"DigitalVaidya-Health-Report-{datetime.utcnow().strftime('%Y-%m-%d')}.pdf"
@@ -1,6 +1,10 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, stream_with_context
+import json
+import time
 from ..firebase_auth import optional_auth
-from ..ai_service import chatbot_response
+from ..ai_service import CHATBOT_FALLBACK_MESSAGE, chatbot_response, chatbot_response_stream, record_chat_turn
+from ..chat_sessions import chat_sessions
+from ..metrics import record_fallback
 
 bp = Blueprint("chatbot", __name__)
 
@@ -17,9 +21,22 @@ def chat():
         if not message:
             return {"ok": False, "error": "Message is required"}, 400
         
+        session = None
+        conversation_summary = None
+        if uses_session(data):
+            session, _ = chat_sessions.open(data.get("sessionId"), session_owner())
+            conversation_summary, conversation_history = chat_sessions.context(session)
+        
+        if wants_stream(data):
+            return stream_chat(message, affected_regions, conversation_history, conversation_summary, session)
+        
         try:
-            response = chatbot_response(message, affected_regions, conversation_history)
-            return {"ok": True, "response": response}
+            response = chatbot_response(message, affected_regions, conversation_history, conversation_summary)
+            if session is None:
+                return {"ok": True, "response": response}
+            if response != CHATBOT_FALLBACK_MESSAGE:
+                record_chat_turn(session["id"], message, response)
+            return {"ok": True, "response": response, "sessionId": session["id"]}
         except Exception as e:
             print(f"Chatbot API Error: {str(e)}")
             import traceback
@@ -34,3 +51,80 @@ def chat():
         import traceback
         traceback.print_exc()
         return {"ok": False, "error": f"Server error: {str(e)}"}, 500
+
+
+def wants_stream(data):
+    """Streaming is opt-in: ?stream=1, {"stream": true} or Accept: text/event-stream"""
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    if data.get("stream") is True:
+        return True
+    return request.accept_mimetypes.best == "text/event-stream"
+
+
+def uses_session(data):
+    """
+    Clients that send a sessionId, or no history at all, get a server-side session;
+    ones that still send the full history are answered statelessly as before
+    """
+    return "sessionId" in data or "history" not in data
+
+
+def session_owner():
+    """uid of the signed-in user, so a session id alone cannot resume someone else's chat"""
+    if hasattr(request, 'user') and request.user:
+        return request.user.get("uid")
+    return None
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream_chat(message, affected_regions, conversation_history, conversation_summary=None, session=None):
+    """
+    Server-Sent Events: `delta` events carry text as the model produces it, then one
+    `done` event with the full response and timings. On failure an `error` event
+    carries the usual fallback message (after any text already sent). Both carry the
+    sessionId when the chat has a server-side session.
+    """
+    session_fields = {"sessionId": session["id"]} if session is not None else {}
+    
+    def events():
+        start = time.perf_counter()
+        first_ms = None
+        parts = []
+        try:
+            for text in chatbot_response_stream(message, affected_regions, conversation_history, conversation_summary):
+                if first_ms is None:
+                    first_ms = (time.perf_counter() - start) * 1000
+                parts.append(text)
+                yield sse_event("delta", {"text": text})
+            response = "".join(parts).strip()
+            if session is not None:
+                record_chat_turn(session["id"], message, response)
+            yield sse_event("done", {
+                "ok": True,
+                "response": response,
+                "ttftMs": round(first_ms, 1),
+                "totalMs": round((time.perf_counter() - start) * 1000, 1),
+                **session_fields
+            })
+        except Exception as e:
+            print(f"Chatbot stream error: {str(e)}")
+            record_fallback("chatbot_stream", "message")
+            yield sse_event("error", {
+                "ok": False,
+                "error": f"AI service error: {str(e)}",
+                "response": CHATBOT_FALLBACK_MESSAGE,
+                "partial": bool(parts),
+                "totalMs": round((time.perf_counter() - start) * 1000, 1),
+                **session_fields
+            })
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Keep proxies (nginx, Render) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
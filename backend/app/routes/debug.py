@@ -0,0 +1,50 @@
+from flask import Blueprint, Response, request
+import time
+from ..firebase_auth import admin_required
+from ..profiler import PROFILE_MAX_SECONDS, ProfilerBusyError, profiler
+
+bp = Blueprint("debug", __name__)
+
+# A profile still "running" this long after its end belongs to a worker that exited
+PROFILE_LOST_AFTER = 30
+
+
+@bp.post("/profile")
+@admin_required
+def start_profile():
+    """
+    Start sampling this worker's threads for `seconds` (body or query, default 10).
+    Answers at once with the profile id; fetch the result from resultUrl once it ends.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = float(data.get("seconds", request.args.get("seconds", 10)))
+    except (TypeError, ValueError):
+        return {"ok": False, "error": "seconds must be a number"}, 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return {"ok": False, "error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}, 400
+    try:
+        profile = profiler.start(seconds)
+    except ProfilerBusyError as e:
+        return {"ok": False, "error": str(e)}, 409
+    return {"ok": True, "profile": profile, "resultUrl": f"/api/debug/profile/{profile['id']}"}, 202
+
+
+@bp.get("/profile/<profile_id>")
+@admin_required
+def profile_result(profile_id):
+    """The collapsed stacks of a finished profile, as text/plain for flamegraph tools"""
+    found = profiler.result(profile_id)
+    if found is None:
+        return {"ok": False, "error": "Profile not found"}, 404
+    profile, collapsed = found
+    if profile["status"] == "failed":
+        return {"ok": False, "error": f"Profile failed: {profile.get('error')}", "profile": profile}, 500
+    if collapsed is None:
+        if time.time() > profile["endsAt"] + PROFILE_LOST_AFTER:
+            return {"ok": False, "error": "Profile was lost; its worker exited", "profile": profile}, 410
+        return {"ok": True, "profile": profile}, 202
+    return Response(collapsed, mimetype="text/plain", headers={
+        "X-Profile-Pid": str(profile["pid"]),
+        "X-Profile-Samples": str(profile["samples"]),
+    })
@@ -1,106 +1,352 @@
 from flask import Blueprint, request, jsonify
+import click
 import cv2
 import numpy as np
 import base64
+import binascii
+import io
 import json
 import os
-from pathlib import Path
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..face_gallery import FaceGallery, ScoreFusion, compute_face_histogram, normalize_histograms, score_rows
+from ..face_store import BASE_FILE, LOG_FILE, META_DTYPE, TemplateStore, migrate_json_templates, remove_migrated_json
+from ..face_ann import IVFIndex
+from ..face_codec import CODEC_DTYPES, DescriptorCodec
+from ..face_detection import CASCADE_PATH, FaceDetector, load_cascade
+from ..metrics import stage
+from ..tracing import bind_trace, traced
 
-bp = Blueprint("face_recognition", __name__)
+bp = Blueprint("face_recognition", __name__, cli_group="face")
 
-FACE_DATA_DIR = 'backend/face_data'
+FACE_DATA_DIR = os.environ.get('FACE_DATA_DIR', 'backend/face_data')
 os.makedirs(FACE_DATA_DIR, exist_ok=True)
 
-CASCADE_PATH = str(Path(__file__).resolve().parent.parent / 'cascade_data' / 'haarcascade_frontalface_default.xml')
+# Packed template store (see face_store.py); float16 halves disk and page-cache use
+FACE_STORE_DIR = os.path.join(FACE_DATA_DIR, 'store')
+FACE_STORE_DTYPE = os.environ.get('FACE_STORE_DTYPE', 'float32')
+FACE_STORE_COMPACT_EVERY = int(os.environ.get('FACE_STORE_COMPACT_EVERY', 1024))
+SAVE_FACE_CROPS = os.environ.get('FACE_SAVE_CROPS', '1') != '0'
+
+# Optional descriptor compression (flask face compress): logins then score a compressed
+# copy in store/compressed/ while store/ keeps the full-width templates to refit from
+FACE_CODEC_DIR = os.path.join(FACE_STORE_DIR, 'compressed')
+FACE_CODEC_PATH = os.path.join(FACE_CODEC_DIR, 'codec.npz')
+FACE_COMPRESSION = os.environ.get('FACE_COMPRESSION', '1') != '0' and os.path.exists(FACE_CODEC_PATH)
+FACE_SERVING_DIR = FACE_CODEC_DIR if FACE_COMPRESSION else FACE_STORE_DIR
+
+# Optional IVF index (flask face build-index); more probes = better recall, slower login
+FACE_ANN_INDEX = os.environ.get('FACE_ANN_INDEX', os.path.join(FACE_SERVING_DIR, 'ivf.npz'))
+FACE_ANN_NPROBE = int(os.environ.get('FACE_ANN_NPROBE', 8))
+FACE_ANN_MIN_GALLERY = int(os.environ.get('FACE_ANN_MIN_GALLERY', 10000))
+
+MATCH_THRESHOLD = 0.75
+MIN_FACE_SIZE = 100
+
+# Multi-frame login: OpenCV releases the GIL, so frames are processed on a thread pool
+FACE_BATCH_WORKERS = int(os.environ.get('FACE_BATCH_WORKERS', 4))
+FACE_BATCH_MAX_FRAMES = int(os.environ.get('FACE_BATCH_MAX_FRAMES', 10))
+FACE_BATCH_MIN_FRAMES = int(os.environ.get('FACE_BATCH_MIN_FRAMES', 2))
+FACE_EARLY_ACCEPT = float(os.environ.get('FACE_EARLY_ACCEPT', 0.9))
+
+# Bulk onboarding; faces in group photos are usually smaller than in selfies, so they
+# are detected with a finer profile (a one-off cost per photo, not per login)
+FACE_BULK_MAX_ITEMS = int(os.environ.get('FACE_BULK_MAX_ITEMS', 500))
+FACE_GROUP_MIN_FACE_SIZE = int(os.environ.get('FACE_GROUP_MIN_FACE_SIZE', 60))
+FACE_GROUP_DETECT_PROFILE = os.environ.get('FACE_GROUP_DETECT_PROFILE', 'accurate')
+BULK_STATUS_MESSAGES = {
+    'registered': 'Face registered successfully',
+    'missing_fields': 'Mobile and image are required',
+    'invalid_mobile': 'Mobile number is too long',
+    'duplicate': 'Mobile appears more than once in this request',
+    'invalid': 'Invalid image data',
+    'no_face': 'No face detected',
+    'unknown_face': 'faceIndex does not match a detected face',
+}
+
+# JPEG frames can be decoded at 1/2, 1/4 or 1/8 size, which skips most of the
+# IDCT work; the detector's minimum face size is scaled down to match
+FACE_DECODE_SCALE = int(os.environ.get('FACE_DECODE_SCALE', 1))
+COLOR_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+GRAYSCALE_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# legacy | accurate | balanced | fast, see face_detection.DETECTION_PROFILES
+FACE_DETECT_PROFILE = os.environ.get('FACE_DETECT_PROFILE', 'balanced')
 
 # Initialize face recognition model on module load
 print("\n" + "="*50)
 print("🔍 Initializing Face Recognition Model...")
 print("="*50)
-face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
-
-if face_cascade.empty():
-    raise RuntimeError(f"Failed to load Haar cascade from {CASCADE_PATH}. File may be missing or corrupted.")
+face_cascade = load_cascade(CASCADE_PATH)
+face_detector = FaceDetector(face_cascade, FACE_DETECT_PROFILE)
+group_detector = FaceDetector(face_cascade, FACE_GROUP_DETECT_PROFILE)
 
 print(f"✓ Face recognition model loaded successfully")
 print(f"✓ Cascade file: {CASCADE_PATH}")
+print(f"✓ Detection profile: {FACE_DETECT_PROFILE}")
 print(f"✓ Face data directory: {FACE_DATA_DIR}")
-registered_faces = len([f for f in os.listdir(FACE_DATA_DIR) if f.endswith('.json')])
-print(f"✓ Registered faces: {registered_faces}")
+template_store = TemplateStore(FACE_STORE_DIR, dtype=FACE_STORE_DTYPE, compact_every=FACE_STORE_COMPACT_EVERY)
+face_codec = DescriptorCodec.load(FACE_CODEC_PATH) if FACE_COMPRESSION else None
+if face_codec:
+    gallery = FaceGallery(
+        TemplateStore(FACE_CODEC_DIR, dim=face_codec.dim, dtype=face_codec.dtype, compact_every=FACE_STORE_COMPACT_EVERY),
+        n_probe=FACE_ANN_NPROBE, ann_min_rows=FACE_ANN_MIN_GALLERY, codec=face_codec, full_store=template_store,
+    )
+    print(f"✓ Compressed descriptors: {face_codec.describe()}")
+else:
+    gallery = FaceGallery(template_store, n_probe=FACE_ANN_NPROBE, ann_min_rows=FACE_ANN_MIN_GALLERY)
+if not template_store.exists() and any(f.endswith('.json') for f in os.listdir(FACE_DATA_DIR)):
+    # Every worker gets here at startup; the first to take the store lock migrates
+    migrated = migrate_json_templates(FACE_DATA_DIR, template_store, normalize_histograms)
+    if migrated:
+        print(f"✓ Migrated {migrated} JSON face templates to {FACE_STORE_DIR}")
+gallery.load()
+if gallery.load_index(FACE_ANN_INDEX):
+    print(f"✓ Face index: {gallery.ann_index.n_lists} lists, probing {FACE_ANN_NPROBE}")
+print(f"✓ Registered faces: {len(gallery)}")
 print("="*50 + "\n")
 
-def decode_base64_image(base64_string):
-    if ',' in base64_string:
-        base64_string = base64_string.split(',')[1]
-    
-    img_data = base64.b64decode(base64_string)
-    nparr = np.frombuffer(img_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    return img
-
-def detect_face(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5, minSize=(100, 100))
+def decode_image_bytes(buffer, scale=1, grayscale=False):
+    """Decode an encoded image directly from a bytes-like buffer without copying it"""
+    flags = (GRAYSCALE_DECODE_FLAGS if grayscale else COLOR_DECODE_FLAGS).get(scale)
+    if flags is None:
+        raise ValueError(f"Unsupported decode scale: {scale}")
+    if len(buffer) == 0:
+        return None
+    with stage('face', 'decode'):
+        return cv2.imdecode(np.frombuffer(buffer, np.uint8), flags)
+
+def decode_base64_payload(base64_string):
+    """Bytes of a base64 string or data URL; empty if it is not valid base64"""
+    _, _, payload = base64_string.rpartition(',')
+    try:
+        return base64.b64decode(payload)
+    except (binascii.Error, ValueError):
+        return b''
+
+def decode_base64_image(base64_string, scale=1):
+    return decode_image_bytes(decode_base64_payload(base64_string), scale)
+
+def read_stream(stream, length=None):
+    """Read a request or upload stream into a single preallocated buffer"""
+    if not length:
+        return stream.read()
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < length:
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return view[:filled]
+
+def read_upload(upload):
+    """Encoded bytes of a multipart file part; in-memory parts are returned without copying"""
+    stream = upload.stream
+    if isinstance(stream, io.BytesIO):
+        return stream.getbuffer()
+    stream.seek(0, io.SEEK_END)
+    length = stream.tell()
+    stream.seek(0)
+    return read_stream(stream, length)
+
+def read_request_frame(field='image'):
+    """
+    Extract the form fields and the encoded frame from a face request.
+
+    Accepts a raw image body (image/jpeg, image/png, application/octet-stream)
+    with fields in the query string, a multipart form with an `image` file part,
+    or the original JSON body with a base64 data URL.
+
+    Returns:
+        (fields dict, bytes-like encoded image or None if absent)
+    """
+    mimetype = request.mimetype
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        return request.args.to_dict(), read_stream(request.stream, request.content_length)
+    if mimetype == 'multipart/form-data':
+        fields = request.form.to_dict()
+        upload = request.files.get(field)
+        return fields, read_upload(upload) if upload else None
+    data = request.get_json(silent=True) or {}
+    image_data = data.get(field)
+    return data, decode_base64_payload(image_data) if image_data else None
+
+def read_request_frames(field='images'):
+    """
+    Encoded frames of a multi-frame request: repeated multipart `image` parts or a
+    JSON `images` list of base64 data URLs.
+    """
+    if request.mimetype == 'multipart/form-data':
+        return [read_upload(upload) for upload in request.files.getlist('image')]
+    data = request.get_json(silent=True) or {}
+    return [decode_base64_payload(image) for image in data.get(field) or [] if image]
+
+_frame_pool = None
+_frame_pool_lock = threading.Lock()
+
+def frame_pool():
+    """Shared worker pool for per-frame decode/detect/histogram work"""
+    global _frame_pool
+    with _frame_pool_lock:
+        if _frame_pool is None:
+            _frame_pool = ThreadPoolExecutor(max_workers=FACE_BATCH_WORKERS, thread_name_prefix='face-frame')
+        return _frame_pool
+
+def request_decode_scale():
+    scale = request.args.get('scale', FACE_DECODE_SCALE, type=int)
+    if scale not in COLOR_DECODE_FLAGS:
+        raise ValueError(f"scale must be one of {sorted(COLOR_DECODE_FLAGS)}")
+    return scale
+
+def response_confidence(score):
+    """
+    A match score as the confidence clients show. Float32 dot products can land a hair
+    above 1.0 for an identical face (compareHist returned 1.0), so it is clipped to [0, 1]
+    """
+    return min(1.0, max(0.0, float(score)))
+
+def crop_face(img, box):
+    x, y, w, h = box
+    face_roi = img[y:y+h, x:x+w]
+    return cv2.resize(face_roi, (128, 128))
+
+@traced('face.detect_face')
+def detect_face(img, min_size=MIN_FACE_SIZE):
+    faces, timings = face_detector.detect(img, min_size)
     
     if len(faces) == 0:
+        face_detector.timings.record(timings)
         return None
     
-    x, y, w, h = faces[0]
-    face_roi = img[y:y+h, x:x+w]
-    face_resized = cv2.resize(face_roi, (128, 128))
+    start = time.perf_counter()
+    face_resized = crop_face(img, faces[0])
+    timings['crop'] = (time.perf_counter() - start) * 1000
+    face_detector.timings.record(timings)
     
     return face_resized
 
-def compute_face_histogram(face):
-    hist_b = cv2.calcHist([face], [0], None, [256], [0, 256])
-    hist_g = cv2.calcHist([face], [1], None, [256], [0, 256])
-    hist_r = cv2.calcHist([face], [2], None, [256], [0, 256])
-    
-    hist_b = cv2.normalize(hist_b, hist_b).flatten()
-    hist_g = cv2.normalize(hist_g, hist_g).flatten()
-    hist_r = cv2.normalize(hist_r, hist_r).flatten()
+@traced('face.detect_faces')
+def detect_faces(img, min_size=MIN_FACE_SIZE, detector=face_detector):
+    """Every face box in the image, ordered left to right (then top to bottom)"""
+    faces, timings = detector.detect(img, min_size)
+    detector.timings.record(timings)
+    return sorted(faces, key=lambda box: (box[0], box[1]))
+
+@traced('face.extract')
+def extract_face(image_bytes, scale=1):
+    """Decode and detect one frame; returns (status, 128x128 face crop or None)"""
+    img = decode_image_bytes(image_bytes, scale)
+    if img is None:
+        return 'invalid', None
+    face = detect_face(img, min_size=MIN_FACE_SIZE // scale)
+    if face is None:
+        return 'no_face', None
+    return 'ok', face
+
+def extract_face_histogram(image_bytes, scale=1):
+    """Decode, detect and histogram one frame; returns (status, histogram or None)"""
+    status, face = extract_face(image_bytes, scale)
+    if face is None:
+        return status, None
+    return status, compute_face_histogram(face)
+
+def extract_face_template(image_bytes, scale=1):
+    """Like extract_face_histogram, but also returns the crop; (status, face, histogram)"""
+    status, face = extract_face(image_bytes, scale)
+    if face is None:
+        return status, None, None
+    return status, face, compute_face_histogram(face)
+
+def read_bulk_registration():
+    """
+    Parse a bulk registration request.
+
+    JSON: `{items: [{mobile, userName, image}]}` or `{groupPhoto, assignments: [{faceIndex, mobile, userName}]}`.
+    Multipart: repeated `mobile` / `userName` fields with matching `image` parts, or a `groupPhoto`
+    part with an `assignments` JSON field.
+
+    Returns:
+        (items list of dicts, group photo bytes or None)
+    """
+    if request.mimetype == 'multipart/form-data':
+        form = request.form
+        group_upload = request.files.get('groupPhoto')
+        if group_upload:
+            return json.loads(form.get('assignments') or '[]'), read_upload(group_upload)
+        names = form.getlist('userName')
+        uploads = request.files.getlist('image')
+        return [
+            {
+                'mobile': mobile,
+                'userName': names[i] if i < len(names) else 'User',
+                'image': read_upload(uploads[i]) if i < len(uploads) else None
+            }
+            for i, mobile in enumerate(form.getlist('mobile'))
+        ], None
     
-    return np.concatenate([hist_b, hist_g, hist_r])
+    data = request.get_json(silent=True) or {}
+    if data.get('groupPhoto'):
+        return data.get('assignments') or [], decode_base64_payload(data['groupPhoto'])
+    return [
+        {
+            'mobile': item.get('mobile'),
+            'userName': item.get('userName', 'User'),
+            'image': decode_base64_payload(item['image']) if item.get('image') else None
+        }
+        for item in data.get('items') or []
+    ], None
 
-def compare_faces(hist1, hist2):
-    correlation = cv2.compareHist(hist1.reshape(-1, 1), hist2.reshape(-1, 1), cv2.HISTCMP_CORREL)
-    return correlation
+def check_bulk_item(item, seen_mobiles, needs_image=True):
+    """Status of a bulk item before any image work, or None if it can be processed"""
+    mobile = item.get('mobile')
+    if not mobile or (needs_image and item.get('image') is None):
+        return 'missing_fields'
+    mobile = str(mobile)
+    if len(mobile.encode('utf-8')) > META_DTYPE['mobile'].itemsize:
+        return 'invalid_mobile'
+    if mobile in seen_mobiles:
+        return 'duplicate'
+    seen_mobiles.add(mobile)
+    return None
 
 @bp.route('/face/register', methods=['POST'])
 def register_face():
     try:
-        data = request.json
+        data, image_bytes = read_request_frame()
         mobile = data.get('mobile')
-        image_data = data.get('image')
         user_name = data.get('userName', 'User')
         
-        if not mobile or not image_data:
+        if not mobile or image_bytes is None:
             return jsonify({'success': False, 'message': 'Mobile and image are required'}), 400
         
-        img = decode_base64_image(image_data)
+        scale = request_decode_scale()
+        img = decode_image_bytes(image_bytes, scale)
         if img is None:
             return jsonify({'success': False, 'message': 'Invalid image data'}), 400
         
-        face = detect_face(img)
+        face = detect_face(img, min_size=MIN_FACE_SIZE // scale)
         if face is None:
             return jsonify({'success': False, 'message': 'No face detected. Please ensure your face is clearly visible.'}), 400
         
         face_histogram = compute_face_histogram(face)
+        gallery.upsert(mobile, user_name, face_histogram)
         
-        user_data = {
-            'mobile': mobile,
-            'userName': user_name,
-            'faceHistogram': face_histogram.tolist(),
-            'registeredAt': datetime.now().isoformat()
-        }
-        
-        file_path = os.path.join(FACE_DATA_DIR, f'{mobile}.json')
-        with open(file_path, 'w') as f:
-            json.dump(user_data, f)
-        
-        face_image_path = os.path.join(FACE_DATA_DIR, f'{mobile}_face.jpg')
-        cv2.imwrite(face_image_path, face)
+        if SAVE_FACE_CROPS:
+            face_image_path = os.path.join(FACE_DATA_DIR, f'{mobile}_face.jpg')
+            cv2.imwrite(face_image_path, face)
         
         return jsonify({
             'success': True,
@@ -108,80 +354,242 @@ def register_face():
             'userName': user_name
         })
     
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         print(f"Error in register_face: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
+@bp.route('/face/register/bulk', methods=['POST'])
+def register_face_bulk():
+    """
+    Register many users in one request from (mobile, image) pairs or one group photo.
+
+    Photos are processed on the frame worker pool and all templates are written to
+    the store in a single append. A group photo without assignments only returns
+    the detected faces (left to right) so the client can assign them.
+    """
+    try:
+        start = time.perf_counter()
+        items, group_photo = read_bulk_registration()
+        
+        if not items and group_photo is None:
+            return jsonify({'success': False, 'message': 'items or groupPhoto is required'}), 400
+        if len(items) > FACE_BULK_MAX_ITEMS:
+            return jsonify({'success': False, 'message': f'At most {FACE_BULK_MAX_ITEMS} registrations per request'}), 400
+        
+        scale = request_decode_scale()
+        seen_mobiles = set()
+        statuses = [check_bulk_item(item, seen_mobiles, needs_image=group_photo is None) for item in items]
+        pending = [i for i, status in enumerate(statuses) if status is None]
+        templates = {}
+        
+        if group_photo is not None:
+            img = decode_image_bytes(group_photo, scale)
+            if img is None:
+                return jsonify({'success': False, 'message': 'Invalid image data'}), 400
+            boxes = detect_faces(img, min_size=FACE_GROUP_MIN_FACE_SIZE // scale, detector=group_detector)
+            faces = [{'faceIndex': i, 'box': [int(v * scale) for v in box]} for i, box in enumerate(boxes)]
+            if not items:
+                return jsonify({
+                    'success': True,
+                    'message': f'Detected {len(boxes)} faces. Send assignments to register them.',
+                    'faces': faces
+                })
+            for i in pending:
+                face_index = items[i].get('faceIndex')
+                if not isinstance(face_index, int) or not 0 <= face_index < len(boxes):
+                    statuses[i] = 'unknown_face'
+                    continue
+                face = crop_face(img, boxes[face_index])
+                templates[i] = (face, compute_face_histogram(face))
+        else:
+            results = frame_pool().map(bind_trace(extract_face_template), [items[i]['image'] for i in pending], [scale] * len(pending))
+            for i, (status, face, histogram) in zip(pending, results):
+                if histogram is None:
+                    statuses[i] = status
+                else:
+                    templates[i] = (face, histogram)
+        
+        registered = sorted(templates)
+        gallery.upsert_many([
+            (str(items[i]['mobile']), items[i].get('userName') or 'User', templates[i][1]) for i in registered
+        ])
+        for i in registered:
+            statuses[i] = 'registered'
+        
+        if SAVE_FACE_CROPS and registered:
+            list(frame_pool().map(
+                lambda i: cv2.imwrite(os.path.join(FACE_DATA_DIR, f"{items[i]['mobile']}_face.jpg"), templates[i][0]),
+                registered
+            ))
+        
+        elapsed = time.perf_counter() - start
+        response = {
+            'success': len(registered) > 0,
+            'registered': len(registered),
+            'failed': len(items) - len(registered),
+            'items': [
+                {
+                    'index': i,
+                    'mobile': item.get('mobile'),
+                    'status': status,
+                    'message': BULK_STATUS_MESSAGES[status],
+                    **({'faceIndex': item.get('faceIndex')} if group_photo is not None else {})
+                }
+                for i, (item, status) in enumerate(zip(items, statuses))
+            ],
+            'elapsedMs': round(elapsed * 1000, 1),
+            'facesPerSecond': round(len(registered) / elapsed, 2) if elapsed > 0 else None
+        }
+        if group_photo is not None:
+            response['faces'] = faces
+        return jsonify(response), 200 if registered else 400
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error in register_face_bulk: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
 @bp.route('/face/login', methods=['POST'])
 def login_face():
     try:
-        data = request.json
-        image_data = data.get('image')
+        _, image_bytes = read_request_frame()
         
-        if not image_data:
+        if image_bytes is None:
             return jsonify({'success': False, 'message': 'Image is required'}), 400
         
-        img = decode_base64_image(image_data)
+        scale = request_decode_scale()
+        img = decode_image_bytes(image_bytes, scale)
         if img is None:
             return jsonify({'success': False, 'message': 'Invalid image data'}), 400
         
-        face = detect_face(img)
+        face = detect_face(img, min_size=MIN_FACE_SIZE // scale)
         if face is None:
             return jsonify({'success': False, 'message': 'No face detected. Please ensure your face is clearly visible.'}), 400
         
         current_histogram = compute_face_histogram(face)
         
-        best_match = None
-        best_score = -1
-        threshold = 0.75
+        gallery.refresh_if_changed()
+        matches = gallery.search(current_histogram, k=1)
+        best_match, best_score = matches[0] if matches else (None, -1)
         
-        for filename in os.listdir(FACE_DATA_DIR):
-            if filename.endswith('.json'):
-                file_path = os.path.join(FACE_DATA_DIR, filename)
-                with open(file_path, 'r') as f:
-                    user_data = json.load(f)
-                
-                stored_histogram = np.array(user_data['faceHistogram'])
-                score = compare_faces(current_histogram, stored_histogram)
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = user_data
-        
-        if best_match and best_score >= threshold:
+        if best_match and best_score >= MATCH_THRESHOLD:
             return jsonify({
                 'success': True,
                 'message': 'Face recognized successfully',
                 'mobile': best_match['mobile'],
                 'userName': best_match['userName'],
-                'confidence': float(best_score)
+                'confidence': response_confidence(best_score)
             })
         else:
             return jsonify({
                 'success': False,
                 'message': 'Face not recognized. Please try again or use another login method.',
-                'confidence': float(best_score) if best_score > 0 else 0
+                'confidence': response_confidence(best_score)
             }), 401
     
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         print(f"Error in login_face: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
+@bp.route('/face/login/batch', methods=['POST'])
+def login_face_batch():
+    """Log in from several frames at once, fusing per-user scores across frames"""
+    try:
+        frames = read_request_frames()
+        
+        if not frames:
+            return jsonify({'success': False, 'message': 'At least one image is required'}), 400
+        if len(frames) > FACE_BATCH_MAX_FRAMES:
+            return jsonify({'success': False, 'message': f'At most {FACE_BATCH_MAX_FRAMES} images per request'}), 400
+        
+        scale = request_decode_scale()
+        gallery.refresh_if_changed()
+        fusion = ScoreFusion(gallery)
+        counts = {'ok': 0, 'no_face': 0, 'invalid': 0}
+        best_match, best_score = None, -1.0
+        early_exit = False
+        
+        futures = [frame_pool().submit(bind_trace(extract_face_histogram), frame, scale) for frame in frames]
+        try:
+            for future in as_completed(futures):
+                status, histogram = future.result()
+                counts[status] += 1
+                if histogram is None:
+                    continue
+                
+                matches = fusion.add(histogram)
+                if matches and matches[0][1] >= FACE_EARLY_ACCEPT:
+                    best_match, best_score = matches[0]
+                    early_exit = True
+                    break
+                if len(fusion) >= FACE_BATCH_MIN_FRAMES:
+                    best_match, best_score = fusion.best()
+                    if best_score >= MATCH_THRESHOLD:
+                        early_exit = len(fusion) < len(frames)
+                        break
+        finally:
+            for future in futures:
+                future.cancel()
+        
+        if not early_exit and len(fusion):
+            best_match, best_score = fusion.best()
+        
+        stats = {
+            'framesTotal': len(frames),
+            'framesProcessed': sum(counts.values()),
+            'framesWithFace': counts['ok'],
+            'earlyExit': early_exit
+        }
+        
+        if counts['ok'] == 0:
+            message = 'Invalid image data' if counts['invalid'] == len(frames) else 'No face detected. Please ensure your face is clearly visible.'
+            return jsonify({'success': False, 'message': message, **stats}), 400
+        
+        if best_match and best_score >= MATCH_THRESHOLD:
+            return jsonify({
+                'success': True,
+                'message': 'Face recognized successfully',
+                'mobile': best_match['mobile'],
+                'userName': best_match['userName'],
+                'confidence': response_confidence(best_score),
+                **stats
+            })
+        return jsonify({
+            'success': False,
+            'message': 'Face not recognized. Please try again or use another login method.',
+            'confidence': response_confidence(best_score),
+            **stats
+        }), 401
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error in login_face_batch: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
 @bp.route('/face/health', methods=['GET'])
 def health():
-    registered_count = len([f for f in os.listdir(FACE_DATA_DIR) if f.endswith('.json')])
+    registered_count = len(gallery)
     return jsonify({
         'status': 'ok', 
         'message': 'Face recognition API is running',
         'modelLoaded': not face_cascade.empty(),
-        'registeredFaces': registered_count
+        'registeredFaces': registered_count,
+        'detectionProfile': face_detector.profile,
+        'detectionTimings': face_detector.timings.summary()
     })
 
 @bp.route('/face/check-registered', methods=['GET'])
 def check_registered():
     """Check if any faces are registered"""
     try:
-        registered_count = len([f for f in os.listdir(FACE_DATA_DIR) if f.endswith('.json')])
+        gallery.refresh_if_changed()
+        registered_count = len(gallery)
         return jsonify({
             'hasRegisteredFaces': registered_count > 0,
             'count': registered_count
@@ -191,3 +599,179 @@ def check_registered():
             'hasRegisteredFaces': False,
             'error': str(e)
         }), 500
+
+
+@bp.cli.command('migrate-json')
+@click.option('--remove-json', is_flag=True, help='Delete the JSON files whose mobiles are in the template store.')
+def migrate_json_command(remove_json):
+    """Import legacy {mobile}.json registrations into the template store."""
+    # Starting the app already imports them into an empty store; then this finds nothing new
+    migrated = migrate_json_templates(FACE_DATA_DIR, template_store, normalize_histograms)
+    click.echo(f"Migrated {migrated} face templates into {FACE_STORE_DIR}")
+    if remove_json:
+        removed = remove_migrated_json(FACE_DATA_DIR, template_store)
+        click.echo(f"Removed {removed} JSON files already in the template store")
+
+
+@bp.cli.command('compact')
+def compact_command():
+    """Fold the template append log into the memory-mapped base file."""
+    template_store.compact()
+    click.echo(f"Compacted {len(template_store)} face templates (generation {template_store.generation})")
+    if gallery.store is not template_store:
+        gallery.store.compact()
+        click.echo(f"Compacted {len(gallery.store)} compressed descriptors (generation {gallery.store.generation})")
+
+
+@bp.cli.command('build-index')
+@click.option('--lists', type=int, default=None, help='Number of IVF buckets (default ~4*sqrt(N)).')
+@click.option('--iterations', type=int, default=20, show_default=True)
+@click.option('--sample', type=int, default=50000, show_default=True, help='Rows used to train the centroids.')
+def build_index_command(lists, iterations, sample):
+    """Compact the template store and build the IVF face index offline."""
+    gallery.store.compact()
+    snapshot = gallery.store.snapshot()
+    mobiles = [m.decode('utf-8') for m in snapshot.base_meta['mobile'].tolist()]
+    index = IVFIndex.build(snapshot.base_vectors, mobiles, n_lists=lists, iterations=iterations, sample_size=sample)
+    index.save(FACE_ANN_INDEX)
+    click.echo(f"Indexed {len(index)} face templates into {index.n_lists} lists at {FACE_ANN_INDEX}")
+
+
+@bp.cli.command('eval-index')
+@click.option('--queries', type=int, default=500, show_default=True)
+@click.option('--noise', type=float, default=0.3, show_default=True, help='Noise added to each probe, relative to its norm.')
+@click.option('--n-probe', 'n_probes', default='1,2,4,8,16,32', show_default=True)
+def eval_index_command(queries, noise, n_probes):
+    """Report recall@1 and latency of the IVF index against exhaustive search."""
+    if not gallery.load_index(FACE_ANN_INDEX):
+        raise click.ClickException(f"No face index at {FACE_ANN_INDEX}; run 'flask face build-index' first")
+    gallery.ann_min_rows = 0
+    # Probes are full-width templates; the gallery encodes them itself when compressed
+    snapshot = template_store.snapshot()
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(snapshot.base_vectors), size=min(queries, len(snapshot.base_vectors)), replace=False)
+    probes = np.asarray(snapshot.base_vectors[rows], dtype=np.float32)
+    probes += rng.normal(scale=noise / np.sqrt(probes.shape[1]), size=probes.shape).astype(np.float32)
+
+    def run(**kwargs):
+        start = time.perf_counter()
+        best = [gallery.search(probe, k=1, **kwargs)[0][0]['mobile'] for probe in probes]
+        return best, (time.perf_counter() - start) * 1000 / len(probes)
+
+    exact, exact_ms = run(exhaustive=True)
+    click.echo(f"exhaustive: {exact_ms:.3f} ms/query over {len(gallery)} templates")
+    for n_probe in (int(n) for n in n_probes.split(',')):
+        found, ms = run(n_probe=n_probe)
+        recall = np.mean([a == b for a, b in zip(found, exact)])
+        click.echo(f"n_probe={n_probe:4d}: recall@1={recall:.3f} {ms:.3f} ms/query")
+
+
+@bp.cli.command('compress')
+@click.option('--bins', type=int, default=256, show_default=True, help='Histogram bins kept per channel; must divide 256.')
+@click.option('--pca', 'components', type=int, default=None, help='Principal components kept (default: no PCA).')
+@click.option('--dtype', type=click.Choice(CODEC_DTYPES), default='int8', show_default=True)
+@click.option('--off', is_flag=True, help='Remove the compressed copy so logins score full-width templates again.')
+def compress_command(bins, components, dtype, off):
+    """Fit a descriptor codec on the gallery and write the compressed copy logins score against."""
+    names = (os.path.basename(FACE_CODEC_PATH), BASE_FILE, LOG_FILE, 'ivf.npz')
+    if off:
+        for name in names:
+            path = os.path.join(FACE_CODEC_DIR, name)
+            if os.path.exists(path):
+                os.remove(path)
+        click.echo("Removed compressed descriptors; restart the app to score full-width templates")
+        return
+
+    template_store.compact()
+    snapshot = template_store.snapshot()
+    codec = DescriptorCodec.fit(snapshot.base_vectors, bins=bins, n_components=components, dtype=dtype)
+
+    os.makedirs(FACE_CODEC_DIR, exist_ok=True)
+    for name in names:
+        path = os.path.join(FACE_CODEC_DIR, name)
+        if os.path.exists(path):
+            os.remove(path)
+    compressed = TemplateStore(FACE_CODEC_DIR, dim=codec.dim, dtype=codec.dtype, compact_every=0)
+    compressed.open()
+    chunk_rows = 10000
+    for start in range(0, len(snapshot.base_meta), chunk_rows):
+        meta = snapshot.base_meta[start:start + chunk_rows]
+        encoded = codec.encode(snapshot.base_vectors[start:start + chunk_rows])
+        compressed.append_many(
+            (row['mobile'].decode('utf-8'), row['userName'].decode('utf-8', errors='replace'), vector, float(row['registeredAt']))
+            for row, vector in zip(meta, encoded)
+        )
+    compressed.compact()
+    codec.save(FACE_CODEC_PATH)
+
+    full_bytes = template_store.dim * np.dtype(template_store.dtype).itemsize
+    click.echo(
+        f"Compressed {len(compressed)} face templates from {full_bytes} to "
+        f"{codec.describe()['bytesPerTemplate']} bytes each ({codec.describe()})"
+    )
+    click.echo("Restart the app to serve them, and rerun 'flask face build-index' if you use the IVF index")
+
+
+@bp.cli.command('eval-codec')
+@click.option('--bins', type=int, default=256, show_default=True)
+@click.option('--pca', 'components', type=int, default=None)
+@click.option('--dtype', type=click.Choice(CODEC_DTYPES), default='int8', show_default=True)
+@click.option('--queries', type=int, default=500, show_default=True)
+@click.option('--noise', type=float, default=0.3, show_default=True, help='Noise added to each probe, relative to its norm.')
+def eval_codec_command(bins, components, dtype, queries, noise):
+    """Report the match-accuracy delta of a descriptor codec against full-width templates."""
+    snapshot = template_store.snapshot()
+    full = np.concatenate([
+        np.asarray(snapshot.base_vectors[snapshot.base_live], dtype=np.float32),
+        snapshot.delta_vectors[snapshot.delta_live],
+    ])
+    if not len(full):
+        raise click.ClickException("No registered faces to evaluate against")
+    codec = DescriptorCodec.fit(full, bins=bins, n_components=components, dtype=dtype)
+    encoded = codec.encode(full)
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(full), size=min(queries, len(full)), replace=False)
+    probes = full[rows] + rng.normal(scale=noise / np.sqrt(full.shape[1]), size=(len(rows), full.shape[1]))
+    probes = normalize_histograms(probes)
+
+    def run(matrix, encode_probe):
+        start = time.perf_counter()
+        best, best_scores, true_scores, impostor_scores = [], [], [], []
+        for row, probe in zip(rows, probes):
+            scores = score_rows(matrix, encode_probe(probe))
+            top = int(np.argmax(scores))
+            best.append(top)
+            best_scores.append(scores[top])
+            true_scores.append(scores[row])
+            scores[row] = -np.inf
+            impostor_scores.append(scores.max() if len(scores) > 1 else -1.0)
+        elapsed = (time.perf_counter() - start) * 1000 / len(rows)
+        return np.array(best), np.array(best_scores), np.array(true_scores), np.array(impostor_scores), elapsed
+
+    full_best, full_scores, full_true, full_impostor, full_ms = run(full, lambda probe: probe)
+    codec_best, codec_scores, codec_true, codec_impostor, codec_ms = run(encoded, codec.probe)
+
+    def accuracy(best, scores):
+        # A login is correct when the right user ranks first and clears the threshold
+        return float(np.mean((best == rows) & (scores >= MATCH_THRESHOLD)))
+
+    full_accuracy = accuracy(full_best, full_scores)
+    codec_accuracy = accuracy(codec_best, codec_scores)
+    agreement = np.mean((full_best == codec_best) & ((full_scores >= MATCH_THRESHOLD) == (codec_scores >= MATCH_THRESHOLD)))
+    score_error = np.abs(codec_true - full_true)
+    click.echo(f"codec: {codec.describe()}")
+    click.echo(f"templates: {len(full)}, queries: {len(rows)}, threshold: {MATCH_THRESHOLD}")
+    # Share of probes where some other user also clears the threshold
+    full_false = np.mean(full_impostor >= MATCH_THRESHOLD)
+    codec_false = np.mean(codec_impostor >= MATCH_THRESHOLD)
+    click.echo(
+        f"full:       accuracy={full_accuracy:.4f} false-accept={full_false:.4f} "
+        f"{full_ms:.3f} ms/query {full.shape[1] * 4} bytes/template"
+    )
+    click.echo(
+        f"compressed: accuracy={codec_accuracy:.4f} false-accept={codec_false:.4f} "
+        f"{codec_ms:.3f} ms/query {codec.describe()['bytesPerTemplate']} bytes/template"
+    )
+    click.echo(f"accuracy delta: {codec_accuracy - full_accuracy:+.4f}, decision agreement: {agreement:.4f}")
+    click.echo(f"score error vs full: mean={score_error.mean():.4f} max={score_error.max():.4f}")
@@ -0,0 +1,208 @@
+from flask import Blueprint
+from flask_sock import ConnectionClosed, Sock
+import cv2
+import json
+import os
+import time
+from ..face_detection import FaceTracker
+from ..face_gallery import ScoreFusion, compute_face_histogram
+from .face_recognition import (
+    FACE_BATCH_MIN_FRAMES,
+    FACE_EARLY_ACCEPT,
+    MATCH_THRESHOLD,
+    MIN_FACE_SIZE,
+    decode_base64_payload,
+    decode_image_bytes,
+    face_detector,
+    gallery,
+    request_decode_scale,
+    response_confidence,
+)
+
+bp = Blueprint("face_stream", __name__)
+sock = Sock()
+
+# A session ends with a failed result after this many processed frames or seconds
+FACE_STREAM_MAX_FRAMES = int(os.environ.get('FACE_STREAM_MAX_FRAMES', 60))
+FACE_STREAM_MAX_SECONDS = float(os.environ.get('FACE_STREAM_MAX_SECONDS', 15))
+FACE_STREAM_IDLE_SECONDS = float(os.environ.get('FACE_STREAM_IDLE_SECONDS', 5))
+
+# Tracking: below this match score the face counts as lost and is detected again;
+# a full detection is also forced every N frames to correct drift and scale changes
+FACE_STREAM_TRACK_MIN_SCORE = float(os.environ.get('FACE_STREAM_TRACK_MIN_SCORE', 0.6))
+FACE_STREAM_REDETECT_EVERY = int(os.environ.get('FACE_STREAM_REDETECT_EVERY', 15))
+
+
+class StreamSession:
+    """Per-connection state: the face tracker, fused scores and frame counters"""
+
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.min_size = MIN_FACE_SIZE // scale
+        self.tracker = FaceTracker(min_score=FACE_STREAM_TRACK_MIN_SCORE)
+        self.fusion = ScoreFusion(gallery)
+        self.started = time.perf_counter()
+        self.received = 0
+        self.skipped = 0
+        self.processed = 0
+        self.detected = 0
+        self.tracked = 0
+        self.since_detect = 0
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def stats(self):
+        return {
+            'framesReceived': self.received,
+            'framesSkipped': self.skipped,
+            'framesProcessed': self.processed,
+            'framesDetected': self.detected,
+            'framesTracked': self.tracked,
+            'elapsedMs': round(self.elapsed_ms(), 1)
+        }
+
+    def locate(self, img):
+        """Face box in this frame: tracked when possible, detected otherwise; returns (box, mode)"""
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if self.tracker.active and self.since_detect < FACE_STREAM_REDETECT_EVERY:
+            start = time.perf_counter()
+            box = self.tracker.update(gray)
+            face_detector.timings.record({'track': (time.perf_counter() - start) * 1000})
+            if box is not None:
+                self.tracked += 1
+                self.since_detect += 1
+                return box, 'track'
+
+        faces, timings = face_detector.detect(gray, self.min_size)
+        face_detector.timings.record(timings)
+        self.detected += 1
+        self.since_detect = 0
+        if len(faces) == 0:
+            self.tracker.reset()
+            return None, 'detect'
+        self.tracker.start(gray, faces[0])
+        return faces[0], 'detect'
+
+    def process(self, frame_bytes):
+        """
+        Score one frame against the gallery.
+
+        Returns:
+            (progress message dict, (user dict, score) once the session is confident or None)
+        """
+        self.processed += 1
+        img = decode_image_bytes(frame_bytes, self.scale)
+        if img is None:
+            return {'type': 'progress', 'frame': self.processed, 'status': 'invalid'}, None
+
+        box, mode = self.locate(img)
+        if box is None:
+            return {'type': 'progress', 'frame': self.processed, 'status': 'no_face', 'mode': mode}, None
+
+        x, y, w, h = box
+        face = cv2.resize(img[y:y+h, x:x+w], (128, 128))
+        # A tracked frame shows the face already searched for, so it only re-scores
+        # the candidates instead of scanning the gallery again
+        matches = self.fusion.add(compute_face_histogram(face), search=(mode == 'detect'))
+
+        accepted = None
+        if matches and matches[0][1] >= FACE_EARLY_ACCEPT:
+            accepted = matches[0]
+        elif len(self.fusion) >= FACE_BATCH_MIN_FRAMES:
+            best_match, best_score = self.fusion.best()
+            if best_match and best_score >= MATCH_THRESHOLD:
+                accepted = (best_match, best_score)
+
+        _, fused_score = self.fusion.best()
+        progress = {
+            'type': 'progress',
+            'frame': self.processed,
+            'status': 'ok',
+            'mode': mode,
+            'box': [int(v * self.scale) for v in box],
+            'confidence': response_confidence(fused_score)
+        }
+        return progress, accepted
+
+
+def read_latest_frame(ws, session, timeout):
+    """
+    Wait for the next frame and drop any older ones queued behind it, so a slow
+    session always works on the newest frame instead of falling further behind.
+
+    Returns the encoded frame bytes, or None on timeout or when the client asks to stop.
+    """
+    frame = None
+    message = ws.receive(timeout=timeout)
+    while message is not None:
+        if isinstance(message, str):
+            if message.lstrip().startswith('{'):
+                control = json.loads(message)
+                if control.get('type') == 'stop':
+                    return None
+                message = decode_base64_payload(control.get('image') or '')
+            else:
+                message = decode_base64_payload(message)
+        session.received += 1
+        if frame is not None:
+            session.skipped += 1
+        frame = message
+        message = ws.receive(timeout=0)
+    return frame
+
+
+@sock.route('/face/stream', bp=bp)
+def face_stream(ws):
+    """
+    Streaming face login.
+
+    The client sends frames as binary JPEG/PNG messages (or base64 data URLs as
+    text) and receives JSON `progress` messages, then a single `result` message
+    as soon as the fused confidence passes the threshold, after which the
+    connection is closed.
+    """
+    try:
+        session = StreamSession(request_decode_scale())
+    except ValueError as e:
+        ws.send(json.dumps({'type': 'result', 'success': False, 'message': str(e)}))
+        return
+
+    gallery.refresh_if_changed()
+    ws.send(json.dumps({'type': 'ready', 'threshold': MATCH_THRESHOLD, 'maxFrames': FACE_STREAM_MAX_FRAMES}))
+
+    try:
+        while session.processed < FACE_STREAM_MAX_FRAMES and session.elapsed_ms() < FACE_STREAM_MAX_SECONDS * 1000:
+            frame = read_latest_frame(ws, session, FACE_STREAM_IDLE_SECONDS)
+            if frame is None:
+                break
+            progress, accepted = session.process(frame)
+            if accepted:
+                user, score = accepted
+                ws.send(json.dumps({
+                    'type': 'result',
+                    'success': True,
+                    'message': 'Face recognized successfully',
+                    'mobile': user['mobile'],
+                    'userName': user['userName'],
+                    'confidence': response_confidence(score),
+                    **session.stats()
+                }))
+                return
+            ws.send(json.dumps(progress))
+
+        _, best_score = session.fusion.best()
+        ws.send(json.dumps({
+            'type': 'result',
+            'success': False,
+            'message': 'Face not recognized. Please try again or use another login method.',
+            'confidence': response_confidence(best_score),
+            **session.stats()
+        }))
+    except ValueError as e:
+        ws.send(json.dumps({'type': 'result', 'success': False, 'message': str(e)}))
+    except ConnectionClosed:
+        raise
+    except Exception as e:
+        print(f"Error in face_stream: {str(e)}")
+        ws.send(json.dumps({'type': 'result', 'success': False, 'message': f'Error: {str(e)}'}))
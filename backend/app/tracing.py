@@ -0,0 +1,246 @@
+import contextvars
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request
+
+# Requests slower than this many milliseconds print their span breakdown; 0 turns it off
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', 5000))
+# Spans kept per request; a large batch stops recording after this many
+TRACE_MAX_SPANS = int(os.environ.get('TRACE_MAX_SPANS', 256))
+# Prefix lines printed while serving a request with its trace id
+TRACE_LOG_PREFIX = os.environ.get('TRACE_LOG_PREFIX', '1') != '0'
+
+TRACE_HEADER = 'X-Trace-Id'
+# W3C traceparent: version-traceid-parentid-flags
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$')
+_TRACE_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+# Index of the innermost open span, the parent of spans opened now
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Trace:
+    """The spans of one request, as [name, parent index, start s, duration s] from the request start"""
+
+    def __init__(self, name, trace_id=None):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.start = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def open(self, name, parent, start):
+        """Index of a new span, or None once TRACE_MAX_SPANS are recorded"""
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return None
+            self.spans.append([name, parent, start - self.start, None])
+            return len(self.spans) - 1
+
+    def close(self, index, end):
+        span = self.spans[index]
+        span[3] = end - self.start - span[2]
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        """Server-Timing header value: the total time of each span name finished so far"""
+        totals = {}
+        for name, _, _, duration in self.spans:
+            if duration is not None:
+                totals[name] = totals.get(name, 0.0) + duration
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items()]
+        return ', '.join(entries + [f'total;dur={self.elapsed_ms():.1f}'])
+
+    def breakdown(self):
+        """The span tree as indented lines, children under their parent in start order"""
+        children = {}
+        for index, (_, parent, _, _) in enumerate(self.spans):
+            children.setdefault(parent, []).append(index)
+        lines = []
+
+        def walk(parent, depth):
+            for index in children.get(parent, []):
+                name, _, start, duration = self.spans[index]
+                took = 'unfinished' if duration is None else f'{duration * 1000:.1f} ms'
+                lines.append(f"{'  ' * depth}{name} {took} (at {start * 1000:.1f} ms)")
+                walk(index, depth + 1)
+
+        walk(None, 1)
+        if self.dropped:
+            lines.append(f'  ... {self.dropped} more spans not recorded')
+        return lines
+
+
+def incoming_trace_id(headers):
+    """The caller's trace id from a traceparent or X-Trace-Id / X-Request-ID header, if well-formed"""
+    match = _TRACEPARENT.match(headers.get('traceparent', '').strip())
+    if match:
+        return match.group(1)
+    for name in (TRACE_HEADER, 'X-Request-ID'):
+        value = headers.get(name, headers.get(name.lower(), '')).strip()
+        if _TRACE_ID.match(value):
+            return value
+    return None
+
+
+def start_trace(name, headers):
+    trace = Trace(name, incoming_trace_id(headers))
+    current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def finish_trace(trace, status):
+    """Ends the request's trace; slow requests print their span breakdown"""
+    if current_trace.get() is trace:
+        current_trace.set(None)
+    elapsed = trace.elapsed_ms()
+    if TRACE_SLOW_MS and elapsed >= TRACE_SLOW_MS:
+        lines = [f"[trace {trace.trace_id}] Slow request {trace.name} -> {status} took {elapsed:.1f} ms:"]
+        # One write, so lines from other threads cannot land inside the breakdown
+        print("\n".join(lines + trace.breakdown()) + "\n", end="")
+
+
+def trace_headers(trace):
+    return {TRACE_HEADER: trace.trace_id, 'Server-Timing': trace.server_timing()}
+
+
+@contextmanager
+def span(name):
+    """Records the block as a span of the current request's trace (nothing outside a request)"""
+    trace = current_trace.get()
+    index = trace.open(name, _current_span.get(), time.perf_counter()) if trace is not None else None
+    if index is None:
+        yield
+        return
+    token = _current_span.set(index)
+    try:
+        yield
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. a generator finished elsewhere)
+            _current_span.set(trace.spans[index][1])
+        trace.close(index, time.perf_counter())
+
+
+def record_span(name, seconds):
+    """Adds a span that just ended after `seconds`, for timings measured elsewhere"""
+    trace = current_trace.get()
+    if trace is None:
+        return
+    end = time.perf_counter()
+    index = trace.open(name, _current_span.get(), end - seconds)
+    if index is not None:
+        trace.close(index, end)
+
+
+def bind_trace(fn):
+    """
+    `fn` wrapped to record its spans in the current trace when a pool thread runs it;
+    thread pools do not carry context variables over by themselves
+    """
+    trace = current_trace.get()
+    parent = _current_span.get()
+    if trace is None:
+        return fn
+
+    def in_trace(*args, **kwargs):
+        current_trace.set(trace)
+        _current_span.set(parent)
+        return fn(*args, **kwargs)
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        # A fresh context per call leaves the pool thread's own one untouched
+        return contextvars.copy_context().run(in_trace, *args, **kwargs)
+    return run
+
+
+def traced(name):
+    """Decorator recording each call of a function or coroutine function as a span"""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def run_async(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return run_async
+
+        @wraps(fn)
+        def run(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return run
+    return decorate
+
+
+class TraceLogStream:
+    """Wraps stdout or stderr so lines written while serving a request start with its trace id"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._state = threading.local()
+
+    def write(self, text):
+        trace = current_trace.get()
+        at_line_start = getattr(self._state, 'at_line_start', True)
+        if text:
+            self._state.at_line_start = text.endswith('\n')
+        if trace is None or not text:
+            return self._stream.write(text)
+        prefix = f'[trace {trace.trace_id}] '
+        parts = text.split('\n')
+        for i, part in enumerate(parts):
+            if part and (i > 0 or at_line_start):
+                parts[i] = prefix + part
+        self._stream.write('\n'.join(parts))
+        return len(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def install_log_prefix():
+    if not isinstance(sys.stdout, TraceLogStream):
+        sys.stdout = TraceLogStream(sys.stdout)
+    if not isinstance(sys.stderr, TraceLogStream):
+        sys.stderr = TraceLogStream(sys.stderr)
+
+
+def init_tracing(app):
+    """Traces every Flask request: X-Trace-Id and Server-Timing headers, trace ids in printed lines"""
+    if TRACE_LOG_PREFIX:
+        install_log_prefix()
+
+    @app.before_request
+    def start_request_trace():
+        g.trace = start_trace(f'{request.method} {request.path}', request.headers)
+
+    @app.after_request
+    def add_trace_headers(response):
+        trace = g.get('trace')
+        if trace is not None:
+            g.response_status = response.status_code
+            response.headers.update(trace_headers(trace))
+        return response
+
+    @app.teardown_request
+    def finish_request_trace(error=None):
+        trace = g.get('trace')
+        if trace is not None:
+            finish_trace(trace, 500 if error is not None else getattr(g, 'response_status', '-'))
@@ -0,0 +1,140 @@
+import threading
+import time
+
+from .pdf_service import get_bp_status, get_hr_status, get_o2_status, get_temp_status
+
+# Urgency levels from least to most urgent, worded like the analysis prompt's choices
+TRIAGE_URGENCY = {
+    "routine": "Consult a healthcare professional",
+    "monitor": "Monitor closely - See doctor if worsens",
+    "urgent": "Seek medical attention promptly within 24 hours",
+    "emergency": "Seek immediate medical attention - Emergency",
+}
+TRIAGE_LEVELS = list(TRIAGE_URGENCY)
+
+# Level for each (vital, pdf_service status) pair; unlisted statuses are routine
+STATUS_LEVELS = {
+    ("temperature", "High (Fever)"): "urgent",
+    ("temperature", "Low"): "monitor",
+    ("bloodPressure", "High"): "monitor",
+    ("bloodPressure", "Low"): "monitor",
+    ("heartRate", "High"): "monitor",
+    ("heartRate", "Low"): "monitor",
+    ("oxygenLevel", "Concerning"): "urgent",
+    ("oxygenLevel", "Critical"): "emergency",
+}
+
+# Values past these limits are emergencies whatever the status bands say
+CRITICAL_LIMITS = {
+    "temperature": (35.0, 40.5),
+    "systolicBP": (70, 180),
+    "diastolicBP": (None, 120),
+    "heartRate": (40, 150),
+}
+
+VITAL_LABELS = {
+    "temperature": ("Temperature", "°C"),
+    "bloodPressure": ("Blood pressure", " mmHg"),
+    "heartRate": ("Heart rate", " bpm"),
+    "oxygenLevel": ("Oxygen saturation", "%"),
+}
+
+
+def _number(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _status(fn, *values):
+    """pdf_service status for the values, or 'N/A' if any is missing or not a number"""
+    if any(_number(value) is None for value in values):
+        return "N/A"
+    return fn(*values)
+
+
+def _past_limit(name, value):
+    low, high = CRITICAL_LIMITS[name]
+    value = _number(value)
+    if value is None:
+        return False
+    return (low is not None and value < low) or (high is not None and value > high)
+
+
+class TriageStats:
+    """Thread-safe counts of triage levels and of requests answered without the model"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.levels = dict.fromkeys(TRIAGE_LEVELS, 0)
+        self.short_circuits = 0
+
+    def record(self, level, short_circuit=False):
+        with self._lock:
+            self.levels[level] += 1
+            self.short_circuits += 1 if short_circuit else 0
+
+    def summary(self):
+        with self._lock:
+            return {"levels": dict(self.levels), "shortCircuits": self.short_circuits}
+
+
+triage_stats = TriageStats()
+
+
+def triage_vitals(health_params):
+    """
+    Rule-based urgency from the vital signs, using the same bands as the PDF report.
+
+    Returns a dict with the level (one of TRIAGE_LEVELS), its urgency text, whether
+    the case is critical enough to answer without the model, the per-vital status
+    and a finding for each abnormal vital.
+    """
+    start = time.perf_counter()
+    health_params = health_params or {}
+    temperature = health_params.get("temperature")
+    systolic = health_params.get("systolicBP")
+    diastolic = health_params.get("diastolicBP")
+    heart_rate = health_params.get("heartRate")
+    oxygen_level = health_params.get("oxygenLevel")
+
+    statuses = {
+        "temperature": _status(get_temp_status, temperature),
+        "bloodPressure": _status(get_bp_status, systolic, diastolic),
+        "heartRate": _status(get_hr_status, heart_rate),
+        "oxygenLevel": _status(get_o2_status, oxygen_level),
+    }
+    values = {
+        "temperature": temperature,
+        "bloodPressure": "/".join(str(value) for value in (systolic, diastolic) if _number(value) is not None),
+        "heartRate": heart_rate,
+        "oxygenLevel": oxygen_level,
+    }
+    extremes = {
+        "temperature": _past_limit("temperature", temperature),
+        "bloodPressure": _past_limit("systolicBP", systolic) or _past_limit("diastolicBP", diastolic),
+        "heartRate": _past_limit("heartRate", heart_rate),
+        "oxygenLevel": False,
+    }
+
+    level = "routine"
+    findings = []
+    for vital, status in statuses.items():
+        vital_level = "emergency" if extremes[vital] else STATUS_LEVELS.get((vital, status), "routine")
+        if vital_level == "routine":
+            continue
+        label, unit = VITAL_LABELS[vital]
+        severity = "Critical" if vital_level == "emergency" else status
+        findings.append(f"{label} {values[vital]}{unit}: {severity}")
+        if TRIAGE_LEVELS.index(vital_level) > TRIAGE_LEVELS.index(level):
+            level = vital_level
+
+    return {
+        "level": level,
+        "urgency": TRIAGE_URGENCY[level],
+        "critical": level == "emergency",
+        "vitals": statuses,
+        "findings": findings,
+        "elapsedUs": round((time.perf_counter() - start) * 1e6, 1),
+    }
@@ -0,0 +1,16 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables before the app modules read their settings
+load_dotenv()
+
+from app import create_app  # noqa: E402
+from app.asgi import create_asgi_app  # noqa: E402
+
+app = create_asgi_app(create_app())
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.environ.get("PORT", 8000))
+    uvicorn.run("asgi:app", host="0.0.0.0", port=port, workers=int(os.environ.get("WEB_CONCURRENCY", 1)))
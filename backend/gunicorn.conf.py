@@ -0,0 +1,26 @@
+"""
+gunicorn settings, read automatically when gunicorn starts from backend/.
+
+Gives the workers a shared PROMETHEUS_MULTIPROC_DIR so /api/metrics reports every
+worker's samples whichever worker answers the scrape (see app/metrics.py).
+"""
+import glob
+import os
+import tempfile
+
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='digitalvaidya-metrics-')
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def on_starting(server):
+    # Samples left by a previous run would be counted again
+    for path in glob.glob(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], '*.db')):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drops the worker from the live gauges (in-flight calls, gallery size)
+    multiprocess.mark_process_dead(worker.pid)
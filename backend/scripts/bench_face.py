@@ -0,0 +1,326 @@
+"""
+Benchmark the face-recognition endpoints against synthetic galleries.
+
+For every gallery size a fresh worker process generates that many synthetic
+templates in a temporary FACE_DATA_DIR, starts the app, and replays each workload
+through the Flask test client:
+
+    register          POST /api/face/register (raw JPEG body)
+    login             POST /api/face/login
+    login_batch       POST /api/face/login/batch (3 frames, multipart)
+    health            GET  /api/face/health
+    check_registered  GET  /api/face/check-registered
+
+Per endpoint it reports p50/p95/p99 latency, throughput and peak RSS (VmHWM,
+reset before each workload on Linux), plus gallery generation and startup cost.
+FACE_* environment variables are passed through, so configurations such as
+FACE_STORE_DTYPE=float16 or FACE_DETECT_PROFILE=fast can be compared run to run.
+
+Usage (from backend/):
+    python scripts/bench_face.py --sizes 1000,10000,100000 --json bench/base.json
+    python scripts/bench_face.py --sizes 10000 --json bench/new.json --compare bench/base.json
+
+Probe images default to the team photos in ../public/team. With --compare the
+script exits non-zero when p95 latency, throughput or peak RSS of any endpoint
+regressed by more than --tolerance.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGES = os.path.join(BACKEND_DIR, '..', 'public', 'team')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+WORKLOADS = ('register', 'login', 'login_batch', 'health', 'check_registered')
+BATCH_FRAMES = 3
+
+
+def synthetic_histograms(count, rng, chunk_rows=10000):
+    """
+    Colour histograms shaped like real ones: a few smooth bumps per channel plus noise.
+    Yields (rows, 768) float32 chunks.
+    """
+    bins = np.arange(256, dtype=np.float32)
+    for start in range(0, count, chunk_rows):
+        rows = min(chunk_rows, count - start)
+        hist = np.zeros((rows, 3, 256), dtype=np.float32)
+        for _ in range(3):
+            centers = rng.uniform(0, 256, size=(rows, 3, 1)).astype(np.float32)
+            widths = rng.uniform(6, 40, size=(rows, 3, 1)).astype(np.float32)
+            weights = rng.uniform(0.2, 1.0, size=(rows, 3, 1)).astype(np.float32)
+            hist += weights * np.exp(-0.5 * ((bins - centers) / widths) ** 2)
+        hist += rng.uniform(0, 0.02, size=hist.shape).astype(np.float32)
+        yield hist.reshape(rows, -1)
+
+
+def generate_gallery(face_data_dir, size, seed=0):
+    """Write `size` synthetic templates straight into a compacted template store"""
+    from app.face_gallery import normalize_histograms
+    from app.face_store import TemplateStore
+
+    store = TemplateStore(
+        os.path.join(face_data_dir, 'store'),
+        dtype=os.environ.get('FACE_STORE_DTYPE', 'float32'), compact_every=0,
+    )
+    store.open()
+    rng = np.random.default_rng(seed)
+    row = 0
+    for chunk in synthetic_histograms(size, rng):
+        vectors = normalize_histograms(chunk)
+        store.append_many((f'{row + i:010d}', 'Synthetic', vector, None) for i, vector in enumerate(vectors))
+        row += len(vectors)
+    store.compact()
+
+
+def reset_peak_rss():
+    """Reset VmHWM so the next reading covers only what runs after this call (Linux)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def build_request(workload, i, images):
+    """(method, url, test-client kwargs) for the i-th request of a workload"""
+    import io
+
+    image = images[i % len(images)]
+    if workload == 'register':
+        return 'POST', f'/api/face/register?mobile=bench{i}&userName=Bench', {'data': image, 'content_type': 'image/jpeg'}
+    if workload == 'login':
+        return 'POST', '/api/face/login', {'data': image, 'content_type': 'image/jpeg'}
+    if workload == 'login_batch':
+        frames = [(io.BytesIO(images[(i + k) % len(images)]), f'frame{k}.jpg') for k in range(BATCH_FRAMES)]
+        return 'POST', '/api/face/login/batch', {'data': {'image': frames}, 'content_type': 'multipart/form-data'}
+    if workload == 'health':
+        return 'GET', '/api/face/health', {}
+    return 'GET', '/api/face/check-registered', {}
+
+
+def run_workload(app, workload, requests, concurrency, images):
+    import threading
+
+    local = threading.local()
+
+    def one(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        method, url, kwargs = build_request(workload, i, images)
+        start = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, response.status_code
+
+    reset_peak_rss()
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+    else:
+        results = [one(i) for i in range(requests)]
+    wall = time.perf_counter() - start
+
+    latencies = [ms for ms, _ in results]
+    status_codes = {}
+    for _, code in results:
+        status_codes[str(code)] = status_codes.get(str(code), 0) + 1
+    return {
+        'requests': requests,
+        'statusCodes': status_codes,
+        'meanMs': round(float(np.mean(latencies)), 3),
+        'p50Ms': round(percentile(latencies, 50), 3),
+        'p95Ms': round(percentile(latencies, 95), 3),
+        'p99Ms': round(percentile(latencies, 99), 3),
+        'throughputRps': round(requests / wall, 2) if wall > 0 else None,
+        'peakRssMb': round(peak_rss_mb(), 1),
+    }
+
+
+def worker(args):
+    """Benchmark one gallery size; runs in its own process with FACE_DATA_DIR already set"""
+    sys.path.insert(0, BACKEND_DIR)
+    face_data_dir = os.environ['FACE_DATA_DIR']
+    images = load_images(args.images)
+
+    start = time.perf_counter()
+    generate_gallery(face_data_dir, args.size)
+    generate_seconds = time.perf_counter() - start
+
+    reset_peak_rss()
+    start = time.perf_counter()
+    from app import create_app
+    app = create_app()
+    startup_seconds = time.perf_counter() - start
+    startup_rss = peak_rss_mb()
+
+    endpoints = {}
+    for workload in args.workloads.split(','):
+        endpoints[workload] = run_workload(app, workload, args.requests, args.concurrency, images)
+
+    result = {
+        'size': args.size,
+        'generateSeconds': round(generate_seconds, 3),
+        'startupSeconds': round(startup_seconds, 3),
+        'startupPeakRssMb': round(startup_rss, 1),
+        'endpoints': endpoints,
+    }
+    with open(args.worker_out, 'w') as f:
+        json.dump(result, f)
+
+
+def load_images(image_dir):
+    paths = sorted(p for p in glob.glob(os.path.join(image_dir, '*')) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise SystemExit(f"No probe images in {image_dir}; pass --images")
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def run_size(args, size):
+    with tempfile.TemporaryDirectory(prefix='face-bench-') as tmp:
+        env = dict(os.environ, FACE_DATA_DIR=os.path.join(tmp, 'face_data'))
+        out_path = os.path.join(tmp, 'result.json')
+        command = [
+            sys.executable, os.path.abspath(__file__), '--worker', '--size', str(size),
+            '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+            '--images', args.images, '--workloads', args.workloads, '--worker-out', out_path,
+        ]
+        completed = subprocess.run(command, env=env, cwd=tmp, stdout=subprocess.DEVNULL)
+        if completed.returncode != 0:
+            raise SystemExit(f"Benchmark worker for size {size} failed with exit code {completed.returncode}")
+        with open(out_path) as f:
+            return json.load(f)
+
+
+def compare(baseline, current, tolerance, min_delta_ms=1.0):
+    """
+    Regressions of current vs baseline as a list of messages. Latency changes below
+    min_delta_ms are ignored so sub-millisecond endpoints do not flag on noise.
+    """
+    regressions = []
+    baseline_runs = {run['size']: run for run in baseline['runs']}
+    for run in current['runs']:
+        old_run = baseline_runs.get(run['size'])
+        if old_run is None:
+            continue
+        for name, new in run['endpoints'].items():
+            old = old_run['endpoints'].get(name)
+            if old is None:
+                continue
+            per_request_delta = 1000 / new['throughputRps'] - 1000 / old['throughputRps']
+            checks = (
+                ('p95Ms', new['p95Ms'] > old['p95Ms'] * (1 + tolerance)
+                 and new['p95Ms'] - old['p95Ms'] > min_delta_ms),
+                ('peakRssMb', new['peakRssMb'] > old['peakRssMb'] * (1 + tolerance)),
+                ('throughputRps', new['throughputRps'] * (1 + tolerance) < old['throughputRps']
+                 and per_request_delta > min_delta_ms),
+            )
+            for metric, regressed in checks:
+                if regressed:
+                    regressions.append(f"size={run['size']} {name} {metric}: {old[metric]} -> {new[metric]}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'size':>8} {'endpoint':18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'peak MB':>9}  status")
+    for run in results['runs']:
+        for name, e in run['endpoints'].items():
+            print(
+                f"{run['size']:>8} {name:18} {e['p50Ms']:9.2f} {e['p95Ms']:9.2f} {e['p99Ms']:9.2f} "
+                f"{e['throughputRps']:9.1f} {e['peakRssMb']:9.1f}  {e['statusCodes']}"
+            )
+        print(
+            f"{run['size']:>8} {'(setup)':18} generate {run['generateSeconds']:.2f}s, "
+            f"startup {run['startupSeconds']:.2f}s, {run['startupPeakRssMb']:.1f} MB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated gallery sizes')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and size')
+    parser.add_argument('--concurrency', type=int, default=1, help='Client threads per workload')
+    parser.add_argument('--images', default=DEFAULT_IMAGES, help='Directory of probe face images')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS))
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+    parser.add_argument('--compare', help='Baseline results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression (default 20%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='Ignore latency changes smaller than this')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    unknown = set(args.workloads.split(',')) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"Unknown workloads: {sorted(unknown)}")
+    load_images(args.images)
+
+    results = {
+        'createdAt': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in sorted(os.environ.items()) if k.startswith('FACE_') and k != 'FACE_DATA_DIR'},
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'runs': [],
+    }
+    for size in (int(s) for s in args.sizes.split(',')):
+        print(f"Benchmarking a {size}-template gallery...", flush=True)
+        results['runs'].append(run_size(args, size))
+
+    print_table(results)
+    if args.json_path:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json_path)), exist_ok=True)
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance, args.min_delta_ms)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Compare a face-detection profile against the original full-resolution cascade call.
+
+Runs both detectors over a directory of reference images and reports, per image
+and in aggregate, whether a face was found, how well the profile's chosen box
+overlaps the original detections (best IoU), the correlation between the two
+128x128 crop histograms and the detection time.
+
+The original call sometimes returns extra false positives on very large frames;
+the profile's box is therefore matched against every original detection rather
+than only faces[0].
+
+Usage (from backend/):
+    python scripts/compare_detection.py path/to/reference_images --profile balanced
+    python scripts/compare_detection.py refs --profile fast --json fast.json
+
+Exits non-zero when the profile disagrees with the original call about whether a
+face is present, picks a box overlapping no original detection (IoU < --min-iou),
+or produces a crop whose histogram correlates below --min-correlation.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.face_detection import DETECTION_PROFILES, FaceDetector, load_cascade  # noqa: E402
+from app.face_gallery import compute_face_histogram  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+MIN_FACE_SIZE = 100
+
+
+def crop(img, box):
+    x, y, w, h = box
+    return cv2.resize(img[y:y + h, x:x + w], (128, 128))
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def timed_detect(detector, img, repeat):
+    best = None
+    boxes = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        boxes, _ = detector.detect(img, MIN_FACE_SIZE)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return boxes, best
+
+
+def compare(image_dir, profile, repeat):
+    cascade = load_cascade()
+    reference = FaceDetector(cascade, 'legacy')
+    candidate = FaceDetector(cascade, profile)
+
+    rows = []
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        img = cv2.imread(os.path.join(image_dir, name), cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        ref_boxes, ref_ms = timed_detect(reference, img, repeat)
+        new_boxes, new_ms = timed_detect(candidate, img, repeat)
+        row = {
+            'image': name,
+            'size': [int(img.shape[1]), int(img.shape[0])],
+            'referenceFound': bool(ref_boxes),
+            'profileFound': bool(new_boxes),
+            'referenceMs': round(ref_ms, 3),
+            'profileMs': round(new_ms, 3),
+            'iou': None,
+            'histogramCorrelation': None,
+        }
+        if ref_boxes and new_boxes:
+            new_box = new_boxes[0]
+            ref_box = max(ref_boxes, key=lambda box: iou(box, new_box))
+            row['iou'] = round(iou(ref_box, new_box), 4)
+            row['referenceFirst'] = ref_box == tuple(ref_boxes[0])
+            ref_hist = compute_face_histogram(crop(img, ref_box))
+            new_hist = compute_face_histogram(crop(img, new_box))
+            row['histogramCorrelation'] = round(float(cv2.compareHist(
+                ref_hist.reshape(-1, 1), new_hist.reshape(-1, 1), cv2.HISTCMP_CORREL,
+            )), 4)
+        rows.append(row)
+    return rows
+
+
+def summarize(rows, profile):
+    agree = [r for r in rows if r['referenceFound'] == r['profileFound']]
+    both = [r for r in rows if r['iou'] is not None]
+    ref_total = sum(r['referenceMs'] for r in rows)
+    new_total = sum(r['profileMs'] for r in rows)
+    return {
+        'profile': profile,
+        'params': DETECTION_PROFILES[profile],
+        'images': len(rows),
+        'detectionAgreement': len(agree) / len(rows) if rows else None,
+        'meanIou': float(np.mean([r['iou'] for r in both])) if both else None,
+        'minIou': min((r['iou'] for r in both), default=None),
+        'minHistogramCorrelation': min((r['histogramCorrelation'] for r in both), default=None),
+        'referenceMsTotal': round(ref_total, 3),
+        'profileMsTotal': round(new_total, 3),
+        'speedup': round(ref_total / new_total, 2) if new_total else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('image_dir')
+    parser.add_argument('--profile', default='balanced', choices=sorted(DETECTION_PROFILES))
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per image; the fastest is reported')
+    parser.add_argument('--min-iou', type=float, default=0.5)
+    parser.add_argument('--min-correlation', type=float, default=0.9)
+    parser.add_argument('--json', dest='json_path', help='Write per-image rows and the summary to this file')
+    args = parser.parse_args()
+
+    rows = compare(args.image_dir, args.profile, args.repeat)
+    if not rows:
+        parser.error(f"No readable images in {args.image_dir}")
+    summary = summarize(rows, args.profile)
+
+    print(f"{'image':32} {'ref':>5} {'new':>5} {'iou':>6} {'corr':>6} {'ref ms':>8} {'new ms':>8}")
+    for r in rows:
+        print(
+            f"{r['image'][:32]:32} {str(r['referenceFound']):>5} {str(r['profileFound']):>5} "
+            f"{r['iou'] if r['iou'] is not None else '-':>6} "
+            f"{r['histogramCorrelation'] if r['histogramCorrelation'] is not None else '-':>6} "
+            f"{r['referenceMs']:8.2f} {r['profileMs']:8.2f}"
+        )
+    print(json.dumps(summary, indent=2))
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'summary': summary, 'images': rows}, f, indent=2)
+
+    failed = (
+        summary['detectionAgreement'] < 1.0
+        or (summary['minIou'] is not None and summary['minIou'] < args.min_iou)
+        or (summary['minHistogramCorrelation'] is not None
+            and summary['minHistogramCorrelation'] < args.min_correlation)
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Local stand-in for the Gemini API, for load tests that must not spend quota.
+
+Answers generateContent and streamGenerateContent (SSE) requests after a delay
+drawn from a latency distribution. JSON requests get an analysis shaped by the
+request's response schema (only the fields asked for, one entry per patient for a
+multi-patient batch), from the canned analysis or a template; other requests get
+bullet-point text. A share of requests can fail on purpose: 503 and 429 errors,
+answers that never come, and JSON cut off mid-way. Point the backend at it with
+GEMINI_BASE_URL.
+
+Latency specs (seconds): "1.5" (fixed), "uniform:0.5:2", "normal:1:0.3",
+"lognormal:1:0.5" (median, sigma), "exp:1" (mean).
+
+Templates are JSON files shaped like the analysis; in their strings $description,
+$regions, $vitals, $region (in regionAnalysis), $patient and $request are filled
+in from the prompt.
+
+Usage (from backend/):
+    python scripts/fake_gemini.py --port 9100 --latency lognormal:1:0.4 --error-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:9100/ GEMINI_API_KEY=fake python wsgi.py
+"""
+import argparse
+import asyncio
+import copy
+import json
+import random
+import re
+from string import Template
+
+CANNED_ANALYSIS = {
+    "conditions": ["Common cold", "Seasonal allergies"],
+    "urgency": "Monitor closely - See doctor if worsens",
+    "regionAnalysis": "Discomfort in the $region is consistent with the reported symptoms",
+    "symptomExplanations": ["Congestion: likely a viral upper respiratory infection"],
+    "possibleSolutions": ["Rest", "Stay hydrated"],
+    "relatedSymptoms": ["Fever above 38°C"],
+    "doctorRecommendation": {
+        "shouldSeeDoctorFor": ["Symptoms lasting more than 10 days"],
+        "urgencyReason": "Vital signs are within normal ranges",
+        "redFlags": ["Difficulty breathing"]
+    },
+    "summary": "Symptoms are consistent with a mild upper respiratory infection."
+}
+CANNED_CHAT = ["• Rest and drink plenty of fluids.\n", "• See a doctor if the fever ", "lasts more than three days."]
+
+ERROR_STATUSES = {503: "UNAVAILABLE", 429: "RESOURCE_EXHAUSTED"}
+
+
+class Latency:
+    """Response delays in seconds drawn from a distribution spec (see the module docstring)"""
+
+    SAMPLERS = {
+        "fixed": (1, lambda rng, value: value),
+        "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+        "normal": (2, lambda rng, mean, stdev: rng.gauss(mean, stdev)),
+        "lognormal": (2, lambda rng, median, sigma: median * rng.lognormvariate(0, sigma)),
+        "exp": (1, lambda rng, mean: rng.expovariate(1 / mean)),
+    }
+
+    def __init__(self, spec, rng=None):
+        self.spec = str(spec)
+        self.rng = rng or random.Random()
+        kind, *params = self.spec.split(":")
+        if not params:
+            kind, params = "fixed", [kind]
+        try:
+            self.params = [float(param) for param in params]
+        except ValueError:
+            raise ValueError(f"Bad latency spec {self.spec!r}")
+        if kind not in self.SAMPLERS or len(self.params) != self.SAMPLERS[kind][0]:
+            raise ValueError(f"Bad latency spec {self.spec!r}")
+        self.kind = kind
+
+    def sample(self):
+        return max(0.0, self.SAMPLERS[self.kind][1](self.rng, *self.params))
+
+
+def candidate(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+def wants_json(body):
+    config = body.get("generationConfig") or {}
+    return config.get("responseMimeType") == "application/json"
+
+
+def prompt_text(body):
+    return "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+
+
+def prompt_patients(prompt):
+    """(description, regions, vitals) for each patient an analysis prompt describes"""
+    patients = []
+    for block in re.split(r"\n(?:Patient \d+|Patient Information):\n", prompt)[1:]:
+        lines = dict(re.findall(r"^- ([A-Za-z ]+): (.*)$", block, re.MULTILINE))
+        regions = lines.get("Affected Body Regions", "None specified")
+        patients.append((
+            lines.get("Symptom Description", ""),
+            [] if regions == "None specified" else [region.strip() for region in regions.split(",")],
+            lines.get("Vital Signs", ""),
+        ))
+    return patients or [("", [], "")]
+
+
+def fill(value, values):
+    if isinstance(value, str):
+        return Template(value).safe_substitute(values)
+    if isinstance(value, list):
+        return [fill(item, values) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, values) for key, item in value.items()}
+    return value
+
+
+def patient_analysis(template, properties, patient, number, request_number, batch):
+    """One patient's answer holding the schema's properties (all the template's without one)"""
+    description, regions, vitals = patient
+    values = {
+        "description": description, "regions": ", ".join(regions) or "none", "vitals": vitals,
+        "patient": number, "request": request_number,
+    }
+    analysis = {}
+    for field in properties or template:
+        if field == "patient":
+            analysis[field] = number
+        elif field == "regionAnalysis":
+            text = template.get(field)
+            text = text if isinstance(text, str) else "Discomfort in the $region"
+            pairs = [(region, fill(text, {**values, "region": region})) for region in regions]
+            analysis[field] = [{"region": region, "analysis": text} for region, text in pairs] if batch else dict(pairs)
+        elif field in template:
+            analysis[field] = fill(copy.deepcopy(template[field]), values)
+    return analysis
+
+
+def answer_json(body, template=CANNED_ANALYSIS, request_number=0):
+    """The analysis for a JSON request, shaped by its response schema (one per patient for an array)"""
+    schema = (body.get("generationConfig") or {}).get("responseSchema") or {}
+    patients = prompt_patients(prompt_text(body))
+    if schema.get("type") == "ARRAY":
+        properties = (schema.get("items") or {}).get("properties")
+        return [
+            patient_analysis(template, properties, patient, number, request_number, True)
+            for number, patient in enumerate(patients, 1)
+        ]
+    return patient_analysis(template, schema.get("properties"), patients[0], 1, request_number, False)
+
+
+class FakeGemini:
+    def __init__(self, latency=1.0, error_rate=0.0, throttle_rate=0.0, hang_rate=0.0, truncate_rate=0.0,
+                 hang_seconds=120.0, template=None, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = Latency(latency, self.rng)
+        # Shares of requests that fail on purpose, in this order of precedence
+        self.faults = [
+            ("errors", error_rate), ("throttled", throttle_rate), ("hung", hang_rate), ("truncated", truncate_rate),
+        ]
+        self.hang_seconds = hang_seconds
+        self.template = template or CANNED_ANALYSIS
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+        self.injected = {name: 0 for name, _ in self.faults}
+
+    def fault(self):
+        """The failure to inject into the next request, if any"""
+        roll = self.rng.random()
+        for name, rate in self.faults:
+            if roll < rate:
+                self.injected[name] += 1
+                return name
+            roll -= rate
+        return None
+
+    def json_text(self, body, fault):
+        text = json.dumps(answer_json(body, self.template, self.requests))
+        if fault == "truncated":
+            text = text[:int(len(text) * self.rng.uniform(0.3, 0.9))]
+        return text
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                raw = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = request_line.split(" ")[1]
+                body = json.loads(raw or b"{}")
+
+                self.requests += 1
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                try:
+                    fault = self.fault()
+                    if fault == "hung":
+                        await asyncio.sleep(self.hang_seconds)
+                    if fault in ("errors", "throttled"):
+                        # Errors come back quicker than answers
+                        await asyncio.sleep(self.latency.sample() / 10)
+                        await self.error(writer, 503 if fault == "errors" else 429)
+                    elif ":streamGenerateContent" in path:
+                        await self.stream(writer, body, fault)
+                    else:
+                        await asyncio.sleep(self.latency.sample())
+                        text = self.json_text(body, fault) if wants_json(body) else "".join(CANNED_CHAT)
+                        payload = json.dumps(candidate(text)).encode()
+                        writer.write(
+                            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                            + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                        )
+                        await writer.drain()
+                finally:
+                    self.active -= 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def error(self, writer, code):
+        status = ERROR_STATUSES[code]
+        payload = json.dumps({"error": {"code": code, "message": "Injected by fake_gemini", "status": status}}).encode()
+        writer.write(
+            f"HTTP/1.1 {code} {status}\r\nContent-Type: application/json\r\n".encode()
+            + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+
+    async def stream(self, writer, body, fault=None):
+        chunks = [self.json_text(body, fault)] if wants_json(body) else CANNED_CHAT
+        if fault == "truncated" and not wants_json(body):
+            chunks = chunks[:-1]
+        latency = self.latency.sample()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            event = f"data: {json.dumps(candidate(chunk))}\r\n\r\n".encode()
+            writer.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def summary(self):
+        return {"requests": self.requests, "peakActive": self.peak_active, "injected": dict(self.injected)}
+
+
+async def serve(host, port, latency, started=None, **options):
+    """Runs the fake until cancelled; `options` go to FakeGemini (error_rate, template, ...)"""
+    fake = FakeGemini(latency, **options)
+    server = await asyncio.start_server(fake.handle, host, port, backlog=4096)
+    if started is not None:
+        started(fake, server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+
+def add_fake_arguments(parser):
+    """Latency and failure options, shared with scripts/load_ai.py"""
+    parser.add_argument("--latency", default="1.0", help="Latency spec, e.g. 1.5, uniform:0.5:2 or lognormal:1:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests left unanswered for --hang-seconds")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="Share of JSON answers cut off mid-way")
+    parser.add_argument("--template", help="JSON file with the analysis to answer with")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def fake_options(args):
+    """FakeGemini keyword arguments (besides latency) from the add_fake_arguments options"""
+    template = None
+    if args.template:
+        with open(args.template) as f:
+            template = json.load(f)
+    return {
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "hang_rate": args.hang_rate,
+        "hang_seconds": args.hang_seconds,
+        "truncate_rate": args.truncate_rate,
+        "template": template,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    print(f"Fake Gemini on http://{args.host}:{args.port}/ (latency {args.latency}, error rate {args.error_rate})")
+    asyncio.run(serve(args.host, args.port, args.latency, **fake_options(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Concurrency load test for the AI routes against a local fake model (no quota).
+
+Starts scripts/fake_gemini.py in-process with the given latency distribution and
+failure rates, then for each mode launches the real server with GEMINI_BASE_URL
+pointing at it and ramps concurrency, one level at a time. Every request carries a
+unique description or message, so the analysis cache and request coalescing cannot
+hide upstream calls.
+
+Each level reports throughput, p50/p99 latency, the error rate (non-200 answers and
+failed connections) and the fallback rate (200 answers that came from a fallback
+rather than the model), plus the upstream requests and failures the fake injected.
+/api/generate-summary answers with a PDF either way, so its fallback rate is not known.
+
+Usage (from backend/):
+    python scripts/load_ai.py --concurrency 8,64,256 --latency 1.0
+    python scripts/load_ai.py --modes wsgi --route analyze --ramp 1:64 --duration 20 \\
+        --latency lognormal:1:0.5 --error-rate 0.05 --json load.json
+    python scripts/load_ai.py --modes asgi --route summary --env ANALYSIS_BATCH_WINDOW_MS=20
+
+With sync workers, throughput is capped at workers / latency; the ASGI app keeps
+every request in flight at once, so the batch finishes in about one latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'scripts'))
+
+from fake_gemini import add_fake_arguments, fake_options, serve  # noqa: E402
+
+ROUTES = ('chatbot', 'analyze', 'summary')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_fake(latency, **options):
+    ready = threading.Event()
+    state = {}
+
+    def started(fake, port):
+        state.update(fake=fake, port=port)
+        ready.set()
+
+    threading.Thread(
+        target=lambda: asyncio.run(serve('127.0.0.1', 0, latency, started, **options)), daemon=True,
+    ).start()
+    if not ready.wait(10):
+        raise RuntimeError('Fake Gemini did not start')
+    return state['fake'], state['port']
+
+
+def server_command(mode, port, workers):
+    if mode == 'wsgi':
+        # The Procfile's configuration: gunicorn sync workers
+        return ['gunicorn', 'wsgi:app', '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    return ['uvicorn', 'asgi:app', '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+            '--no-access-log', '--log-level', 'warning']
+
+
+def wait_ready(url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}')
+        try:
+            if httpx.get(f'{url}/api/health', timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError('Server did not become ready')
+
+
+def concurrency_levels(args):
+    """The --concurrency list, or --ramp START:STOP doubling from START up to STOP"""
+    if not args.ramp:
+        return [int(c) for c in args.concurrency.split(',')]
+    start, stop = (int(value) for value in args.ramp.split(':'))
+    levels = []
+    level = max(1, start)
+    while level < stop:
+        levels.append(level)
+        level *= 2
+    return levels + [stop]
+
+
+def request_body(route):
+    marker = uuid.uuid4().hex[:12]
+    if route == 'analyze':
+        return '/api/analyze', {'description': f'Headache and mild fever ({marker})', 'spots': ['head']}
+    if route == 'summary':
+        return '/api/generate-summary', {'description': f'Headache and mild fever ({marker})', 'affectedRegions': ['head']}
+    return '/api/chatbot', {'message': f'What helps with a sore throat? ({marker})'}
+
+
+def is_fallback(route, response):
+    """Whether a 200 answer came from a fallback rather than the model (None when it cannot tell)"""
+    if route == 'summary':
+        return None
+    payload = response.json()
+    if route == 'analyze':
+        # The placeholder analysis, or simple_analyze's "Symptoms described" for these descriptions
+        condition = payload['result']['condition']
+        return 'AI analysis unavailable' in condition or 'Symptoms described' in condition
+    return payload.get('response', '').startswith("I'm having trouble")
+
+
+def percentile(latencies, p):
+    return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1) if latencies else None
+
+
+async def run_level(url, route, concurrency, total, duration, timeout):
+    """
+    One concurrency level: `concurrency` clients sending back to back, either
+    `total` requests between them or for `duration` seconds.
+    """
+    latencies = []
+    counts = {'requests': 0, 'errors': 0, 'fallbacks': 0}
+    unknown_fallbacks = False
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        deadline = time.perf_counter() + duration if duration else None
+
+        def more():
+            if deadline is not None:
+                return time.perf_counter() < deadline
+            return counts['requests'] < total
+
+        async def client_loop():
+            nonlocal unknown_fallbacks
+            while more():
+                counts['requests'] += 1
+                path, body = request_body(route)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, json=body)
+                except httpx.HTTPError:
+                    counts['errors'] += 1
+                    continue
+                if response.status_code != 200:
+                    counts['errors'] += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+                fallback = is_fallback(route, response)
+                if fallback is None:
+                    unknown_fallbacks = True
+                elif fallback:
+                    counts['fallbacks'] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    requests = counts['requests']
+    answered = len(latencies)
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'throughput': round(answered / elapsed, 2),
+        'p50Ms': percentile(latencies, 0.50),
+        'p99Ms': percentile(latencies, 0.99),
+        'errors': counts['errors'],
+        'errorRate': round(counts['errors'] / requests, 4) if requests else None,
+        'fallbacks': None if unknown_fallbacks else counts['fallbacks'],
+        'fallbackRate': None if unknown_fallbacks or not answered else round(counts['fallbacks'] / answered, 4),
+    }
+
+
+def rate(value):
+    return 'n/a' if value is None else f'{value:.1%}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--route', default='chatbot', choices=ROUTES)
+    parser.add_argument('--concurrency', default='8,64,256')
+    parser.add_argument('--ramp', help='START:STOP, doubling the concurrency from START up to STOP (instead of --concurrency)')
+    parser.add_argument('--requests', type=int, default=None, help='Requests per level (default: the concurrency)')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds per level (instead of --requests)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=300, help='Client timeout per request in seconds')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='Extra server environment')
+    parser.add_argument('--json', dest='json_path')
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    options = fake_options(args)
+    fake, fake_port = start_fake(args.latency, **options)
+    levels = concurrency_levels(args)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='load_ai_') as tmp:
+        env = dict(
+            os.environ,
+            GEMINI_API_KEY='fake',
+            GEMINI_BASE_URL=f'http://127.0.0.1:{fake_port}/',
+            ANALYSIS_CACHE_TTL='0',
+            FACE_DATA_DIR=os.path.join(tmp, 'face_data'),
+        )
+        env.update(item.split('=', 1) for item in args.env)
+        for mode in args.modes.split(','):
+            port = free_port()
+            url = f'http://127.0.0.1:{port}'
+            process = subprocess.Popen(
+                server_command(mode, port, args.workers), cwd=BACKEND_DIR, env=env,
+                stdout=subprocess.DEVNULL,
+            )
+            try:
+                wait_ready(url, process)
+                for concurrency in levels:
+                    fake.peak_active = 0
+                    before = fake.summary()
+                    row = asyncio.run(run_level(
+                        url, args.route, concurrency, args.requests or concurrency, args.duration, args.timeout,
+                    ))
+                    after = fake.summary()
+                    row.update(
+                        mode=mode,
+                        workers=args.workers,
+                        upstreamRequests=after['requests'] - before['requests'],
+                        peakUpstream=fake.peak_active,
+                        injected={name: count - before['injected'][name] for name, count in after['injected'].items()},
+                    )
+                    results.append(row)
+                    print(
+                        f"{mode:5} c={concurrency:<5} {row['throughput']:8.2f} req/s  p50 {row['p50Ms']} ms  "
+                        f"p99 {row['p99Ms']} ms  errors {rate(row['errorRate'])}  fallbacks {rate(row['fallbackRate'])}  "
+                        f"upstream {row['upstreamRequests']} (peak {row['peakUpstream']} in flight, "
+                        f"injected {sum(row['injected'].values())})"
+                    )
+            finally:
+                process.terminate()
+                process.wait(30)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'route': args.route,
+                'latency': args.latency,
+                'fake': {key: value for key, value in vars(args).items() if key in options},
+                'env': args.env,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import numpy as np
+
+from app.face_ann import IVFIndex
+from app.face_gallery import score_rows
+from app.face_store import META_DTYPE
+
+
+def gallery(count, seed=0, dim=16):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    meta = np.zeros(count, dtype=META_DTYPE)
+    meta['mobile'] = [str(i).encode('utf-8') for i in range(count)]
+    return vectors, meta
+
+
+def test_bind_is_reused_for_the_same_base():
+    vectors, meta = gallery(200)
+    index = IVFIndex.build(vectors, [str(i) for i in range(200)], n_lists=8)
+    binding = index.bind(vectors, meta)
+    assert index.bind(vectors, meta) is binding
+    assert not binding.positions.flags.writeable and not binding.offsets.flags.writeable
+
+
+def test_old_binding_stays_valid_after_a_rebind():
+    vectors, meta = gallery(200)
+    index = IVFIndex.build(vectors, [str(i) for i in range(200)], n_lists=8)
+    old = index.bind(vectors, meta)
+    smaller, smaller_meta = vectors[:50].copy(), meta[:50].copy()
+    new = index.bind(smaller, smaller_meta)
+
+    assert new is not old and new.positions.max() < 50
+    probe = vectors[120]
+    positions, scores = index.score_candidates(old, probe, n_probe=8)
+    assert positions.max() >= 50
+    np.testing.assert_allclose(scores, score_rows(vectors[positions], probe))
+    assert positions[np.argmax(scores)] == 120
@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+
+from app.face_store import TemplateStore, migrate_json_templates, remove_migrated_json
+
+DIM = 8
+
+
+def unit(seed):
+    vector = np.random.default_rng(seed).random(DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_snapshot_is_unchanged_by_a_re_registration(tmp_path):
+    store = TemplateStore(str(tmp_path), dim=DIM, compact_every=0)
+    store.append('111', 'Asha', unit(1))
+    store.append('222', 'Ravi', unit(2))
+    store.compact()
+    store.append('333', 'Meera', unit(3))
+    before = store.snapshot()
+    delta_vectors = before.delta_vectors.copy()
+
+    # Re-register one user from the base and one from the delta
+    store.append_many([('111', 'Asha', unit(4), None), ('333', 'Meera', unit(5), None)])
+    after = store.snapshot()
+
+    assert before.base_live.tolist() == [True, True]
+    assert before.delta_live.tolist() == [True]
+    np.testing.assert_array_equal(before.delta_vectors, delta_vectors)
+    assert [user['mobile'] for user in before.delta_meta] == ['333']
+
+    assert after.base_live.tolist() == [False, True]
+    assert after.delta_live.tolist() == [False, True, True]
+    np.testing.assert_allclose(store.vector('111'), unit(4))
+    np.testing.assert_allclose(store.vector('333'), unit(5))
+    assert len(store) == 3
+
+
+def test_compaction_keeps_the_latest_registration(tmp_path):
+    store = TemplateStore(str(tmp_path), dim=DIM, compact_every=0)
+    store.append('111', 'Asha', unit(1))
+    store.append('111', 'Asha K', unit(2))
+    store.compact()
+    snapshot = store.snapshot()
+    assert len(snapshot) == 1
+    assert snapshot.user(0)['userName'] == 'Asha K'
+    np.testing.assert_allclose(store.vector('111'), unit(2))
+
+
+def write_legacy(directory, name, data):
+    with open(directory / name, 'w') as f:
+        json.dump(data, f)
+
+
+def test_migration_skips_files_without_a_mobile(tmp_path):
+    legacy = tmp_path / 'legacy'
+    legacy.mkdir()
+    write_legacy(legacy, '111.json', {'mobile': '111', 'userName': 'Asha', 'faceHistogram': unit(1).tolist()})
+    write_legacy(legacy, 'broken.json', {'userName': 'Nobody', 'faceHistogram': unit(2).tolist()})
+    store = TemplateStore(str(tmp_path / 'store'), dim=DIM)
+
+    assert migrate_json_templates(str(legacy), store, lambda histogram: histogram) == 1
+    assert '111' in store and len(store) == 1
+
+
+def test_migration_runs_once(tmp_path):
+    legacy = tmp_path / 'legacy'
+    legacy.mkdir()
+    write_legacy(legacy, '111.json', {'mobile': '111', 'faceHistogram': unit(1).tolist()})
+    first = TemplateStore(str(tmp_path / 'store'), dim=DIM)
+    second = TemplateStore(str(tmp_path / 'store'), dim=DIM)
+
+    assert migrate_json_templates(str(legacy), first, lambda histogram: histogram) == 1
+    assert migrate_json_templates(str(legacy), second, lambda histogram: histogram) == 0
+    second.open()
+    assert len(second) == 1
+
+
+def test_remove_json_after_an_earlier_migration(tmp_path):
+    legacy = tmp_path / 'legacy'
+    legacy.mkdir()
+    write_legacy(legacy, '111.json', {'mobile': '111', 'faceHistogram': unit(1).tolist()})
+    write_legacy(legacy, '222.json', {'mobile': '222', 'faceHistogram': unit(2).tolist()})
+    # Imported at startup by one worker
+    assert migrate_json_templates(str(legacy), TemplateStore(str(tmp_path / 'store'), dim=DIM), lambda h: h) == 2
+    # Registered in the legacy layout after the store was populated, so never imported
+    write_legacy(legacy, '333.json', {'mobile': '333', 'faceHistogram': unit(3).tolist()})
+
+    store = TemplateStore(str(tmp_path / 'store'), dim=DIM)
+    assert migrate_json_templates(str(legacy), store, lambda h: h) == 0
+    assert remove_migrated_json(str(legacy), store) == 2
+    assert sorted(path.name for path in legacy.iterdir()) == ['333.json']
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from google.genai import types
+from google.genai._api_client import HttpResponse
+from prometheus_client import REGISTRY
+
+from app.gemini_client import (
+    AsyncSingleFlight,
+    GeminiClientManager,
+    SingleFlight,
+    SingleFlightTimeout,
+    TruncatedResponse,
+)
+from app.gemini_resilience import Deadline
+
+
+class CannedTransport:
+    """Answers every call with `text` as the model's reply"""
+
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def send(self, http_request, stream=False):
+        self.calls += 1
+        body = {'candidates': [{'content': {'role': 'model', 'parts': [{'text': self.text}]}}]}
+        return HttpResponse({}, [json.dumps(body)])
+
+
+def schema_request():
+    return {
+        'model': 'gemini-2.5-flash',
+        'contents': 'Analyze',
+        'config': types.GenerateContentConfig(
+            response_mime_type='application/json',
+            response_schema={'type': 'OBJECT', 'properties': {'summary': {'type': 'STRING'}}},
+        ),
+    }
+
+
+def error_count(kind):
+    return REGISTRY.get_sample_value('ai_errors_total', {'kind': kind, 'error': 'JSONDecodeError'}) or 0
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    return GeminiClientManager(max_retries=2, hedge=False)
+
+
+def test_truncated_schema_answer_is_a_success(manager):
+    transport = CannedTransport('{"summary": "Rest and flu')
+    manager.set_transport(transport)
+    errors_before = error_count('test_truncated')
+
+    response = manager.generate_content('test_truncated', **schema_request())
+
+    assert isinstance(response, TruncatedResponse)
+    assert response.text == '{"summary": "Rest and flu'
+    assert transport.calls == 1
+    assert error_count('test_truncated') == errors_before
+    summary = manager.summary()
+    assert summary['calls']['test_truncated']['errors'] == 0
+    assert summary['resilience']['test_truncated']['truncated'] == 1
+    assert summary['breaker']['consecutiveFailures'] == 0
+
+
+def test_truncated_schema_answer_is_a_success_async(manager):
+    class AsyncCanned(CannedTransport):
+        async def send(self, http_request):
+            return CannedTransport.send(self, http_request)
+
+    transport = AsyncCanned('{"summary": "Rest and flu')
+    manager.set_async_transport(transport)
+    response = asyncio.run(manager.agenerate_content('test_truncated_async', **schema_request()))
+
+    assert isinstance(response, TruncatedResponse)
+    assert transport.calls == 1
+    assert manager.summary()['calls']['test_truncated_async']['errors'] == 0
+
+
+def run_in_threads(count, fn):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = ('ok', fn())
+        except Exception as e:
+            results[i] = ('error', e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_singleflight_shares_the_leaders_error():
+    flight = SingleFlight(timeout=5)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    error = ValueError('upstream said no')
+
+    def leader_call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise error
+
+    leader, leader_result = run_in_threads(1, lambda: flight.do('chatbot', 'key', leader_call))
+    started.wait(5)
+    waiters, waiter_results = run_in_threads(3, lambda: flight.do('chatbot', 'key', leader_call))
+    while flight.summary()['waiting'] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in leader + waiters:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert leader_result == [('error', error)]
+    assert waiter_results == [('error', error)] * 3
+    summary = flight.summary()
+    assert summary['inflight'] == 0
+    assert summary['calls']['chatbot'] == {'upstreamCalls': 1, 'coalesced': 3, 'timeouts': 0, 'errors': 1}
+
+
+def test_singleflight_forgets_a_failed_call():
+    flight = SingleFlight(timeout=5)
+
+    def fail():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        flight.do('analyze', 'key', fail)
+    assert flight.do('analyze', 'key', lambda: 'answer') == 'answer'
+    assert flight.summary()['calls']['analyze']['upstreamCalls'] == 2
+
+
+def test_singleflight_waiter_times_out():
+    flight = SingleFlight(timeout=5)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'late'
+
+    leader, leader_result = run_in_threads(1, lambda: flight.do('analyze', 'key', slow))
+    started.wait(5)
+    with pytest.raises(SingleFlightTimeout):
+        flight.do('analyze', 'key', slow, timeout=0.01)
+    release.set()
+    leader[0].join(5)
+    assert leader_result == [('ok', 'late')]
+    assert flight.summary()['calls']['analyze']['timeouts'] == 1
+
+
+def test_async_singleflight_shares_the_leaders_error():
+    flight = AsyncSingleFlight(timeout=5)
+    calls = []
+
+    async def leader_call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError('upstream said no')
+
+    async def go():
+        return await asyncio.gather(*(flight.do('chatbot', 'key', leader_call) for _ in range(4)), return_exceptions=True)
+
+    results = asyncio.run(go())
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len({id(result) for result in results}) == 1
+
+
+class HedgeCalls:
+    """Stands in for a manager's attempts: the primary goes through _attempt, the hedge through _run"""
+
+    def __init__(self, manager, primary, hedge):
+        self.manager = manager
+        self.outcomes = {'primary': primary, 'hedge': hedge}
+        manager._attempt = lambda kind, client, kwargs, deadline: self.call('primary')
+        manager._run = lambda kind, client, kwargs, deadline, wait_ms: self.call('hedge', release_slot=True)
+
+    def call(self, which, release_slot=False):
+        delay, outcome = self.outcomes[which]
+        try:
+            time.sleep(delay)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        finally:
+            if release_slot:
+                self.manager._slots.release()
+
+
+def hedged(manager):
+    return manager._hedged('analyze', None, {}, Deadline(5), 0.02)
+
+
+def test_hedge_not_sent_when_the_primary_answers_in_time(manager):
+    HedgeCalls(manager, primary=(0, 'primary'), hedge=(0, 'hedge'))
+    assert hedged(manager) == 'primary'
+    assert manager.resilience.summary() == {}
+
+
+def test_hedge_wins_over_a_slow_primary(manager):
+    HedgeCalls(manager, primary=(0.3, 'primary'), hedge=(0, 'hedge'))
+    assert hedged(manager) == 'hedge'
+    assert manager.resilience.summary()['analyze']['hedges'] == 1
+    assert manager.resilience.summary()['analyze']['hedgeWins'] == 1
+
+
+def test_primary_wins_over_a_slower_hedge(manager):
+    HedgeCalls(manager, primary=(0.05, 'primary'), hedge=(0.5, 'hedge'))
+    assert hedged(manager) == 'primary'
+    assert manager.resilience.summary()['analyze']['hedges'] == 1
+    assert manager.resilience.summary()['analyze']['hedgeWins'] == 0
+
+
+def test_hedge_answers_when_the_primary_fails(manager):
+    HedgeCalls(manager, primary=(0.05, RuntimeError('primary failed')), hedge=(0.1, 'hedge'))
+    assert hedged(manager) == 'hedge'
+    assert manager.resilience.summary()['analyze']['hedgeWins'] == 1
+
+
+def test_both_failing_raises_the_first_error(manager):
+    first = RuntimeError('primary failed')
+    HedgeCalls(manager, primary=(0.05, first), hedge=(0.2, RuntimeError('hedge failed')))
+    with pytest.raises(RuntimeError) as raised:
+        hedged(manager)
+    assert raised.value is first
+    assert manager.resilience.summary()['analyze']['hedgeWins'] == 0
+
+
+def test_no_hedge_without_a_free_slot(manager):
+    HedgeCalls(manager, primary=(0.1, 'primary'), hedge=(0, 'hedge'))
+    for _ in range(manager.max_inflight):
+        manager._slots.acquire()
+    try:
+        assert hedged(manager) == 'primary'
+    finally:
+        for _ in range(manager.max_inflight):
+            manager._slots.release()
+    assert manager.resilience.summary() == {}
@@ -0,0 +1,150 @@
+import pytest
+
+from app import gemini_resilience
+from app.gemini_resilience import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gemini_resilience, 'time', clock)
+    return clock
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failures):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, window=20, cooldown=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.opens == 1
+
+
+def test_opens_on_failure_rate_once_half_the_window_is_seen(clock):
+    breaker = CircuitBreaker(failures=100, failure_rate=0.5, window=10, cooldown=30)
+    for _ in range(2):
+        breaker.record_success()
+        breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_open_refuses_until_the_cooldown_passes(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    assert not breaker.allow()
+    clock.now += 29.9
+    assert not breaker.allow()
+    assert breaker.rejected == 2
+    clock.now += 0.1
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+
+
+def test_failures_while_open_do_not_extend_the_cooldown(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    clock.now += 20
+    # A call that started before the breaker opened reports late
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert not breaker.allow()
+
+
+def test_trial_success_closes(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() and breaker.allow()
+    # The failures before the breaker opened are forgotten
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+
+def test_trial_failure_reopens_for_a_full_cooldown(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.opens == 2
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_trial_that_never_reports_times_out(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+
+
+def test_release_frees_the_trial_slot(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    # The trial never reached the upstream (e.g. no free slot)
+    breaker.release()
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_release_while_closed_changes_nothing(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    breaker.record_failure()
+    breaker.release()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_summary(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    open_breaker(breaker)
+    clock.now += 10
+    summary = breaker.summary()
+    assert summary['state'] == 'open'
+    assert summary['opens'] == 1
+    assert summary['reopensInS'] == 20.0
@@ -0,0 +1,89 @@
+import pytest
+
+from app.ai_service import parse_analysis, split_batch_analysis
+from app.analysis_fields import ANALYSIS_FIELD_SPECS, ANALYSIS_URGENCY_LEVELS
+from app.partial_json import PartialJsonParser, parse_partial_json
+
+
+def test_complete_document_after_a_fence():
+    assert parse_partial_json('```json\n{"a": [1, {"b": "c"}]}\n```') == ({"a": [1, {"b": "c"}]}, True)
+
+
+def test_unclosed_string_value_is_dropped():
+    assert parse_partial_json('{"conditions":["Migraine"],"urgency":"Seek imm') == ({"conditions": ["Migraine"]}, False)
+
+
+def test_unclosed_string_with_pending_escape_is_dropped():
+    assert parse_partial_json('{"a":"x","b":"line\\') == ({"a": "x"}, False)
+    assert parse_partial_json('{"a":"x","b":"\\u00') == ({"a": "x"}, False)
+
+
+def test_unclosed_array_is_dropped_whole():
+    assert parse_partial_json('{"summary":"ok","conditions":["Migraine","Tension hea') == ({"summary": "ok"}, False)
+    assert parse_partial_json('{"summary":"ok","conditions":["Migraine",') == ({"summary": "ok"}, False)
+
+
+def test_unclosed_object_is_dropped_whole():
+    text = '{"summary":"ok","doctorRecommendation":{"shouldSeeDoctorFor":["x"],"urgencyReason":"y"'
+    assert parse_partial_json(text) == ({"summary": "ok"}, False)
+
+
+def test_unfinished_number_and_literal_are_dropped():
+    assert parse_partial_json('{"a":1,"b":12') == ({"a": 1}, False)
+    assert parse_partial_json('[true, fal') == ([True], False)
+
+
+def test_cut_in_a_key_or_before_a_value():
+    assert parse_partial_json('{"a":"x","summ') == ({"a": "x"}, False)
+    assert parse_partial_json('{"a":"x","summary":') == ({"a": "x"}, False)
+    assert parse_partial_json('{"a":"x",') == ({"a": "x"}, False)
+
+
+def test_array_keeps_closed_elements_only():
+    text = '[{"patient":1,"conditions":["a"]},{"patient":2,"conditions":["b"]}'
+    assert parse_partial_json(text) == ([{"patient": 1, "conditions": ["a"]}, {"patient": 2, "conditions": ["b"]}], False)
+    text = '[{"patient":1,"conditions":["a"]},{"patient":2,"conditions":["b"'
+    assert parse_partial_json(text) == ([{"patient": 1, "conditions": ["a"]}], False)
+
+
+def test_fed_in_chunks_matches_one_feed():
+    text = '{"a":"x\\"y","b":[1,2],"c":{"d":"e"},"f":"unfini'
+    parser = PartialJsonParser()
+    for char in text:
+        parser.feed(char)
+    assert parser.value() == parse_partial_json(text)[0] == {"a": 'x"y', "b": [1, 2], "c": {"d": "e"}}
+
+
+def test_no_json_raises():
+    with pytest.raises(ValueError):
+        parse_partial_json("Sorry, I cannot help with that")
+
+
+def test_truncated_analysis_defaults_the_field_it_stopped_in():
+    analysis, complete = parse_analysis('{"conditions":["Migraine"],"urgency":"Seek imm', ("conditions", "urgency"))
+    assert not complete
+    assert analysis == {"conditions": ["Migraine"], "urgency": ANALYSIS_FIELD_SPECS["urgency"]["default"]}
+
+
+def test_truncated_analysis_drops_a_cut_off_list():
+    analysis, complete = parse_analysis('{"conditions":["Migraine","Tension hea', ("conditions",))
+    assert not complete
+    assert analysis == {"conditions": ANALYSIS_FIELD_SPECS["conditions"]["default"]}
+
+
+def test_urgency_outside_the_levels_gets_the_default():
+    analysis, _ = parse_analysis('{"urgency":"Seek imm"}', ("urgency",))
+    assert analysis["urgency"] == ANALYSIS_FIELD_SPECS["urgency"]["default"]
+    analysis, _ = parse_analysis(f'{{"urgency":"{ANALYSIS_URGENCY_LEVELS[-1]}"}}', ("urgency",))
+    assert analysis["urgency"] == ANALYSIS_URGENCY_LEVELS[-1]
+
+
+def test_batch_keeps_a_closed_last_entry_of_an_unfinished_array():
+    text = '[{"patient":1,"conditions":["a"]},{"patient":2,"conditions":["b"]}'
+    analyses = split_batch_analysis(text, ("conditions",), 3)
+    assert analyses == [{"conditions": ["a"]}, {"conditions": ["b"]}, None]
+
+
+def test_batch_drops_a_cut_off_last_entry():
+    text = '[{"patient":1,"conditions":["a"]},{"patient":2,"conditions":["b"'
+    assert split_batch_analysis(text, ("conditions",), 2) == [{"conditions": ["a"]}, None]
@@ -1,6 +1,41 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 
+// Reads the chatbot's Server-Sent Events, calling onText with the text so far;
+// resolves with the final `done` or `error` payload (same shape as the JSON reply)
+async function readChatStream(response, onText) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+  let result = { ok: false, error: 'Stream ended unexpectedly' };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const raw of events) {
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = raw.match(/^data: (.*)$/m)?.[1];
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'delta') {
+        text += payload.text;
+        onText(text);
+      } else if (event === 'error') {
+        // Same fallback reply the non-streaming endpoint gives when the model fails
+        console.error('Chatbot stream error:', payload.error);
+        result = { ok: true, response: payload.response, sessionId: payload.sessionId };
+      } else {
+        result = payload;
+      }
+    }
+  }
+  return result;
+}
+
 export default function Chatbot({ affectedRegions = [] }) {
   const [isOpen, setIsOpen] = useState(false);
   const [messages, setMessages] = useState([
@@ -13,6 +48,8 @@ export default function Chatbot({ affectedRegions = [] }) {
   const [isLoading, setIsLoading] = useState(false);
   const [isListening, setIsListening] = useState(false);
   const messagesEndRef = useRef(null);
+  // The server keeps the conversation (and a summary of older turns) under this id
+  const sessionIdRef = useRef(null);
   const recognitionRef = useRef(null);
 
   useEffect(() => {
@@ -75,15 +112,16 @@ export default function Chatbot({ affectedRegions = [] }) {
     setIsLoading(true);
 
     try {
-      const response = await fetch('/api/chatbot', {
+      const response = await fetch('/api/chatbot?stream=1', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
         },
         body: JSON.stringify({
           message: userMessage,
           affectedRegions: affectedRegions,
-          history: messages.slice(-10)
+          sessionId: sessionIdRef.current
         }),
       });
 
@@ -91,8 +129,16 @@ export default function Chatbot({ affectedRegions = [] }) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
+      const data = (response.headers.get('Content-Type') || '').includes('text/event-stream')
+        ? await readChatStream(response, (text) => {
+            setIsLoading(false);
+            setMessages([...newMessages, { role: 'assistant', content: text }]);
+          })
+        : await response.json();
       
+      if (data.sessionId) {
+        sessionIdRef.current = data.sessionId;
+      }
       if (data.ok && data.response) {
         setMessages([...newMessages, { role: 'assistant', content: data.response }]);
       } else {
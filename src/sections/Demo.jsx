@@ -5,6 +5,35 @@ import { auth } from '../config/firebase';
 import { dbService } from '../services/dbService';
 import BodyMapper3D from '../components/BodyMapper3D';
 
+// Reads /api/analyze's Server-Sent Events: calls onTriage with the provisional
+// rule-based result, resolves with the final `result` payload ({ ok, result })
+async function readAnalysisStream(response, onTriage) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let final = { ok: false, error: 'Stream ended unexpectedly' };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const raw of events) {
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = raw.match(/^data: (.*)$/m)?.[1];
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'triage') {
+        onTriage(payload.result);
+      } else {
+        final = payload;
+      }
+    }
+  }
+  return final;
+}
+
 export default function Demo() {
   const [description, setDescription] = React.useState('');
   const [healthParams, setHealthParams] = React.useState({
@@ -98,7 +127,8 @@ export default function Demo() {
         headers['Authorization'] = `Bearer ${token}`;
       }
       
-      const response = await fetch('/api/analyze', {
+      headers['Accept'] = 'text/event-stream';
+      const response = await fetch('/api/analyze?stream=1', {
         method: 'POST',
         headers,
         body: JSON.stringify({
@@ -108,7 +138,10 @@ export default function Demo() {
         })
       });
       
-      const data = await response.json();
+      // The triage result shows right away; the model's analysis replaces it
+      const data = response.headers.get('Content-Type')?.includes('text/event-stream')
+        ? await readAnalysisStream(response, setResult)
+        : await response.json();
       
       if (data.ok && data.result) {
         setResult(data.result);
@@ -185,7 +218,9 @@ export default function Demo() {
         body: JSON.stringify({
           description,
           affectedRegions: spots.map(s => s.bodyRegion),
-          healthParams
+          healthParams,
+          // Reuses the analysis shown above instead of asking the AI again (if the inputs are unchanged)
+          analysisId: result?.analysisId
         })
       });
       
@@ -412,6 +447,11 @@ export default function Demo() {
                 <div className="mt-1 font-semibold">{result.urgency}</div>
               </div>
             </div>
+            {result.provisional && (
+              <div className="text-sm opacity-70">
+                Preliminary result from your vital signs. The full AI analysis is loading...
+              </div>
+            )}
             {result.symptomExplanations && result.symptomExplanations.length > 0 && (
               <div className="rounded-xl border border-blue-300/40 dark:border-blue-700/40 bg-blue-50/60 dark:bg-blue-900/20 p-4">
                 <div className="text-sm opacity-70 mb-2">What Your Symptoms May Indicate</div>